@@ -0,0 +1,284 @@
+"""Incremental analysis of all trajectories of a simulation project.
+
+`mdsim-analyze` reads the ``simulation.trajectories`` config written by
+`mdsim-batch-config` and builds a task graph for the project directory:
+
+* ``sstructure/<trajectory>/<batch>`` and, for ibuprofen trajectories,
+  ``contacts/<trajectory>/<batch>`` analyze one batch DCD each and save
+  it as a shard, see `mdsim.shards`, in
+  ``<trajectory>/analysis/sstructure-<experiment><trajectory>.shards``
+  and ``<trajectory>/analysis/ibuContacts_<trajectory>.shards``.
+* ``sstructure/<trajectory>`` and ``contacts/<trajectory>`` write the
+  manifests of the leading finished batches, after which the shard
+  directories can be read by `mdsim-stride-stats`.
+* ``plot/<trajectory>`` runs `mdsim-plot` on ``analysis/prod_plot.yaml``
+  once the logs of all batches exist, unless ``--no-plot`` is given.
+
+Tasks run on a process pool as soon as the tasks they depend on are
+done. The inputs of every finished task are recorded in a JSON state
+file by size and modification time, or by content hash with ``--hash``,
+and a task is skipped while its inputs are unchanged and its outputs
+exist. A failed task only stops the tasks depending on it.
+
+"""
+import argparse
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import contextlib
+import io
+import os
+from pathlib import Path
+import sys
+
+import yaml
+
+from mdsim.filestate import file_key, load_state, save_state
+from mdsim.shards import MANIFEST, shard_path, write_manifest, write_shard
+
+
+STATE_FILE = '.mdsim-analyze.json'
+PSF_FILES = {
+    'ibu': 'abf_solv_ions.psf',
+    'water': 'abf_solv.psf',
+}
+CONTACT_EXPERIMENTS = ('ibu',)
+
+
+Task = namedtuple(
+    'Task', ['name', 'function', 'args', 'inputs', 'outputs', 'deps'])
+Task.__doc__ = """A unit of analysis work.
+
+``function(*args)`` is run in a worker process and writes ``outputs``.
+``inputs`` are the files it reads and ``deps`` the names of the tasks
+that must finish first.
+"""
+
+
+def input_keys(task, content_hash=False):
+    return dict((str(path), file_key(path, content_hash))
+                for path in task.inputs)
+
+
+def is_up_to_date(task, keys, state):
+    """Return True when a task ran on the same inputs and its outputs exist."""
+    record = state.get(task.name)
+    if record is None or record.get('inputs') != keys:
+        return False
+    return all(Path(path).exists() for path in task.outputs)
+
+
+def run_sstructure(psf_path, dcd_path, shard_dir, batch):
+    from mdsim.sstructure import compute_structures
+    codes = compute_structures(psf_path, [dcd_path], jobs=1)
+    write_shard(shard_dir, batch, codes, update_manifest=False)
+
+
+def run_contacts(psf_path, dcd_path, shard_dir, batch):
+    from mdsim.contacts import compute_contacts
+    contacts = compute_contacts(psf_path, [dcd_path], jobs=1)
+    write_shard(shard_dir, batch, contacts, update_manifest=False)
+
+
+def run_plot(config_path):
+    from mdsim import plot_stats
+    with contextlib.redirect_stdout(io.StringIO()):
+        plot_stats.main(['mdsim-plot', '--config', str(config_path)])
+
+
+def _batch_task(name, function, psf_path, dcd_path, shard_dir, batch):
+    return Task(name, function, (psf_path, dcd_path, shard_dir, batch),
+                [psf_path, dcd_path], [shard_path(shard_dir, batch)], [])
+
+
+def _manifest_task(name, batch_tasks, shard_dir):
+    batches = [task.args[-1] for task in batch_tasks]
+    shards = [task.outputs[0] for task in batch_tasks]
+    return Task(name, write_manifest, (shard_dir, batches), shards,
+                [shard_dir / MANIFEST], [task.name for task in batch_tasks])
+
+
+def trajectory_tasks(project_dir, trajectory, plot=True):
+    """Return the tasks for one trajectory of a simulation config.
+
+    Batch tasks are only made for batches whose DCD file exists, and
+    the plot task, with ``plot``, once every batch log exists.
+    """
+    name = str(trajectory['trajectory'])
+    experiment = trajectory['experiment']
+    trajectory_dir = Path(project_dir) / name
+    analysis_dir = trajectory_dir / 'analysis'
+    structure_dir = analysis_dir / f'sstructure-{experiment}{name}.shards'
+    contact_dir = analysis_dir / f'ibuContacts_{name}.shards'
+    psf_path = trajectory_dir / PSF_FILES.get(experiment, 'abf_solv.psf')
+    batches = [str(batch['batch']) for batch in trajectory['batches']]
+
+    tasks = []
+    structures = []
+    contacts = []
+    for batch in batches:
+        dcd_path = trajectory_dir / 'output' / f'abf_quench{batch}.dcd'
+        if not dcd_path.exists():
+            break
+        structures.append(_batch_task(
+            f'sstructure/{name}/{batch}', run_sstructure, psf_path,
+            dcd_path, structure_dir, batch))
+        if experiment in CONTACT_EXPERIMENTS:
+            contacts.append(_batch_task(
+                f'contacts/{name}/{batch}', run_contacts, psf_path,
+                dcd_path, contact_dir, batch))
+    tasks.extend(structures)
+    tasks.extend(contacts)
+    if structures:
+        tasks.append(_manifest_task(
+            f'sstructure/{name}', structures, structure_dir))
+    if contacts:
+        tasks.append(_manifest_task(
+            f'contacts/{name}', contacts, contact_dir))
+
+    config_path = analysis_dir / 'prod_plot.yaml'
+    logs = [trajectory_dir / 'output' / f'abf_quench{batch}.out'
+            for batch in batches]
+    if (plot and config_path.exists()
+            and all(log.exists() for log in logs)):
+        tasks.append(Task(
+            f'plot/{name}', run_plot, (config_path,), [config_path] + logs,
+            [analysis_dir / f'{experiment}{name}-prod.png'], []))
+    return tasks
+
+
+def build_tasks(project_dir, sim_config, trajectories=None, plot=True):
+    """Return the tasks for all, or the named, trajectories."""
+    tasks = []
+    for trajectory in sim_config['simulation']['trajectories']:
+        if trajectories and str(trajectory['trajectory']) not in trajectories:
+            continue
+        tasks.extend(trajectory_tasks(project_dir, trajectory, plot))
+    return tasks
+
+
+def run_tasks(tasks, state, jobs=1, force=False, content_hash=False,
+              state_path=None):
+    """Run tasks in dependency order and return ``{name: status}``.
+
+    The status is ``'ran'``, ``'skipped'`` when up to date, ``'failed'``
+    or ``'blocked'`` when a dependency failed. ``state`` is updated as
+    tasks finish and saved to ``state_path`` after each one.
+    """
+    pending = dict((task.name, task) for task in tasks)
+    status = {}
+    running = {}
+
+    def finish(task, result, keys=None):
+        status[task.name] = result
+        if result == 'ran':
+            state[task.name] = {'inputs': keys}
+            if state_path is not None:
+                save_state(state_path, state)
+        print(f'{result:<8} {task.name}', flush=True)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            progress = True
+            while progress:
+                progress = False
+                for task in list(pending.values()):
+                    if any(status.get(dep) in ('failed', 'blocked')
+                           for dep in task.deps):
+                        del pending[task.name]
+                        finish(task, 'blocked')
+                        progress = True
+                        continue
+                    if not all(dep in status for dep in task.deps):
+                        continue
+                    del pending[task.name]
+                    progress = True
+                    keys = input_keys(task, content_hash)
+                    if not force and is_up_to_date(task, keys, state):
+                        finish(task, 'skipped')
+                        continue
+                    future = executor.submit(task.function, *task.args)
+                    running[future] = (task, keys)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in [f for f in running if f in done]:
+                task, keys = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    finish(task, 'ran', keys)
+                else:
+                    state.pop(task.name, None)
+                    finish(task, 'failed')
+                    print(f'    {type(error).__name__}: {error}', flush=True)
+    return status
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    arg_map = {
+        '--config': {
+            'dest': 'config',
+            'help': 'The simulation config from mdsim-batch-config',
+            'required': True,
+        },
+        '--project-dir': {
+            'dest': 'project_dir',
+            'help': 'The directory holding the trajectory directories',
+            'default': '.',
+        },
+        '--trajectories': {
+            'dest': 'trajectories',
+            'help': 'Only analyze these trajectories',
+            'nargs': '+',
+        },
+        '--jobs': {
+            'dest': 'jobs',
+            'help': 'The number of worker processes',
+            'type': int,
+            'default': os.cpu_count(),
+        },
+        '--state': {
+            'dest': 'state',
+            'help': f'The state file (default: PROJECT_DIR/{STATE_FILE})',
+        },
+        '--hash': {
+            'dest': 'content_hash',
+            'help': 'Compare inputs by content hash instead of mtime',
+            'action': 'store_true',
+        },
+        '--force': {
+            'dest': 'force',
+            'help': 'Run all tasks even when up to date',
+            'action': 'store_true',
+        },
+        '--no-plot': {
+            'dest': 'plot',
+            'help': 'Skip the plot tasks',
+            'action': 'store_false',
+        },
+    }
+    for (arg, arg_opts) in arg_map.items():
+        parser.add_argument(arg, **arg_opts)
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    if argv is not None:
+        args = parser.parse_args(argv[1:])
+    else:
+        args = parser.parse_args()
+    with open(args.config) as f:
+        sim_config = yaml.load(f, yaml.Loader)
+    state_path = args.state or Path(args.project_dir) / STATE_FILE
+    state = load_state(state_path)
+    tasks = build_tasks(
+        args.project_dir, sim_config, args.trajectories, args.plot)
+    status = run_tasks(tasks, state, args.jobs, args.force,
+                       args.content_hash, state_path)
+    counts = dict((result, list(status.values()).count(result))
+                  for result in ('ran', 'skipped', 'failed', 'blocked'))
+    print('Analysis complete: ' + ', '.join(
+        f'{count} {result}' for (result, count) in counts.items()))
+    if counts['failed'] or counts['blocked']:
+        sys.exit(1)
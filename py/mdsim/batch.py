@@ -1,11 +1,24 @@
 """Utilities to generate batch configurations for production simulations.
 
+Every batch runs ``numsteps`` steps, 2000000 unless sized otherwise.
+Given NAMD logs of earlier runs, `mdsim-batch-config` measures the
+throughput of each host and sizes the batches of its trajectories to
+take at most ``target_hours`` of wall clock time, keeping the length of
+the trajectory. Shorter batches lose less work when a job is preempted.
+
 """
 import argparse
+import glob
+import math
 
 import yaml
 
 
+DEFAULT_BATCH_STEPS = 2000000
+# restartfreq and dcdfreq of the NAMD templates; batches end on both.
+RESTART_FREQ = 10000
+
+
 def make_seed(student_id, trajectory_id, step_id):
     result = f'{student_id}'
     result += trajectory_name(trajectory_id)
@@ -21,7 +34,21 @@ def trajectory_name(trajectory_id):
     return f'{trajectory_id:02}'
 
 
-def make_batch_config(student_id, trajectory_id, step_id):
+def batch_lengths(total_steps, seconds_per_step, target_hours,
+                  multiple=RESTART_FREQ):
+    """Return the numsteps of batches fitting ``target_hours`` each.
+
+    The steps are split as evenly as possible into multiples of
+    ``multiple``, rounding ``total_steps`` up to one.
+    """
+    units = math.ceil(total_steps / multiple)
+    per_batch = int(target_hours * 3600 / seconds_per_step) // multiple
+    n_batches = math.ceil(units / max(per_batch, 1))
+    size, extra = divmod(units, n_batches)
+    return [(size + (i < extra)) * multiple for i in range(n_batches)]
+
+
+def make_batch_config(student_id, trajectory_id, step_id, numsteps=None):
     result = {}
     result['batch'] = step_name(step_id)
     result['seed'] = make_seed(student_id, trajectory_id, step_id)
@@ -30,35 +57,80 @@ def make_batch_config(student_id, trajectory_id, step_id):
         result['previous_batch'] = step_name(prev_id)
     else:
         result['previous_batch'] = None
+    if numsteps is not None:
+        result['numsteps'] = numsteps
 
     return result
 
 
 def make_trajectory_config(
-        student_id, trajectory_id, experiment, steps, template):
+        student_id, trajectory_id, experiment, steps, template,
+        lengths=None):
+    """Return the config of a trajectory of ``steps`` batches.
+
+    ``lengths``, if given, are the numsteps of each batch and replace
+    ``steps``.
+    """
+    if lengths is not None:
+        steps = len(lengths)
+    else:
+        lengths = [None] * steps
     result = {
         'trajectory': trajectory_name(trajectory_id),
         'experiment': experiment,
         'config_template': template,
     }
     batch_configs = [
-        make_batch_config(student_id, trajectory_id, i)
+        make_batch_config(student_id, trajectory_id, i, lengths[i])
         for i in range(steps)
     ]
     result['batches'] = batch_configs
     return result
 
 
-def make_simulation_config(student_id, trajectory_plan, steps):
-    tr_configs = [
-        make_trajectory_config(
-            student_id, tr_id, tr_info['experiment'], steps, tr_info['template']
-        )
-        for (tr_id, tr_info) in trajectory_plan.items()
-    ]
+def make_simulation_config(student_id, trajectory_plan, steps,
+                           host_throughput=None, target_hours=None,
+                           batch_steps=DEFAULT_BATCH_STEPS):
+    """Return the config of all trajectories of a plan.
+
+    With ``target_hours``, the ``steps * batch_steps`` steps of a
+    trajectory are resized into batches by the s/step of its ``host``
+    in ``host_throughput``, where trajectories without a host use the
+    ``None`` entry. Trajectories of unmeasured hosts keep ``steps``
+    batches.
+    """
+    host_throughput = host_throughput or {}
+    tr_configs = []
+    for (tr_id, tr_info) in trajectory_plan.items():
+        seconds_per_step = host_throughput.get(tr_info.get('host'))
+        lengths = None
+        if target_hours and seconds_per_step:
+            lengths = batch_lengths(
+                steps * batch_steps, seconds_per_step, target_hours)
+        tr_config = make_trajectory_config(
+            student_id, tr_id, tr_info['experiment'], steps,
+            tr_info['template'], lengths)
+        if tr_info.get('host') is not None:
+            tr_config['host'] = tr_info['host']
+        tr_configs.append(tr_config)
     return {'trajectories': tr_configs}
 
 
+def measure_hosts(host_logs):
+    """Return ``{host: (s/step, ns/day)}`` from ``{host: [log globs]}``."""
+    from mdsim.namdlog import read_timing, throughput
+    result = {}
+    for (host, patterns) in host_logs.items():
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        paths = sorted(path for pattern in patterns
+                       for path in glob.glob(str(pattern)))
+        if not paths:
+            raise ValueError(f'No NAMD logs found for host {host}')
+        result[host] = throughput([read_timing(path) for path in paths])
+    return result
+
+
 def save_yaml(file_name, sim_config):
     obj = {'simulation': sim_config}
     with open(file_name, 'w') as f:
@@ -78,6 +150,17 @@ def get_main_parser():
             'help': 'The output file',
             'required': True,
         },
+        '--logs': {
+            'dest': 'logs',
+            'help': ('NAMD logs measuring the throughput of trajectories '
+                     'without a host'),
+            'nargs': '+',
+        },
+        '--target-hours': {
+            'dest': 'target_hours',
+            'help': 'Size batches to take at most this wall clock time',
+            'type': float,
+        },
     }
     for (arg, arg_opts) in arg_map.items():
         parser.add_argument(arg, **arg_opts)
@@ -95,5 +178,20 @@ def main(argv=None):
         student_id = plan_obj['student_id']
         steps = plan_obj['steps']
         tr_plan = plan_obj['plan']
-        sim_config = make_simulation_config(student_id, tr_plan, steps)
-        save_yaml(args.out, sim_config)
+        host_logs = dict(plan_obj.get('hosts') or {})
+        target_hours = args.target_hours or plan_obj.get('target_hours')
+        batch_steps = plan_obj.get('batch_steps', DEFAULT_BATCH_STEPS)
+    if args.logs:
+        host_logs[None] = args.logs
+    measured = measure_hosts(host_logs) if target_hours else {}
+    for (host, (seconds_per_step, ns_per_day)) in measured.items():
+        lengths = batch_lengths(
+            steps * batch_steps, seconds_per_step, target_hours)
+        print(f'{host or "default"}: {seconds_per_step:.4f} s/step, '
+              f'{ns_per_day:.2f} ns/day, {len(lengths)} batches of '
+              f'up to {max(lengths)} steps')
+    sim_config = make_simulation_config(
+        student_id, tr_plan, steps,
+        dict((host, s) for (host, (s, _)) in measured.items()),
+        target_hours, batch_steps)
+    save_yaml(args.out, sim_config)
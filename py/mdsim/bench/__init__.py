@@ -0,0 +1,7 @@
+"""Benchmarks of the mdsim analysis tools on synthetic data.
+
+`mdsim.bench.synthetic` writes STRIDE, ibuContacts and NAMD log files of
+any size, and `mdsim.bench.suite` times the analysis functions and
+command line tools on them. Run the suite with ``mdsim-bench``.
+
+"""
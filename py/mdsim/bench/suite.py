@@ -0,0 +1,327 @@
+"""Timing of the mdsim analysis hot paths.
+
+Every benchmark runs in a fresh worker process, so its peak RSS is its
+own. Setup, such as loading inputs for the functions that take arrays,
+is not timed. The best of ``repeat`` calls is reported together with
+the throughput in frames and megabytes of input per second, and can be
+compared to a baseline saved by an earlier run.
+
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+import json
+import multiprocessing
+from pathlib import Path
+import resource
+import sys
+from tempfile import TemporaryDirectory
+import time
+
+from mdsim.bench.synthetic import write_dataset
+
+
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.2
+
+
+def _file_sizes(paths):
+    return sum(Path(path).stat().st_size for path in paths)
+
+
+def _close_figures():
+    import matplotlib.pyplot as plt
+    plt.close('all')
+
+
+def bench_process_files(dataset):
+    from mdsim.stride import process_files
+    paths = dataset['stride_files']
+    return (lambda: process_files(paths), dataset['frames'], paths)
+
+
+def bench_process_contact_files(dataset):
+    from mdsim.stride import process_contact_files
+    paths = dataset['contact_files']
+    return (lambda: process_contact_files(paths), dataset['contact_frames'],
+            paths)
+
+
+def bench_calculate_t_h(dataset):
+    import yaml
+    from mdsim.stride import calculate_t_h, process_files
+    _, _, helices_pcts = process_files(dataset['stride_files'])
+    with open(dataset['stride_config']) as f:
+        groups = yaml.load(f, yaml.Loader)['groups']
+    return (lambda: calculate_t_h(groups, helices_pcts), dataset['frames'],
+            [])
+
+
+def bench_plot_trajectory_helix_content(dataset):
+    from mdsim.stride import plot_trajectory_helix_content, process_file
+    path = dataset['stride_files'][0]
+    _, _, y_raw = process_file(path)
+    output_file = dataset['output_dir'] / 'bench-trajectory.png'
+
+    def run():
+        plot_trajectory_helix_content('ibu', 1, y_raw, output_file)
+    return (run, len(y_raw), [])
+
+
+def bench_plot_average_helix_all(dataset):
+    from mdsim.stride import plot_average_helix_all, process_files
+    _, _, helices_pcts = process_files(dataset['stride_files'])
+    output_file = dataset['output_dir'] / 'bench-all.png'
+    return (lambda: plot_average_helix_all(helices_pcts, output_file),
+            dataset['frames'], [])
+
+
+def bench_plot_production(dataset):
+    from mdsim.plot_stats import load_config, plot_production
+    config = load_config(dataset['plot_config'])
+    config.update(config_path=dataset['plot_config'], cache=False)
+    paths = dataset['log_files']
+    return (lambda: plot_production(config), dataset['log_rows'], paths)
+
+
+def bench_read_energies(dataset):
+    from mdsim.namdlog import read_energies
+    path = dataset['log_files'][0]
+    return (lambda: read_energies(path, cache=False),
+            dataset['log_rows'] // len(dataset['log_files']), [path])
+
+
+def bench_stride_stats_cli(dataset):
+    from mdsim import stride
+    argv = ['mdsim-stride-stats', '--config', str(dataset['stride_config']),
+            '--jobs', '1', '--no-cache']
+    paths = dataset['stride_files'] + dataset['contact_files']
+    return (lambda: stride.main(argv), dataset['frames'], paths)
+
+
+def bench_plot_cli(dataset):
+    from mdsim import plot_stats
+    argv = ['mdsim-plot', '--config', str(dataset['plot_config']),
+            '--no-cache']
+    return (lambda: plot_stats.main(argv), dataset['log_rows'],
+            dataset['log_files'])
+
+
+BENCHMARKS = {
+    'stride.process_files': bench_process_files,
+    'stride.process_contact_files': bench_process_contact_files,
+    'stride.calculate_t_h': bench_calculate_t_h,
+    'stride.plot_trajectory_helix_content':
+        bench_plot_trajectory_helix_content,
+    'stride.plot_average_helix_all': bench_plot_average_helix_all,
+    'namdlog.read_energies': bench_read_energies,
+    'plot_stats.plot_production': bench_plot_production,
+    'mdsim-stride-stats': bench_stride_stats_cli,
+    'mdsim-plot': bench_plot_cli,
+}
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def run_benchmark(name, dataset, repeat=DEFAULT_REPEAT):
+    """Run one benchmark in this process and return its result dict."""
+    import matplotlib
+    matplotlib.use('Agg')
+    function, n_frames, input_paths = BENCHMARKS[name](dataset)
+    n_bytes = _file_sizes(input_paths)
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+            _close_figures()
+    seconds = min(times)
+    return {
+        'seconds': seconds,
+        'frames_per_s': n_frames / seconds,
+        'mb_per_s': n_bytes / 2**20 / seconds,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_benchmarks(names, dataset, repeat=DEFAULT_REPEAT):
+    """Return results of the named benchmarks, each in a new process."""
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in names:
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=context) as executor:
+            results[name] = executor.submit(
+                run_benchmark, name, dataset, repeat).result()
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return ``{name: [messages]}`` for results worse than the baseline.
+
+    Time and peak RSS regress when they exceed the baseline by more than
+    the ``tolerance`` fraction.
+    """
+    regressions = {}
+    for (name, result) in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        messages = []
+        for (key, label) in (('seconds', 'time'), ('peak_rss_mb', 'RSS')):
+            ratio = result[key] / base[key]
+            if ratio > 1 + tolerance:
+                messages.append(f'{label} x{ratio:.2f}')
+        if messages:
+            regressions[name] = messages
+    return regressions
+
+
+def format_report(results, baseline=None, regressions=None):
+    """Return the results as a text table."""
+    baseline = baseline or {}
+    regressions = regressions or {}
+    width = max(len(name) for name in results) if results else 4
+    lines = [
+        f'{"benchmark":<{width}}  {"seconds":>9}  {"frames/s":>11}  '
+        f'{"MB/s":>8}  {"RSS MB":>8}  {"speedup":>9}'
+    ]
+    for (name, result) in results.items():
+        base = baseline.get(name)
+        speedup = (f'x{base["seconds"] / result["seconds"]:.2f}'
+                   if base else '-')
+        line = (
+            f'{name:<{width}}  {result["seconds"]:9.4f}  '
+            f'{result["frames_per_s"]:11.0f}  {result["mb_per_s"]:8.1f}  '
+            f'{result["peak_rss_mb"]:8.1f}  {speedup:>9}'
+        )
+        if name in regressions:
+            line += '  REGRESSION: ' + ', '.join(regressions[name])
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def load_baseline(file_path):
+    with open(file_path) as f:
+        return json.load(f)['results']
+
+
+def save_report(file_path, sizes, results):
+    with open(file_path, 'w') as f:
+        json.dump({'sizes': sizes, 'results': results}, f, indent=2)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    arg_map = {
+        '--trajectories': {
+            'dest': 'trajectories',
+            'help': 'The number of synthetic trajectories',
+            'type': int,
+            'default': 4,
+        },
+        '--frames': {
+            'dest': 'frames',
+            'help': 'The number of frames per trajectory',
+            'type': int,
+            'default': 20000,
+        },
+        '--residues': {
+            'dest': 'residues',
+            'help': 'The number of residues',
+            'type': int,
+            'default': 7,
+        },
+        '--log-rows': {
+            'dest': 'log_rows',
+            'help': 'The number of ENERGY lines per NAMD log batch',
+            'type': int,
+            'default': 20000,
+        },
+        '--batches': {
+            'dest': 'batches',
+            'help': 'The number of NAMD log batches',
+            'type': int,
+            'default': 2,
+        },
+        '--seed': {
+            'dest': 'seed',
+            'help': 'The random seed for the synthetic data',
+            'type': int,
+            'default': 0,
+        },
+        '--repeat': {
+            'dest': 'repeat',
+            'help': 'Calls per benchmark; the fastest is reported',
+            'type': int,
+            'default': DEFAULT_REPEAT,
+        },
+        '--only': {
+            'dest': 'only',
+            'help': 'Benchmarks to run',
+            'nargs': '+',
+            'choices': list(BENCHMARKS),
+        },
+        '--data-dir': {
+            'dest': 'data_dir',
+            'help': 'Where to write the synthetic data (default: temporary)',
+        },
+        '--baseline': {
+            'dest': 'baseline',
+            'help': 'A saved report to compare against',
+        },
+        '--tolerance': {
+            'dest': 'tolerance',
+            'help': 'The allowed slowdown or RSS growth as a fraction',
+            'type': float,
+            'default': DEFAULT_TOLERANCE,
+        },
+        '--out': {
+            'dest': 'out',
+            'help': 'Save the report as JSON, e.g. as the next baseline',
+        },
+    }
+    for (arg, arg_opts) in arg_map.items():
+        parser.add_argument(arg, **arg_opts)
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    if argv is not None:
+        args = parser.parse_args(argv[1:])
+    else:
+        args = parser.parse_args()
+    sizes = {
+        'trajectories': args.trajectories,
+        'frames': args.frames,
+        'residues': args.residues,
+        'log_rows': args.log_rows,
+        'batches': args.batches,
+        'seed': args.seed,
+    }
+    with contextlib.ExitStack() as stack:
+        data_dir = args.data_dir
+        if data_dir is None:
+            data_dir = stack.enter_context(
+                TemporaryDirectory(prefix='mdsim-bench-'))
+        dataset = write_dataset(
+            data_dir, args.trajectories, args.frames, args.residues,
+            args.log_rows, args.batches, args.seed)
+        results = run_benchmarks(
+            args.only or list(BENCHMARKS), dataset, args.repeat)
+    baseline = load_baseline(args.baseline) if args.baseline else {}
+    regressions = compare(results, baseline, args.tolerance)
+    print(format_report(results, baseline, regressions))
+    if args.out:
+        save_report(args.out, sizes, results)
+        print(f'Saved report: {args.out}')
+    if regressions:
+        sys.exit(1)
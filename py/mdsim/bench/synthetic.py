@@ -0,0 +1,172 @@
+"""Synthetic analysis inputs of any size.
+
+The files follow the layouts written by VMD/STRIDE, the ibuContacts
+script and NAMD, with helix content that dissolves at a random time in
+every trajectory, so the analysis has something to find.
+
+"""
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from mdsim.namdlog import DEFAULT_TITLES
+
+
+HELIX_LETTERS = np.frombuffer(b'HHHG', dtype=np.uint8)
+OTHER_LETTERS = np.frombuffer(b'TTCCCE', dtype=np.uint8)
+
+# Typical values and fluctuations of the ENERGY columns in the ABF
+# quench runs.
+ENERGY_MEANS = {
+    'BOND': 450.0, 'ANGLE': 620.0, 'DIHED': 180.0, 'IMPRP': 9.0,
+    'ELECT': -14980.0, 'VDW': 1810.0, 'KINETIC': 4030.0,
+    'TOTAL': -8460.0, 'TEMP': 329.0, 'POTENTIAL': -12490.0,
+    'TOTAL3': -8460.0, 'TEMPAVG': 329.0, 'VOLUME': 46656.0,
+}
+ENERGY_SCALES = {
+    'BOND': 8.0, 'ANGLE': 8.0, 'DIHED': 3.0, 'IMPRP': 1.0, 'ELECT': 50.0,
+    'VDW': 20.0, 'KINETIC': 20.0, 'TOTAL': 40.0, 'TEMP': 2.0,
+    'POTENTIAL': 30.0, 'TOTAL3': 40.0, 'TEMPAVG': 2.0, 'PRESSURE': 100.0,
+    'GPRESSURE': 100.0, 'PRESSAVG': 20.0, 'GPRESSAVG': 20.0,
+}
+
+
+def _write_letter_rows(file_path, letters):
+    """Write a uint8 matrix as rows of single-space separated letters."""
+    n_frames, n_columns = letters.shape
+    buf = np.full((n_frames, 2 * n_columns), ord(' '), dtype=np.uint8)
+    buf[:, 0::2] = letters
+    buf[:, -1] = ord('\n')
+    with open(file_path, 'wb') as f:
+        f.write(buf.tobytes())
+
+
+def write_stride_file(file_path, n_frames, n_residues, rng):
+    """Write STRIDE data and return the frame the helix dissolves at."""
+    t_h = int(rng.integers(n_frames // 5, max(n_frames * 4 // 5, 1) + 1))
+    p_helix = np.where(np.arange(n_frames) < t_h, 0.85, 0.15)
+    helix = rng.random((n_frames, n_residues)) < p_helix[:, np.newaxis]
+    letters = np.where(
+        helix,
+        rng.choice(HELIX_LETTERS, (n_frames, n_residues)),
+        rng.choice(OTHER_LETTERS, (n_frames, n_residues)),
+    )
+    _write_letter_rows(file_path, letters)
+    return t_h
+
+
+def write_contact_file(file_path, n_frames, n_residues, rng):
+    """Write ibuContacts data with Poisson counts per residue."""
+    rates = rng.uniform(0.2, 1.5, n_residues)
+    counts = np.minimum(rng.poisson(rates, (n_frames, n_residues)), 9)
+    _write_letter_rows(file_path, (counts + ord('0')).astype(np.uint8))
+
+
+def write_namd_log(file_path, n_rows, rng, first_ts=0, output_energies=1000,
+                   title_every=10):
+    """Write a NAMD log with ``n_rows`` ENERGY lines.
+
+    ETITLE lines are repeated every ``title_every`` rows and a TIMING
+    line follows every ENERGY line, as in NAMD output.
+    """
+    titles = DEFAULT_TITLES
+    values = np.empty((n_rows, len(titles) - 1))
+    for (i, title) in enumerate(titles[1:]):
+        mean = ENERGY_MEANS.get(title, 0.0)
+        scale = ENERGY_SCALES.get(title, 0.0)
+        values[:, i] = mean + scale * rng.standard_normal(n_rows)
+    ts = first_ts + output_energies * np.arange(n_rows)
+    title_line = 'ETITLE:' + ''.join(f' {title:>14}' for title in titles)
+    row_format = 'ENERGY: %7d' + ' %14.4f' * (len(titles) - 1) + '\n'
+    with open(file_path, 'w') as f:
+        f.write('Info: NAMD 2.14 for Linux-x86_64-multicore\n')
+        n_steps = int(ts[-1]) - first_ts if n_rows else 0
+        f.write(f'Info: NUMBER OF STEPS        {n_steps}\n')
+        f.write('Info: Benchmark time: 16 CPUs 0.0175 s/step '
+                '0.202546 days/ns 513.1 MB memory\n')
+        for i in range(n_rows):
+            if i % title_every == 0:
+                f.write(title_line + '\n\n')
+            f.write(row_format % (ts[i], *values[i]))
+            f.write('\n')
+            wall = 0.0175 * (ts[i] - first_ts)
+            f.write(f'TIMING: {ts[i]}  CPU: {wall:.4f}, 0.017325/step  '
+                    f'Wall: {wall:.4f}, 0.017500/step, 0.0 hours '
+                    'remaining, 513.1 MB of memory in use.\n')
+        f.write('WallClock: 178.200000  CPUTime: 176.350000  '
+                'Memory: 513.148438 MB\n')
+
+
+def write_dataset(directory, n_trajectories=4, n_frames=10000, n_residues=7,
+                  log_rows=10000, n_batches=2, seed=0):
+    """Write a synthetic experiment and the configs to analyze it.
+
+    Half the trajectories form the ``ibu`` group, which also gets
+    contact files, and the rest the ``water`` group. Every batch log
+    restarts TS at zero, like the quench batches. Returns a dict of the
+    written paths and the total frame and ENERGY row counts.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    n_ibu = max(n_trajectories // 2, 1)
+    stride_files = []
+    contact_files = []
+    for i in range(n_trajectories):
+        group = 'ibu' if i < n_ibu else 'water'
+        stride_file = directory / f'sstructure-{group}{i + 1}.dat'
+        write_stride_file(stride_file, n_frames, n_residues, rng)
+        stride_files.append(stride_file)
+        if group == 'ibu':
+            contact_file = directory / f'ibuContacts-ibu{i + 1}.dat'
+            write_contact_file(contact_file, n_frames, n_residues, rng)
+            contact_files.append(contact_file)
+    log_files = []
+    for batch in range(n_batches):
+        log_file = directory / f'abf_quench{batch:02d}.out'
+        write_namd_log(log_file, log_rows, rng)
+        log_files.append(log_file)
+
+    output_dir = directory / 'output'
+    output_dir.mkdir(exist_ok=True)
+    stride_config = directory / 'stride.yaml'
+    with open(stride_config, 'w') as f:
+        yaml.dump({
+            'stride_files': [path.name for path in stride_files],
+            'ibuContact_files': [path.name for path in contact_files],
+            'output_dir': str(output_dir),
+            'groups': [
+                {
+                    'name': 'ibu',
+                    'cols': list(range(n_ibu)),
+                    'trajectories': list(range(1, n_ibu + 1)),
+                },
+                {
+                    'name': 'water',
+                    'cols': list(range(n_ibu, n_trajectories)),
+                    'trajectories': list(range(n_ibu + 1,
+                                               n_trajectories + 1)),
+                },
+            ],
+        }, f)
+    plot_config = directory / 'plot.yaml'
+    with open(plot_config, 'w') as f:
+        yaml.dump({
+            'quench': {
+                'input': [path.name for path in log_files],
+                'output': 'output/quench.png',
+            },
+        }, f)
+    return {
+        'directory': directory,
+        'stride_files': stride_files,
+        'contact_files': contact_files,
+        'log_files': log_files,
+        'output_dir': output_dir,
+        'stride_config': stride_config,
+        'plot_config': plot_config,
+        'frames': n_trajectories * n_frames,
+        'contact_frames': len(contact_files) * n_frames,
+        'log_rows': n_batches * log_rows,
+    }
@@ -0,0 +1,160 @@
+"""Persistent cache of analysis results.
+
+Unlike a sidecar, see `mdsim.sidecar`, which keeps the arrays parsed
+from one file next to it, the cache keeps the results of a computation
+over many input files in one cache directory. An entry is addressed by
+the SHA-256 digest of the computation's name, its parameters and the
+keys of its input files: size and mtime, or content hashes with
+``content_hash``, see `mdsim.filestate.file_key`. A shard directory is
+keyed by all of its files.
+
+Each entry is a directory of ``.npy`` files, one per array; a
+RaggedArray is stored as its data and offsets. Loading an entry marks it
+as used, and once the cache grows beyond ``max_bytes`` the least
+recently used entries are removed.
+
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+
+import numpy as np
+
+from mdsim.filestate import file_key
+from mdsim.ragged import RaggedArray
+
+
+CACHE_DIR = '.mdsim-cache'
+DEFAULT_MAX_BYTES = 2**30
+RAGGED_FIELDS = ('data', 'offsets')
+
+
+def input_key(file_path, content_hash=False):
+    """Return the key of a file, or of all files in a directory."""
+    path = Path(file_path)
+    if not path.is_dir():
+        return file_key(path, content_hash)
+    return [[str(child.relative_to(path)), file_key(child, content_hash)]
+            for child in sorted(path.rglob('*')) if child.is_file()]
+
+
+class Cache:
+    """A directory of cached analysis results with a size limit."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES,
+                 content_hash=False):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.content_hash = content_hash
+
+    def key(self, name, input_paths, params=None):
+        """Return the address of a computation on input files."""
+        description = {
+            'name': name,
+            'inputs': [[str(Path(path).resolve()),
+                        input_key(path, self.content_hash)]
+                       for path in input_paths],
+            'params': params,
+        }
+        text = json.dumps(description, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def entry_path(self, key):
+        return self.directory / key
+
+    def load(self, key):
+        """Return the arrays of an entry, or None when missing."""
+        entry = self.entry_path(key)
+        try:
+            files = sorted(entry.glob('*.npy'))
+            if not files:
+                return None
+            arrays = {}
+            for path in files:
+                name, _, field = path.stem.partition('.')
+                value = np.load(path, allow_pickle=False)
+                if field:
+                    arrays.setdefault(name, {})[field] = value
+                else:
+                    arrays[name] = value[()] if value.ndim == 0 else value
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+        for (name, value) in arrays.items():
+            if isinstance(value, dict):
+                arrays[name] = RaggedArray(**value)
+        return arrays
+
+    def save(self, key, arrays):
+        """Store arrays as an entry. Unwritable caches are skipped."""
+        entry = self.entry_path(key)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_dir = Path(tempfile.mkdtemp(prefix=key, dir=self.directory))
+        except OSError:
+            return None
+        try:
+            for (name, value) in arrays.items():
+                if isinstance(value, RaggedArray):
+                    for field in RAGGED_FIELDS:
+                        np.save(tmp_dir / f'{name}.{field}.npy',
+                                getattr(value, field))
+                else:
+                    np.save(tmp_dir / f'{name}.npy', np.asarray(value))
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp_dir, entry)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return None
+        self.evict()
+        return entry
+
+    def entries(self):
+        """Return ``(last use, bytes, path)`` of every entry, oldest first."""
+        result = []
+        try:
+            paths = list(self.directory.iterdir())
+        except OSError:
+            return result
+        for path in paths:
+            try:
+                size = sum(child.stat().st_size for child in path.iterdir())
+                result.append((path.stat().st_mtime_ns, size, path))
+            except OSError:
+                continue
+        return sorted(result)
+
+    def size(self):
+        return sum(size for (_, size, _) in self.entries())
+
+    def evict(self):
+        """Remove least recently used entries until within ``max_bytes``."""
+        entries = self.entries()
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def cached(cache, name, input_paths, params, function):
+    """Return the arrays of ``function()``, from the cache when it has them.
+
+    ``function`` returns a dict of arrays, RaggedArrays and numbers.
+    Without a cache it is always called.
+    """
+    if cache is None:
+        return function()
+    key = cache.key(name, input_paths, params)
+    arrays = cache.load(key)
+    if arrays is None:
+        arrays = function()
+        cache.save(key, arrays)
+    return arrays
@@ -0,0 +1,71 @@
+"""Total charge of a PSF topology, without starting VMD.
+
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from mdsim.psf import read_psf
+
+
+DEFAULT_TOLERANCE = 1e-3
+
+
+def segment_charges(psf, selection='all'):
+    """Return ``(segids, charges)`` summed per segment of a selection."""
+    mask = psf.select(selection)
+    segids, segments = np.unique(psf.segid[mask], return_inverse=True)
+    charges = np.bincount(
+        segments, weights=psf.charge[mask], minlength=len(segids))
+    return (segids, charges)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    arg_map = {
+        'psf': {
+            'help': 'The PSF topology file',
+        },
+        '--selection': {
+            'dest': 'selection',
+            'help': 'The atoms to sum charges over',
+            'default': 'all',
+        },
+        '--segments': {
+            'dest': 'segments',
+            'help': 'Also print the charge of every segment',
+            'action': 'store_true',
+        },
+        '--expect': {
+            'dest': 'expect',
+            'help': 'Fail unless the total charge is this value',
+            'type': float,
+        },
+        '--tolerance': {
+            'dest': 'tolerance',
+            'help': 'The allowed deviation from --expect',
+            'type': float,
+            'default': DEFAULT_TOLERANCE,
+        },
+    }
+    for (arg, arg_opts) in arg_map.items():
+        parser.add_argument(arg, **arg_opts)
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    if argv is not None:
+        args = parser.parse_args(argv[1:])
+    else:
+        args = parser.parse_args()
+    psf = read_psf(args.psf)
+    if args.segments:
+        for (segid, charge) in zip(*segment_charges(psf, args.selection)):
+            print(f'{segid:<8} {charge:9.4f}')
+    total = psf.total_charge(args.selection)
+    print(f'TOTAL CHARGE: {total:.4f}')
+    if args.expect is not None and abs(total - args.expect) > args.tolerance:
+        print(f'ERROR: Expected a total charge of {args.expect:.4f}')
+        sys.exit(1)
@@ -1,29 +1,34 @@
 #!/usr/bin/env python
-from functools import partial
 import sys
 
+import numpy as np
 
-def validate_atom_line(max_dist, line):
-    fields = line.split()
-    coords = map(float, fields[6:9])
-    return all(abs(v) <= max_dist for v in coords)
+from mdsim.pdb import read_pdb
 
 
-def get_atom_validator(max_dist):
-    return partial(validate_atom_line, max_dist)
+def invalid_atoms(coordinates, max_dist):
+    """Return indices of atoms with a coordinate beyond ``max_dist``."""
+    return np.flatnonzero(np.abs(coordinates).max(axis=1) > max_dist)
 
 
-def main():
-    (_, filename, max_dist) = sys.argv
-    max_dist = float(max_dist)
-    is_valid_atom = get_atom_validator(max_dist)
+def read_line(filename, lineno):
     with open(filename) as f:
-        for (lineno, line) in enumerate(f.readlines()):
-            if line.startswith('ATOM') and not is_valid_atom(line):
-                print('ERROR: Invalid atom at line ', lineno + 1)
-                print(line.rstrip())
-                sys.exit(1)
-        print('All good!')
+        for (i, line) in enumerate(f):
+            if i == lineno:
+                return line
+
+
+def main(argv=None):
+    (_, filename, max_dist) = argv if argv is not None else sys.argv
+    max_dist = float(max_dist)
+    pdb = read_pdb(filename)
+    invalid = invalid_atoms(pdb.coordinates, max_dist)
+    if len(invalid):
+        lineno = pdb.lineno[invalid[0]]
+        print('ERROR: Invalid atom at line ', lineno + 1)
+        print(read_line(filename, lineno).rstrip())
+        sys.exit(1)
+    print('All good!')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,195 @@
+"""Residue-ligand contact counts computed directly from PSF/DCD files.
+
+For every frame and protein residue, this counts the ligand molecules
+with at least one heavy atom within the cutoff distance of any heavy
+atom of the residue. The output has one line per frame with one count
+per protein residue, the format read by
+`mdsim.stride.process_contact_file`.
+
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from mdsim.dcd import frame_windows, open_dcd
+from mdsim.psf import read_psf
+
+
+DEFAULT_CUTOFF = 4.5
+DEFAULT_LIGAND = 'IBU2'
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def contact_groups(psf, ligand_resname=DEFAULT_LIGAND):
+    """Return heavy atom indices and group numbers for protein and ligand.
+
+    The result is ``(protein_atoms, protein_groups, n_residues,
+    ligand_atoms, ligand_groups, n_ligands)``, where the group arrays
+    number the residues of each selected atom from zero.
+    """
+    protein_atoms = psf.indices('protein and noh')
+    ligand_atoms = psf.indices(f'resname {ligand_resname} and noh')
+    _, protein_groups = np.unique(
+        psf.residue[protein_atoms], return_inverse=True)
+    _, ligand_groups = np.unique(
+        psf.residue[ligand_atoms], return_inverse=True)
+    n_residues = len(np.unique(psf.residue[psf.select('protein')]))
+    n_ligands = len(np.unique(
+        psf.residue[psf.select(f'resname {ligand_resname}')]))
+    return (protein_atoms, protein_groups, n_residues,
+            ligand_atoms, ligand_groups, n_ligands)
+
+
+def periodic_box(unitcell):
+    """Return the orthorhombic box lengths of a unit cell, or None."""
+    if unitcell is None or not np.all(unitcell[:3] > 0):
+        return None
+    if not np.allclose(unitcell[3:], 90.0):
+        raise ValueError('Only orthorhombic unit cells are supported')
+    return np.asarray(unitcell[:3], dtype=np.float64)
+
+
+def _wrap(xyz, box):
+    xyz = np.mod(xyz, box)
+    # Rounding can land a coordinate exactly on the box edge.
+    xyz[xyz >= box] = 0.0
+    return xyz
+
+
+def frame_contacts(protein_xyz, protein_groups, n_residues,
+                   ligand_xyz, ligand_groups, n_ligands,
+                   cutoff=DEFAULT_CUTOFF, box=None):
+    """Return ligand contact counts per residue for a single frame.
+
+    With an orthorhombic ``box`` distances use the minimum image
+    convention.
+    """
+    protein_xyz = np.asarray(protein_xyz, dtype=np.float64)
+    ligand_xyz = np.asarray(ligand_xyz, dtype=np.float64)
+    if box is not None:
+        protein_xyz = _wrap(protein_xyz, box)
+        ligand_xyz = _wrap(ligand_xyz, box)
+    protein_tree = cKDTree(protein_xyz, boxsize=box)
+    ligand_tree = cKDTree(ligand_xyz, boxsize=box)
+    pairs = protein_tree.sparse_distance_matrix(
+        ligand_tree, cutoff, output_type='ndarray')
+    pairs = pairs[pairs['v'] < cutoff]
+    residue_ligand = np.unique(
+        protein_groups[pairs['i']] * n_ligands + ligand_groups[pairs['j']])
+    return np.bincount(residue_ligand // n_ligands, minlength=n_residues)
+
+
+def trajectory_contacts(coordinates, unitcells, groups,
+                        cutoff=DEFAULT_CUTOFF):
+    """Return an ``(n_frames, n_residues)`` array of contact counts."""
+    (protein_atoms, protein_groups, n_residues,
+     ligand_atoms, ligand_groups, n_ligands) = groups
+    result = np.zeros((len(coordinates), n_residues), dtype=np.uint)
+    if n_ligands == 0:
+        return result
+    for (i, xyz) in enumerate(coordinates):
+        box = periodic_box(unitcells[i]) if unitcells is not None else None
+        result[i] = frame_contacts(
+            xyz[protein_atoms], protein_groups, n_residues,
+            xyz[ligand_atoms], ligand_groups, n_ligands,
+            cutoff, box,
+        )
+    return result
+
+
+def _contacts_task(dcd_path, start, stop, groups, cutoff):
+    dcd = open_dcd(dcd_path)
+    window = slice(start, stop)
+    return trajectory_contacts(
+        dcd[window], dcd.unitcell(window), groups, cutoff)
+
+
+def compute_contacts(psf_path, dcd_paths, cutoff=DEFAULT_CUTOFF,
+                     ligand_resname=DEFAULT_LIGAND, jobs=1,
+                     chunk_size=DEFAULT_CHUNK_SIZE):
+    """Return contact counts for DCD files concatenated in order.
+
+    Frame windows are distributed across ``jobs`` worker processes.
+    """
+    groups = contact_groups(read_psf(psf_path), ligand_resname)
+    tasks = frame_windows(dcd_paths, chunk_size)
+    args = [(path, start, stop, groups, cutoff)
+            for (path, start, stop) in tasks]
+    if jobs == 1 or len(tasks) <= 1:
+        results = [_contacts_task(*task_args) for task_args in args]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_contacts_task, *zip(*args)))
+    if not results:
+        return np.zeros((0, groups[2]), dtype=np.uint)
+    return np.concatenate(results)
+
+
+def save_contacts(file_path, contacts):
+    """Write contact counts with one line per frame."""
+    np.savetxt(file_path, contacts, fmt='%d')
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    arg_map = {
+        '--psf': {
+            'dest': 'psf',
+            'help': 'The PSF topology file',
+            'required': True,
+        },
+        '--dcd': {
+            'dest': 'dcd',
+            'help': 'DCD trajectory files, in order',
+            'nargs': '+',
+            'required': True,
+        },
+        '--out': {
+            'dest': 'out',
+            'help': 'The output file',
+            'required': True,
+        },
+        '--cutoff': {
+            'dest': 'cutoff',
+            'help': 'The contact distance cutoff in Angstroms',
+            'type': float,
+            'default': DEFAULT_CUTOFF,
+        },
+        '--ligand': {
+            'dest': 'ligand',
+            'help': 'The ligand residue name',
+            'default': DEFAULT_LIGAND,
+        },
+        '--jobs': {
+            'dest': 'jobs',
+            'help': 'The number of worker processes',
+            'type': int,
+            'default': os.cpu_count(),
+        },
+        '--chunk-size': {
+            'dest': 'chunk_size',
+            'help': 'The number of frames per work unit',
+            'type': int,
+            'default': DEFAULT_CHUNK_SIZE,
+        },
+    }
+    for (arg, arg_opts) in arg_map.items():
+        parser.add_argument(arg, **arg_opts)
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    if argv is not None:
+        args = parser.parse_args(argv[1:])
+    else:
+        args = parser.parse_args()
+    contacts = compute_contacts(
+        args.psf, args.dcd, args.cutoff, args.ligand, args.jobs,
+        args.chunk_size,
+    )
+    save_contacts(args.out, contacts)
+    print(f'Saved contacts for {len(contacts)} frames: {args.out}')
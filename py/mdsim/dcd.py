@@ -0,0 +1,280 @@
+"""Memory-mapped access to NAMD DCD trajectories.
+
+DCD files are Fortran unformatted files. After the header, every frame
+holds an optional unit cell record followed by separate X, Y and Z
+records, each wrapped in 4-byte record markers. Rather than loading
+frames, the file is memory-mapped and each frame is exposed as a strided
+``(n_atoms, 3)`` float32 view into the mapping, so reading a frame
+touches only the pages it lives on.
+
+"""
+from collections import namedtuple
+from pathlib import Path
+import struct
+
+import numpy as np
+
+
+# One AKMA time unit in femtoseconds. DCD headers store the timestep
+# in AKMA units.
+AKMA_FS = 48.88821
+
+HEADER_SIZE = 84
+UNITCELL_SIZE = 48
+
+
+Chunk = namedtuple('Chunk', ['frames', 'coordinates', 'unitcell'])
+Chunk.__doc__ = """A block of consecutive trajectory frames.
+
+``frames`` holds the frame indices, ``coordinates`` an
+``(n_frames, n_atoms, 3)`` array and ``unitcell`` an ``(n_frames, 6)``
+array of ``(a, b, c, alpha, beta, gamma)`` or None.
+"""
+
+
+def _detect_endian(marker):
+    for endian in ('<', '>'):
+        if struct.unpack(endian + 'i', marker)[0] == HEADER_SIZE:
+            return endian
+    raise ValueError('Not a DCD file: bad header record marker')
+
+
+def _read_record(f, endian):
+    (size,) = struct.unpack(endian + 'i', f.read(4))
+    data = f.read(size)
+    (tail,) = struct.unpack(endian + 'i', f.read(4))
+    if len(data) != size or tail != size:
+        raise ValueError('Corrupt DCD header record')
+    return data
+
+
+def read_header(f):
+    """Return the header fields of an open DCD file.
+
+    The file position is left at the start of the first frame.
+    """
+    marker = f.read(4)
+    endian = _detect_endian(marker)
+    f.seek(0)
+    data = _read_record(f, endian)
+    if data[:4] != b'CORD':
+        raise ValueError('Not a DCD coordinate file')
+    icntrl = struct.unpack(endian + '9if10i', data[4:])
+    titles_data = _read_record(f, endian)
+    (n_titles,) = struct.unpack(endian + 'i', titles_data[:4])
+    titles = [
+        titles_data[4 + 80 * i:4 + 80 * (i + 1)].decode('ascii', 'replace')
+        .rstrip('\x00 ')
+        for i in range(n_titles)
+    ]
+    (n_atoms,) = struct.unpack(endian + 'i', _read_record(f, endian))
+    if icntrl[8]:
+        raise ValueError('DCD files with fixed atoms are not supported')
+    if icntrl[11]:
+        raise ValueError('4D DCD files are not supported')
+    return {
+        'endian': endian,
+        'n_sets': icntrl[0],
+        'istart': icntrl[1],
+        'nsavc': icntrl[2],
+        'delta': icntrl[9],
+        'has_unitcell': bool(icntrl[10]),
+        'charmm_version': icntrl[19],
+        'titles': titles,
+        'n_atoms': n_atoms,
+        'header_size': f.tell(),
+    }
+
+
+def convert_unitcell(raw):
+    """Convert raw DCD unit cell records to ``(a, b, c, alpha, beta, gamma)``.
+
+    DCD stores ``(a, gamma, b, beta, alpha, c)``. NAMD writes the angles
+    as cosines, older CHARMM files as degrees; cosines are detected and
+    converted to degrees.
+    """
+    raw = np.asarray(raw, dtype=np.float64)
+    lengths = raw[..., [0, 2, 5]]
+    angles = raw[..., [4, 3, 1]]
+    if np.all(np.abs(angles) <= 1.0):
+        angles = np.degrees(np.arccos(angles))
+    return np.concatenate((lengths, angles), axis=-1)
+
+
+class DCDFile:
+    """A memory-mapped DCD trajectory.
+
+    ``coordinates`` is an ``(n_frames, n_atoms, 3)`` float32 view into
+    the mapped file. Indexing a DCDFile indexes that view, so frame
+    slices and strides are zero-copy; only atom subsets copy.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            header = read_header(f)
+        self.__dict__.update(header)
+        n = self.n_atoms
+        self._coord_record = 4 * n + 8
+        cell_record = UNITCELL_SIZE + 8 if self.has_unitcell else 0
+        self._cell_record = cell_record
+        self.frame_size = cell_record + 3 * self._coord_record
+        file_size = self.path.stat().st_size
+        # Count complete frames from the file size since NAMD only
+        # updates the header frame count as it flushes.
+        self.n_frames = (file_size - self.header_size) // self.frame_size
+        if self.n_frames == 0:
+            # A batch that has just started has a header but no frames.
+            self._map = None
+            self.coordinates = np.zeros(
+                (0, n, 3), dtype=np.dtype(self.endian + 'f4'))
+            self.unitcell_raw = (
+                np.zeros((0, 6), dtype=np.dtype(self.endian + 'f8'))
+                if self.has_unitcell else None)
+            return
+        self._map = np.memmap(self.path, dtype=np.uint8, mode='r')
+        self.coordinates = np.ndarray(
+            shape=(self.n_frames, n, 3),
+            dtype=np.dtype(self.endian + 'f4'),
+            buffer=self._map,
+            offset=self.header_size + cell_record + 4,
+            strides=(self.frame_size, 4, self._coord_record),
+        )
+        if self.has_unitcell:
+            self.unitcell_raw = np.ndarray(
+                shape=(self.n_frames, 6),
+                dtype=np.dtype(self.endian + 'f8'),
+                buffer=self._map,
+                offset=self.header_size + 4,
+                strides=(self.frame_size, 8),
+            )
+        else:
+            self.unitcell_raw = None
+
+    def __repr__(self):
+        return (
+            f'<DCDFile {self.path.name}: {self.n_frames} frames, '
+            f'{self.n_atoms} atoms>'
+        )
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, key):
+        return self.coordinates[key]
+
+    @property
+    def timestep(self):
+        """The time between saved frames in femtoseconds."""
+        return self.delta * AKMA_FS * self.nsavc
+
+    def frame(self, i):
+        """Return frame ``i`` as an ``(n_atoms, 3)`` view."""
+        return self.coordinates[i]
+
+    def unitcell(self, frames=slice(None)):
+        """Return ``(a, b, c, alpha, beta, gamma)`` for the given frames."""
+        if self.unitcell_raw is None:
+            return None
+        return convert_unitcell(self.unitcell_raw[frames])
+
+    def select(self, frames=slice(None), atoms=None):
+        """Return coordinates for a frame slice and optional atom indices.
+
+        Without ``atoms`` the result is a view into the mapped file.
+        """
+        coords = self.coordinates[frames]
+        if atoms is not None:
+            coords = coords[:, atoms]
+        return coords
+
+    def iter_chunks(self, chunk_size=100, start=None, stop=None, step=None,
+                    atoms=None):
+        """Yield Chunks of at most ``chunk_size`` frames."""
+        indices = np.arange(self.n_frames)[start:stop:step]
+        for i in range(0, len(indices), chunk_size):
+            frames = indices[i:i + chunk_size]
+            window = slice(frames[0], frames[-1] + 1, step)
+            yield Chunk(
+                frames,
+                self.select(window, atoms),
+                self.unitcell(window),
+            )
+
+
+def open_dcd(path):
+    """Open a DCD trajectory."""
+    return DCDFile(path)
+
+
+def iter_trajectory(paths, chunk_size=100, step=None, atoms=None):
+    """Yield Chunks across several DCD files as one trajectory.
+
+    Frame indices in the chunks are numbered continuously across the
+    files, in the order given.
+    """
+    offset = 0
+    for path in paths:
+        dcd = open_dcd(path)
+        for chunk in dcd.iter_chunks(chunk_size, step=step, atoms=atoms):
+            yield chunk._replace(frames=chunk.frames + offset)
+        offset += dcd.n_frames
+
+
+def frame_windows(paths, chunk_size):
+    """Split DCD files into ``(path, start, stop)`` frame windows.
+
+    Windows are units of work for processing a trajectory in parallel.
+    """
+    windows = []
+    for path in paths:
+        n_frames = len(open_dcd(path))
+        for start in range(0, n_frames, chunk_size):
+            windows.append((path, start, min(start + chunk_size, n_frames)))
+    return windows
+
+
+def _write_record(f, endian, data):
+    marker = struct.pack(endian + 'i', len(data))
+    f.write(marker)
+    f.write(data)
+    f.write(marker)
+
+
+def write_dcd(path, coordinates, unitcell=None, istart=0, nsavc=1,
+              delta=1.0 / AKMA_FS, title='Created by mdsim', endian='<'):
+    """Write coordinates in NAMD's DCD layout.
+
+    ``coordinates`` is an ``(n_frames, n_atoms, 3)`` array and
+    ``unitcell`` an optional ``(n_frames, 6)`` array of
+    ``(a, b, c, alpha, beta, gamma)``.
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float32)
+    n_frames, n_atoms, _ = coordinates.shape
+    icntrl = [0] * 20
+    icntrl[0] = n_frames
+    icntrl[1] = istart
+    icntrl[2] = nsavc
+    icntrl[3] = istart + nsavc * n_frames
+    icntrl[7] = 3 * n_atoms - 6
+    icntrl[10] = int(unitcell is not None)
+    icntrl[19] = 24
+    with open(path, 'wb') as f:
+        header = b'CORD' + struct.pack(
+            endian + '9if10i', *icntrl[:9], delta, *icntrl[10:])
+        _write_record(f, endian, header)
+        title_data = title.encode('ascii')[:80].ljust(80)
+        _write_record(f, endian, struct.pack(endian + 'i', 1) + title_data)
+        _write_record(f, endian, struct.pack(endian + 'i', n_atoms))
+        for i in range(n_frames):
+            if unitcell is not None:
+                a, b, c, alpha, beta, gamma = unitcell[i]
+                cosines = np.cos(np.radians([gamma, beta, alpha]))
+                cell = np.array(
+                    [a, cosines[0], b, cosines[1], cosines[2], c],
+                    dtype=endian + 'f8',
+                )
+                _write_record(f, endian, cell.tobytes())
+            for axis in range(3):
+                values = coordinates[i, :, axis].astype(endian + 'f4')
+                _write_record(f, endian, values.tobytes())
@@ -0,0 +1,67 @@
+"""Decimation of long timeseries for plotting.
+
+"""
+import numpy as np
+
+
+METHODS = ('lttb', 'stride', 'none')
+DEFAULT_METHOD = 'lttb'
+DEFAULT_MAX_POINTS = 5000
+
+
+def stride_indices(n, max_points):
+    """Return indices taking every k-th of ``n`` points."""
+    step = max(1, -(-n // max_points))
+    return np.arange(0, n, step)
+
+
+def lttb_indices(x, y, max_points):
+    """Return indices chosen by largest-triangle-three-buckets.
+
+    The first and last points are always kept. The points between are
+    split into ``max_points - 2`` buckets, and from each bucket the
+    point forming the largest triangle with the previously kept point
+    and the mean of the next bucket is kept. This preserves peaks and
+    dips that a plain stride would skip.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    # Mean of every bucket, with the last point standing in for the
+    # bucket after the final one.
+    counts = np.diff(edges)
+    x_means = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    y_means = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    x_means = np.append(x_means, x[-1])
+    y_means = np.append(y_means, y[-1])
+    result = np.empty(max_points, dtype=np.int64)
+    result[0] = 0
+    result[-1] = n - 1
+    a = 0
+    for i in range(max_points - 2):
+        start, stop = edges[i], edges[i + 1]
+        xs = x[start:stop]
+        ys = y[start:stop]
+        areas = np.abs(
+            (x[a] - x_means[i + 1]) * (ys - y[a])
+            - (x[a] - xs) * (y_means[i + 1] - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        result[i + 1] = a
+    return result
+
+
+def downsample(x, y, method=DEFAULT_METHOD, max_points=DEFAULT_MAX_POINTS):
+    """Return ``(x, y)`` reduced to at most ``max_points`` points."""
+    if method == 'none' or len(x) <= max_points:
+        return (x, y)
+    if method == 'lttb':
+        indices = lttb_indices(x, y, max_points)
+    elif method == 'stride':
+        indices = stride_indices(len(x), max_points)
+    else:
+        raise ValueError(f'Unknown downsampling method: {method}')
+    return (np.asarray(x)[indices], np.asarray(y)[indices])
@@ -0,0 +1,44 @@
+"""Keys of input files and JSON state files.
+
+Tools that skip work whose inputs are unchanged key each input file by
+its size and modification time, or by a SHA-256 content hash, and keep
+their progress in a JSON state file that is replaced atomically.
+
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+
+
+HASH_BLOCK_SIZE = 2**20
+
+
+def file_key(file_path, content_hash=False):
+    """Return the size and mtime, or the SHA-256 digest, of a file."""
+    if not content_hash:
+        st = os.stat(file_path)
+        return [st.st_size, st.st_mtime_ns]
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_state(file_path):
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(file_path, state):
+    file_path = Path(file_path)
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=file_path.name, dir=file_path.parent)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, file_path)
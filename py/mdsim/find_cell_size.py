@@ -1,27 +1,331 @@
 #!/usr/bin/env python
+"""Periodic cell sizes for solvating a structure.
 
+By default the cell is the legacy cube on the origin, twice the largest
+absolute coordinate plus padding. With ``--center`` the structure is
+centered on its center of geometry or mass instead, and the smallest
+cubic, orthorhombic or truncated octahedral cell that keeps ``padding``
+between every atom and the cell faces is reported, optionally after
+searching rigid rotations. PME grid sizes with only small prime factors
+are reported to match the cell.
+
+"""
+import argparse
 from math import ceil
-import sys
+
+import numpy as np
+
+from mdsim.pdb import read_pdb, write_coordinates
+
+
+DEFAULT_PADDING = 10.0
+DEFAULT_PME_SPACING = 1.0
+DEFAULT_TRIALS = 200
+
+SHAPES = ('cubic', 'orthorhombic', 'octahedron')
+CENTERS = ('origin', 'geometry', 'mass')
+
+# NAMD's PME is fastest for grid sizes with only these prime factors.
+PME_PRIMES = (2, 3, 5)
+
+ELEMENT_MASSES = {
+    'H': 1.008, 'C': 12.011, 'N': 14.007, 'O': 15.999, 'S': 32.06,
+    'P': 30.974,
+}
+
+
+def max_atom_coord(coordinates):
+    """Return the largest absolute coordinate of any atom."""
+    if not len(coordinates):
+        return 0.0
+    return float(np.abs(coordinates).max())
+
+
+def guess_masses(names):
+    """Return atom masses guessed from the first letter of atom names.
+
+    Unknown elements count as carbon.
+    """
+    letters = np.char.lstrip(np.asarray(names, dtype=str), '0123456789')
+    letters = np.char.upper(np.char.ljust(letters, 1)).astype('U1')
+    masses = np.full(len(letters), ELEMENT_MASSES['C'])
+    for (element, mass) in ELEMENT_MASSES.items():
+        masses[letters == element] = mass
+    return masses
+
+
+def structure_center(coordinates, method='geometry', masses=None):
+    """Return the origin, or the center of geometry or mass."""
+    if method == 'origin':
+        return np.zeros(3)
+    if method == 'geometry':
+        return coordinates.mean(axis=0)
+    if method == 'mass':
+        return np.average(coordinates, axis=0, weights=masses)
+    raise ValueError(f'Unknown center: {method}')
+
+
+def hull_points(points):
+    """Return the convex hull vertices of points, or all points.
+
+    Cell sizes only depend on the extreme points, so the search works on
+    the hull.
+    """
+    if len(points) < 5:
+        return points
+    from scipy.spatial import ConvexHull, QhullError
+    try:
+        return points[ConvexHull(points).vertices]
+    except QhullError:
+        # Flat or degenerate structures.
+        return points
+
+
+def cell_dimensions(points, shape, padding=DEFAULT_PADDING):
+    """Return the cell edges that hold points centered on the origin.
+
+    ``points`` is an ``(..., n_points, 3)`` array. Cubic and
+    orthorhombic cells have edges ``(a, b, c)``. A truncated octahedron
+    is given by the edge ``d`` of the cube it is cut from, repeated
+    three times; its square faces are ``d / 2`` and its hexagonal faces
+    ``sqrt(3) d / 4`` from the center.
+    """
+    extent = np.abs(points).max(axis=-2)
+    edges = 2 * (extent + padding)
+    if shape == 'orthorhombic':
+        return edges
+    if shape == 'cubic':
+        side = edges.max(axis=-1, keepdims=True)
+        return np.repeat(side, 3, axis=-1)
+    if shape == 'octahedron':
+        diagonal = np.abs(points).sum(axis=-1).max(axis=-1)
+        d = np.maximum(edges.max(axis=-1),
+                       4 / 3 * (diagonal + np.sqrt(3) * padding))
+        return np.repeat(d[..., np.newaxis], 3, axis=-1)
+    raise ValueError(f'Unknown cell shape: {shape}')
+
+
+def cell_volume(dimensions, shape):
+    volume = np.prod(dimensions, axis=-1)
+    if shape == 'octahedron':
+        return volume / 2
+    return volume
+
+
+def basis_vectors(dimensions, shape):
+    """Return the three cell basis vectors as rows."""
+    if shape == 'octahedron':
+        d = dimensions[0]
+        return d / 2 * np.array([[-1, 1, 1], [1, -1, 1], [1, 1, -1]])
+    return np.diag(dimensions)
+
+
+def _rotated_volumes(points, rotations, shape, padding):
+    rotated = np.einsum('kij,nj->kni', rotations.as_matrix(), points)
+    return cell_volume(cell_dimensions(rotated, shape, padding), shape)
+
+
+def principal_rotation(points):
+    """Return the rotation onto the principal axes of points."""
+    from scipy.spatial.transform import Rotation
+    _, vectors = np.linalg.eigh(np.cov(points.T))
+    if np.linalg.det(vectors) < 0:
+        vectors[:, 0] *= -1
+    return Rotation.from_matrix(vectors.T)
+
+
+def minimal_rotation(points, shape, padding=DEFAULT_PADDING,
+                     n_trials=DEFAULT_TRIALS, seed=0):
+    """Return the rotation giving the smallest cell around points.
+
+    The identity, the principal axes and ``n_trials`` random rotations
+    are tried together, and the best few refined by a local search.
+    """
+    from scipy.optimize import minimize
+    from scipy.spatial.transform import Rotation
+    points = hull_points(points)
+    candidates = Rotation.concatenate([
+        Rotation.identity(),
+        principal_rotation(points),
+        Rotation.random(n_trials, random_state=seed),
+    ])
+    volumes = _rotated_volumes(points, candidates, shape, padding)
+    best = candidates[int(np.argmin(volumes))]
+    best_volume = volumes.min()
+
+    def volume(rotvec):
+        rotation = Rotation.from_rotvec(rotvec[np.newaxis])
+        return _rotated_volumes(points, rotation, shape, padding)[0]
+
+    for i in np.argsort(volumes)[:3]:
+        result = minimize(volume, candidates[int(i)].as_rotvec(),
+                          method='Nelder-Mead',
+                          options={'xatol': 1e-4, 'fatol': 1e-3})
+        if result.fun < best_volume:
+            best = Rotation.from_rotvec(result.x)
+            best_volume = result.fun
+    return best
+
+
+def smooth_size(n, primes=PME_PRIMES):
+    """Return the smallest integer >= n with only the given prime factors."""
+    m = max(int(n), 1)
+    while True:
+        k = m
+        for p in primes:
+            while k % p == 0:
+                k //= p
+        if k == 1:
+            return m
+        m += 1
+
+
+def pme_grid_sizes(basis, spacing=DEFAULT_PME_SPACING):
+    """Return PME grid sizes along the basis vectors.
+
+    Each size is at least the vector length over ``spacing``.
+    """
+    lengths = np.linalg.norm(basis, axis=1)
+    return [smooth_size(ceil(length / spacing - 1e-9)) for length in lengths]
+
+
+def fit_cell(coordinates, shape='cubic', center='geometry', masses=None,
+             padding=DEFAULT_PADDING, rotate=False, n_trials=DEFAULT_TRIALS,
+             seed=0):
+    """Return the smallest cell of a shape around coordinates.
+
+    The result is a dict with the ``center``, the ``rotation`` matrix
+    applied about the center, the cell ``dimensions``, ``basis``
+    vectors and ``volume``, and the rotated ``coordinates``.
+    """
+    from scipy.spatial.transform import Rotation
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    origin = structure_center(coordinates, center, masses)
+    points = coordinates - origin
+    rotation = Rotation.identity()
+    if rotate:
+        rotation = minimal_rotation(points, shape, padding, n_trials, seed)
+    points = rotation.apply(points)
+    dimensions = cell_dimensions(hull_points(points), shape, padding)
+    return {
+        'center': origin,
+        'rotation': rotation.as_matrix(),
+        'dimensions': dimensions,
+        'basis': basis_vectors(dimensions, shape),
+        'volume': float(cell_volume(dimensions, shape)),
+        'coordinates': points + origin,
+    }
+
+
+def print_cell(cell, shape, pme_spacing=DEFAULT_PME_SPACING):
+    def vector(v):
+        return '  '.join(f'{x:9.3f}' for x in v)
+
+    print(f'Center = {vector(cell["center"])}')
+    if not np.allclose(cell['rotation'], np.eye(3)):
+        for row in cell['rotation']:
+            print(f'Rotation = {vector(row)}')
+    print(f'Cell = {shape}')
+    print(f'Volume = {cell["volume"]:.1f} A^3')
+    for (i, v) in enumerate(cell['basis']):
+        print(f'cellBasisVector{i + 1}    {vector(v)}')
+    print(f'cellOrigin          {vector(cell["center"])}')
+    for (axis, size) in zip('XYZ', pme_grid_sizes(cell['basis'],
+                                                  pme_spacing)):
+        print(f'PMEGridSize{axis}    {size}')
 
 
-def max_atom_coord(line):
-    fields = line.split()
-    coords = [abs(float(s)) for s in fields[6:9]]
-    return max(coords)
+def get_parser():
+    parser = argparse.ArgumentParser()
+    arg_map = {
+        'file': {
+            'help': 'The PDB or NAMD coordinate file',
+        },
+        '--center': {
+            'dest': 'center',
+            'help': 'Center the cell on the structure instead of the origin',
+            'choices': CENTERS,
+            'default': 'origin',
+        },
+        '--shape': {
+            'dest': 'shape',
+            'help': 'The cell shape',
+            'choices': SHAPES,
+            'default': 'cubic',
+        },
+        '--padding': {
+            'dest': 'padding',
+            'help': 'The distance from every atom to the cell faces',
+            'type': float,
+            'default': DEFAULT_PADDING,
+        },
+        '--rotate': {
+            'dest': 'rotate',
+            'help': 'Search rotations for the smallest cell',
+            'action': 'store_true',
+        },
+        '--trials': {
+            'dest': 'trials',
+            'help': 'The number of random rotations to try',
+            'type': int,
+            'default': DEFAULT_TRIALS,
+        },
+        '--psf': {
+            'dest': 'psf',
+            'help': 'A PSF file with atom masses, for --center mass',
+        },
+        '--pme-spacing': {
+            'dest': 'pme_spacing',
+            'help': 'The largest PME grid spacing in Angstroms',
+            'type': float,
+            'default': DEFAULT_PME_SPACING,
+        },
+        '--out': {
+            'dest': 'out',
+            'help': 'Write the rotated structure to this PDB file',
+        },
+        '--cache': {
+            'dest': 'cache',
+            'help': 'Cache the parsed atoms in a sidecar next to the file',
+            'action': 'store_true',
+        },
+    }
+    for (arg, arg_opts) in arg_map.items():
+        parser.add_argument(arg, **arg_opts)
+    return parser
 
 
-def main():
-    (_, filepath) = sys.argv
-    max_coord = 0
-    with open(filepath) as f:
-        for (lineno, line) in enumerate(f.readlines()):
-            if line.startswith('ATOM'):
-                coord = max_atom_coord(line)
-                if coord > max_coord:
-                    max_coord = coord
-        cell_size = 2 * (ceil(max_coord) + 10)
+def main(argv=None):
+    parser = get_parser()
+    if argv is not None:
+        args = parser.parse_args(argv[1:])
+    else:
+        args = parser.parse_args()
+    if args.rotate and not args.out:
+        parser.error('--rotate needs --out for the rotated structure')
+    pdb = read_pdb(args.file, args.cache)
+    if (args.center == 'origin' and args.shape == 'cubic'
+            and not args.rotate):
+        max_coord = max_atom_coord(pdb.coordinates)
+        cell_size = 2 * (ceil(max_coord) + args.padding)
+        if cell_size == int(cell_size):
+            cell_size = int(cell_size)
         print(f'L/2 = {max_coord}')
         print(f'Unit Cell Size = {cell_size}')
+        return
+    masses = None
+    if args.center == 'mass':
+        if args.psf:
+            from mdsim.psf import read_psf
+            masses = read_psf(args.psf).mass
+        else:
+            masses = guess_masses(pdb.name)
+    cell = fit_cell(pdb.coordinates, args.shape, args.center, masses,
+                    args.padding, args.rotate, args.trials)
+    print_cell(cell, args.shape, args.pme_spacing)
+    if args.out:
+        write_coordinates(args.file, args.out, cell['coordinates'])
+        print(f'Saved structure: {args.out}')
 
 
 if __name__ == '__main__':
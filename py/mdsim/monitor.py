@@ -0,0 +1,228 @@
+"""Live monitoring of running NAMD simulations.
+
+Each log is followed by byte offset, so a refresh only parses the
+ENERGY lines appended since the last one. Running statistics are
+updated from the new rows alone, and the plot is redrawn in place. The
+plotted history of a log is kept to at most twice ``--max-points``
+points per column: whenever it grows beyond that, it is reduced to
+``--max-points`` with `mdsim.downsample.lttb_indices`, so older rows are
+shown at a coarser resolution than recent ones.
+
+"""
+import argparse
+from pathlib import Path
+import time
+
+import numpy as np
+
+from mdsim.downsample import DEFAULT_MAX_POINTS, lttb_indices
+from mdsim.namdlog import LogFollower
+from mdsim.render import pyplot
+
+
+DEFAULT_COLUMNS = ['TEMP', 'TOTAL']
+DEFAULT_INTERVAL = 30.0
+
+
+class RunningStats:
+    """Count, mean, variance and range updated a block at a time."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        k = len(values)
+        if k == 0:
+            return
+        block_mean = values.mean()
+        block_m2 = ((values - block_mean)**2).sum()
+        n = self.n + k
+        delta = block_mean - self.mean
+        self.mean += delta * k / n
+        self.m2 += block_m2 + delta**2 * self.n * k / n
+        self.n = n
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+    @property
+    def var(self):
+        return self.m2 / self.n if self.n else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+
+class LogMonitor:
+    """Followed log, running statistics and plotted history of one run."""
+
+    def __init__(self, file_path, columns=DEFAULT_COLUMNS,
+                 max_points=DEFAULT_MAX_POINTS):
+        self.file_path = Path(file_path)
+        self.columns = columns
+        self.max_points = max_points
+        self.follower = LogFollower(file_path)
+        self.reset()
+
+    def reset(self):
+        """Forget the rows read so far."""
+        self.stats = dict((column, RunningStats())
+                          for column in self.columns)
+        # Blocks of TS and of values of every column.
+        self.history = dict((column, ([], [])) for column in self.columns)
+        self.history_size = 0
+        self.last_ts = None
+
+    def refresh(self):
+        """Read new ENERGY rows and return how many there were.
+
+        When the log was restarted, the rows of the old run are dropped.
+        """
+        energies = self.follower.poll()
+        if self.follower.restarted:
+            self.reset()
+        if len(energies) == 0:
+            return 0
+        for column in self.columns:
+            self.stats[column].update(energies[column])
+        for (column, (ts, values)) in self.history.items():
+            ts.append(energies['TS'])
+            values.append(energies[column])
+        self.history_size += len(energies)
+        if self.history_size > 2 * self.max_points:
+            self.decimate()
+        self.last_ts = int(energies['TS'][-1])
+        return len(energies)
+
+    def decimate(self):
+        """Reduce the history of every column to ``max_points``."""
+        for column in self.history:
+            (ts, values) = self.series(column)
+            indices = lttb_indices(ts, values, self.max_points)
+            self.history[column] = ([ts[indices]], [values[indices]])
+        self.history_size = min(self.history_size, self.max_points)
+
+    def series(self, column):
+        """Return the TS and values of a column in the history."""
+        (ts, values) = self.history[column]
+        if not ts:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0))
+        # Merge the appended blocks so the history stays one array each.
+        self.history[column] = ([np.concatenate(ts)],
+                                [np.concatenate(values)])
+        return (self.history[column][0][0], self.history[column][1][0])
+
+    def summary(self):
+        fields = [f'{self.file_path.name}']
+        fields.append(f'TS {self.last_ts}' if self.last_ts is not None
+                      else 'TS -')
+        n = self.stats[self.columns[0]].n if self.columns else 0
+        fields.append(f'frames {n}')
+        for (column, st) in self.stats.items():
+            fields.append(f'{column} {st.mean:.2f} +/- {st.std:.2f}')
+        return '  '.join(fields)
+
+
+class MonitorPlot:
+    """A figure with one panel per column, updated in place."""
+
+    def __init__(self, monitors, columns, output_file):
+        self.output_file = output_file
+        self.fig, axs = pyplot().subplots(
+            len(columns), 1, sharex=True, squeeze=False)
+        self.axs = dict(zip(columns, axs[:, 0]))
+        self.lines = {}
+        for (column, ax) in self.axs.items():
+            ax.set_ylabel(column)
+            for monitor in monitors:
+                (line,) = ax.plot([], [], lw=0.7,
+                                  label=monitor.file_path.name)
+                self.lines[(monitor.file_path, column)] = line
+        axs[-1, 0].set_xlabel('ts')
+        axs[0, 0].legend(fontsize='small')
+
+    def update(self, monitors):
+        for monitor in monitors:
+            for column in self.axs:
+                line = self.lines[(monitor.file_path, column)]
+                line.set_data(*monitor.series(column))
+        for ax in self.axs.values():
+            ax.relim()
+            ax.autoscale_view()
+        self.fig.savefig(self.output_file)
+
+
+def refresh_all(monitors):
+    """Refresh every monitor and return the number of new rows."""
+    return sum(monitor.refresh() for monitor in monitors)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    arg_map = {
+        'logs': {
+            'help': 'NAMD log files to follow',
+            'nargs': '+',
+        },
+        '--columns': {
+            'dest': 'columns',
+            'help': 'ENERGY columns to track',
+            'nargs': '+',
+            'default': DEFAULT_COLUMNS,
+        },
+        '--interval': {
+            'dest': 'interval',
+            'help': 'Seconds between refreshes',
+            'type': float,
+            'default': DEFAULT_INTERVAL,
+        },
+        '--out': {
+            'dest': 'out',
+            'help': 'Plot file to update on each refresh',
+        },
+        '--max-points': {
+            'dest': 'max_points',
+            'help': 'The number of points to reduce each plotted column to',
+            'type': int,
+            'default': DEFAULT_MAX_POINTS,
+        },
+        '--once': {
+            'dest': 'once',
+            'help': 'Refresh once and exit',
+            'action': 'store_true',
+        },
+    }
+    for (arg, arg_opts) in arg_map.items():
+        parser.add_argument(arg, **arg_opts)
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    if argv is not None:
+        args = parser.parse_args(argv[1:])
+    else:
+        args = parser.parse_args()
+    monitors = [LogMonitor(path, args.columns, args.max_points)
+                for path in args.logs]
+    plot = None
+    if args.out:
+        plot = MonitorPlot(monitors, args.columns, args.out)
+    try:
+        while True:
+            if refresh_all(monitors) > 0:
+                for monitor in monitors:
+                    print(monitor.summary())
+                if plot is not None:
+                    plot.update(monitors)
+                print(flush=True)
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,325 @@
+"""Streaming parser for NAMD log files.
+
+NAMD prints an ``ETITLE:`` header naming the columns of the ``ENERGY:``
+lines that follow it. The log is read once, line by line, and the
+energy table is returned as a NumPy structured array with one field per
+column, e.g. ``energies['TEMP']``. On request parsed tables are cached
+in a sidecar ``.npz`` file so a log is only parsed again after it
+changes. Project directories may be read-only or shared, so this is off
+by default.
+
+`read_timing` collects the performance figures NAMD prints, the
+``Benchmark time`` lines at startup, the ``TIMING`` lines every
+``outputtiming`` steps and the closing ``WallClock`` line, to measure
+the throughput of a host.
+
+"""
+from collections import namedtuple
+import os
+
+import numpy as np
+
+from mdsim import sidecar
+
+
+ENERGY_PREFIX = 'ENERGY:'
+ETITLE_PREFIX = 'ETITLE:'
+TIMING_PREFIX = 'TIMING:'
+BENCHMARK_PREFIX = 'Info: Benchmark time:'
+TIMESTEP_PREFIX = 'Info: TIMESTEP'
+WALLCLOCK_PREFIX = 'WallClock:'
+ENERGY_SUFFIX = '.energy.npz'
+
+# The columns of NAMD 2.x when no ETITLE line has been seen.
+DEFAULT_TITLES = (
+    'TS', 'BOND', 'ANGLE', 'DIHED', 'IMPRP', 'ELECT', 'VDW', 'BOUNDARY',
+    'MISC', 'KINETIC', 'TOTAL', 'TEMP', 'POTENTIAL', 'TOTAL3', 'TEMPAVG',
+    'PRESSURE', 'GPRESSURE', 'VOLUME', 'PRESSAVG', 'GPRESSAVG',
+)
+
+BLOCK_SIZE = 10000
+READ_SIZE = 2**20
+SECONDS_PER_DAY = 86400
+
+
+Timing = namedtuple('Timing', [
+    'timestep', 'cpus', 'benchmark', 'steps', 'cpu', 'wall', 'memory',
+    'wallclock', 'cputime',
+])
+Timing.__doc__ = """Performance figures of a NAMD log.
+
+``timestep`` is in fs and ``cpus`` the CPU count of the Benchmark
+lines, and ``benchmark`` holds their ``(s/step, days/ns)`` pairs. The
+TIMING lines give ``steps``, the CPU and wall clock s/step in ``cpu``
+and ``wall``, and ``memory`` in MB. ``wallclock`` and ``cputime`` are
+the total seconds of a finished run, or None.
+"""
+
+
+def energy_dtype(titles):
+    """Return the structured dtype for ENERGY columns."""
+    return np.dtype([
+        (title, np.int64 if title == 'TS' else np.float64)
+        for title in titles
+    ])
+
+
+def parse_titles(line):
+    """Return the column names of an ETITLE line."""
+    return tuple(line.split()[1:])
+
+
+def parse_energy_block(lines, n_columns):
+    """Return an ``(n, n_columns)`` float array for ENERGY lines.
+
+    Lines with the wrong number of fields, such as a line still being
+    written by a running simulation, are skipped.
+    """
+    rows = [line.split()[1:] for line in lines]
+    rows = [row for row in rows if len(row) == n_columns]
+    if not rows:
+        return np.zeros((0, n_columns))
+    return np.array(rows, dtype=np.float64)
+
+
+def to_records(values, titles):
+    """Convert a float array of ENERGY columns to a structured array."""
+    result = np.empty(len(values), dtype=energy_dtype(titles))
+    for (i, title) in enumerate(titles):
+        result[title] = values[:, i]
+    return result
+
+
+class EnergyParser:
+    """Incremental parser of ENERGY lines.
+
+    Lines are fed in any number of calls to `feed`; ENERGY lines are
+    buffered and parsed a block at a time so memory use does not depend
+    on the length of the log.
+    """
+
+    def __init__(self, titles=None, block_size=BLOCK_SIZE):
+        self.titles = titles
+        self.block_size = block_size
+        self.blocks = []
+        self.pending = []
+
+    def _flush(self):
+        if self.pending:
+            titles = self.titles or DEFAULT_TITLES
+            self.blocks.append(parse_energy_block(self.pending, len(titles)))
+            self.pending = []
+
+    def feed(self, lines):
+        for line in lines:
+            if line.startswith(ENERGY_PREFIX):
+                self.pending.append(line)
+                if len(self.pending) >= self.block_size:
+                    self._flush()
+            elif line.startswith(ETITLE_PREFIX):
+                titles = parse_titles(line)
+                if self.titles is not None and titles != self.titles:
+                    if self.pending or self.blocks:
+                        raise ValueError(
+                            'ENERGY columns changed within the log')
+                self.titles = titles
+
+    def result(self):
+        """Return and clear the parsed ENERGY rows."""
+        self._flush()
+        titles = self.titles or DEFAULT_TITLES
+        if self.blocks:
+            values = np.concatenate(self.blocks)
+        else:
+            values = np.zeros((0, len(titles)))
+        self.blocks = []
+        return to_records(values, titles)
+
+
+class LogFollower:
+    """Follow a growing NAMD log by byte offset.
+
+    Each `poll` reads only the bytes appended since the previous poll,
+    ``read_size`` bytes at a time, and returns the ENERGY rows they
+    complete. A partially written last line is left for the next poll.
+    A log that was truncated or replaced, such as the log of a restarted
+    batch, is read again from the start, and `restarted` is set until
+    the next poll.
+    """
+
+    def __init__(self, file_path, read_size=READ_SIZE):
+        self.file_path = file_path
+        self.read_size = read_size
+        self.offset = 0
+        self.identity = None
+        self.last_line = b''
+        self.restarted = False
+        self.parser = EnergyParser()
+
+    def _changed(self, f, st):
+        """Return whether the log is not the one read up to ``offset``."""
+        if (st.st_dev, st.st_ino) != self.identity or st.st_size < self.offset:
+            return True
+        f.seek(self.offset - len(self.last_line))
+        return f.read(len(self.last_line)) != self.last_line
+
+    def poll(self):
+        """Return the ENERGY rows appended since the last poll."""
+        self.restarted = False
+        try:
+            f = open(self.file_path, 'rb')
+        except FileNotFoundError:
+            return self.parser.result()
+        with f:
+            st = os.fstat(f.fileno())
+            if self.offset and self._changed(f, st):
+                self.restarted = True
+                self.offset = 0
+                self.last_line = b''
+                self.parser = EnergyParser()
+            self.identity = (st.st_dev, st.st_ino)
+            f.seek(self.offset)
+            remaining = st.st_size - self.offset
+            tail = b''
+            while remaining > 0:
+                block = f.read(min(self.read_size, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                data = tail + block
+                end = data.rfind(b'\n') + 1
+                if end:
+                    self.offset += end
+                    self.last_line = data[data.rfind(b'\n', 0, end - 1)
+                                          + 1:end]
+                    text = data[:end].decode('utf8', 'replace')
+                    self.parser.feed(text.splitlines())
+                tail = data[end:]
+        return self.parser.result()
+
+
+def parse_energies(f):
+    """Return the ENERGY table of an open NAMD log."""
+    parser = EnergyParser()
+    parser.feed(f)
+    return parser.result()
+
+
+def read_energies(file_path, cache=False):
+    """Return the ENERGY table of a NAMD log file.
+
+    With ``cache`` the table is loaded from, or saved to, a sidecar
+    ``.energy.npz`` file next to the log.
+    """
+    if cache:
+        cached = sidecar.load(file_path, ENERGY_SUFFIX)
+        if cached is not None:
+            return cached['energies']
+    with open(file_path) as f:
+        energies = parse_energies(f)
+    if cache:
+        sidecar.save(file_path, ENERGY_SUFFIX, {'energies': energies})
+    return energies
+
+
+def concatenate_batches(batches):
+    """Join the ENERGY tables of consecutive batches into one timeline.
+
+    A batch restarted from its predecessor's restart files repeats the
+    predecessor's last step. Without ``firsttimestep`` NAMD also counts
+    TS from zero again; such batches are shifted to continue where the
+    previous batch ended. Rows at or before the end of the previous
+    batch are then dropped.
+    """
+    result = []
+    end = None
+    for energies in batches:
+        if len(energies) == 0:
+            continue
+        if end is not None:
+            if energies['TS'][0] == 0 and end > 0:
+                energies = energies.copy()
+                energies['TS'] += end
+            energies = energies[energies['TS'] > end]
+            if len(energies) == 0:
+                continue
+        result.append(energies)
+        end = energies['TS'][-1]
+    if not result:
+        return to_records(np.zeros((0, len(DEFAULT_TITLES))), DEFAULT_TITLES)
+    return np.concatenate(result)
+
+
+def _figure_before(fields, unit):
+    return float(fields[fields.index(unit) - 1])
+
+
+def parse_timing(f):
+    """Return the Timing of an open NAMD log."""
+    timestep = cpus = wallclock = cputime = None
+    benchmark = []
+    steps, cpu, wall, memory = [], [], [], []
+    for line in f:
+        try:
+            if line.startswith(TIMING_PREFIX):
+                fields = line.split()
+                values = (
+                    int(fields[1]),
+                    float(fields[fields.index('CPU:') + 2].split('/')[0]),
+                    float(fields[fields.index('Wall:') + 2].split('/')[0]),
+                    _figure_before(fields, 'MB'),
+                )
+                for (column, value) in zip((steps, cpu, wall, memory),
+                                           values):
+                    column.append(value)
+            elif line.startswith(BENCHMARK_PREFIX):
+                fields = line.split()
+                cpus = int(_figure_before(fields, 'CPUs'))
+                benchmark.append((_figure_before(fields, 's/step'),
+                                  _figure_before(fields, 'days/ns')))
+            elif line.startswith(TIMESTEP_PREFIX):
+                timestep = float(line.split()[2])
+            elif line.startswith(WALLCLOCK_PREFIX):
+                fields = line.split()
+                wallclock = float(fields[1])
+                cputime = float(fields[fields.index('CPUTime:') + 1])
+        except (IndexError, ValueError):
+            # A line still being written by a running simulation.
+            continue
+    return Timing(timestep, cpus, benchmark, steps, cpu, wall, memory,
+                  wallclock, cputime)
+
+
+def read_timing(file_path):
+    """Return the Timing of a NAMD log file."""
+    with open(file_path) as f:
+        return parse_timing(f)
+
+
+def throughput(timings):
+    """Return the ``(s/step, ns/day)`` measured by a list of Timings.
+
+    The median wall clock time of the TIMING lines is used, as it
+    includes the cost of output; logs that stopped before their first
+    TIMING line fall back to the Benchmark figures. Raises ValueError
+    if the logs have no timing lines at all.
+    """
+    wall = [value for timing in timings for value in timing.wall]
+    benchmark = [pair for timing in timings for pair in timing.benchmark]
+    if wall:
+        seconds_per_step = float(np.median(wall))
+    elif benchmark:
+        seconds_per_step = float(np.median([s for (s, _) in benchmark]))
+    else:
+        raise ValueError('No TIMING or Benchmark lines in the NAMD logs')
+    timesteps = [t.timestep for t in timings if t.timestep is not None]
+    if timesteps:
+        timestep = timesteps[0]
+    elif benchmark:
+        # days/ns = s/step * (1e6 / timestep) / 86400
+        seconds, days = benchmark[0]
+        timestep = 1e6 * seconds / (days * SECONDS_PER_DAY)
+    else:
+        raise ValueError('No TIMESTEP in the NAMD logs')
+    ns_per_day = SECONDS_PER_DAY / seconds_per_step * timestep * 1e-6
+    return (seconds_per_step, ns_per_day)
@@ -0,0 +1,207 @@
+"""Periodic boundary transforms over streamed trajectory chunks.
+
+The transforms take and yield `mdsim.dcd.Chunk` objects, so they plug in
+between `mdsim.dcd.iter_trajectory` and any analysis, and only one
+chunk of frames is held in memory at a time. Unit cells are read from
+every frame, so they follow NPT box fluctuations. Here is the
+equivalent of VMD's ``pbc wrap -all -center com -centersel protein -sel
+"not water" -compound fragment``::
+
+    chunks = iter_trajectory(dcd_paths, chunk_size=1000)
+    chunks = unwrap(chunks, psf)
+    chunks = wrap(chunks, psf, 'not water', center='protein')
+
+Transformed coordinates are float64 copies; the mapped DCD files are
+never written to.
+
+"""
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import breadth_first_order, connected_components
+
+
+COMPOUNDS = ('atom', 'residue', 'fragment')
+
+
+def box_vectors(unitcell):
+    """Return cell vectors as rows from ``(a, b, c, alpha, beta, gamma)``.
+
+    ``unitcell`` is an ``(..., 6)`` array; the result is ``(..., 3, 3)``
+    with ``a`` along x and ``b`` in the xy plane.
+    """
+    unitcell = np.asarray(unitcell, dtype=np.float64)
+    a, b, c = np.moveaxis(unitcell[..., :3], -1, 0)
+    cos_alpha, cos_beta, cos_gamma = np.moveaxis(
+        np.cos(np.radians(unitcell[..., 3:])), -1, 0)
+    sin_gamma = np.sin(np.radians(unitcell[..., 5]))
+    cx = c * cos_beta
+    cy = c * (cos_alpha - cos_beta * cos_gamma) / sin_gamma
+    cz = np.sqrt(np.maximum(c**2 - cx**2 - cy**2, 0.0))
+    zero = np.zeros_like(a)
+    vectors = np.stack([
+        np.stack([a, zero, zero], axis=-1),
+        np.stack([b * cos_gamma, b * sin_gamma, zero], axis=-1),
+        np.stack([cx, cy, cz], axis=-1),
+    ], axis=-2)
+    # Drop the rounding noise of cos(90).
+    vectors[np.abs(vectors) < 1e-9] = 0.0
+    return vectors
+
+
+def _chunk_boxes(chunk):
+    if chunk.unitcell is None:
+        raise ValueError('Trajectory has no unit cell')
+    unitcell = np.asarray(chunk.unitcell)
+    if not np.all(unitcell[:, :3] > 0):
+        raise ValueError('Trajectory has frames without a unit cell')
+    box = box_vectors(unitcell)
+    return box, np.linalg.inv(box)
+
+
+def minimum_image(vectors, box, inverse):
+    """Return the shortest periodic images of ``(n_frames, n, 3)`` vectors.
+
+    ``box`` and ``inverse`` are the ``(n_frames, 3, 3)`` cell vectors
+    and their inverses.
+    """
+    fractional = np.einsum('fnj,fjk->fnk', vectors, inverse)
+    return vectors - np.einsum(
+        'fnj,fjk->fnk', np.round(fractional), box)
+
+
+def fragments(psf):
+    """Return the bonded fragment number of every atom.
+
+    Fragments are numbered from zero in order of their first atom.
+    """
+    n = psf.n_atoms
+    bonds = psf.bonds
+    graph = coo_matrix(
+        (np.ones(len(bonds)), (bonds[:, 0], bonds[:, 1])), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    _, first = np.unique(labels, return_index=True)
+    order = np.empty(len(first), dtype=np.int64)
+    order[np.argsort(first)] = np.arange(len(first))
+    return order[labels]
+
+
+def bond_levels(psf):
+    """Return the bond spanning forest as ``[(children, parents)]`` levels.
+
+    Every fragment is rooted at its first atom and the levels are in
+    breadth-first order, so each parent is placed before its children.
+    """
+    n = psf.n_atoms
+    labels = fragments(psf)
+    _, roots = np.unique(labels, return_index=True)
+    # Join all fragment roots to an extra node to walk every fragment
+    # in a single breadth-first search.
+    rows = np.concatenate([psf.bonds[:, 0], np.full(len(roots), n)])
+    cols = np.concatenate([psf.bonds[:, 1], roots])
+    graph = csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=(n + 1, n + 1))
+    order, parents = breadth_first_order(
+        graph, n, directed=False, return_predecessors=True)
+    depth = np.zeros(n + 1, dtype=np.int64)
+    for atom in order[1:]:
+        depth[atom] = depth[parents[atom]] + 1
+    depth = depth[:n]
+    levels = []
+    for level in range(2, int(depth.max(initial=0)) + 1):
+        children = np.flatnonzero(depth == level)
+        levels.append((children, parents[children]))
+    return levels
+
+
+def compound_labels(psf, atoms, compound='fragment'):
+    """Return compound numbers from zero for the given atom indices."""
+    if compound == 'atom':
+        return np.arange(len(atoms))
+    if compound == 'residue':
+        labels = psf.residue[atoms]
+    elif compound == 'fragment':
+        labels = fragments(psf)[atoms]
+    else:
+        raise ValueError(f'Unknown compound: {compound}')
+    return np.unique(labels, return_inverse=True)[1].reshape(-1)
+
+
+def group_centers(coordinates, labels, weights=None):
+    """Return ``(n_frames, n_groups, 3)`` weighted centers of atom groups."""
+    n_frames, n_atoms, _ = coordinates.shape
+    if weights is None:
+        weights = np.ones(n_atoms)
+    n_groups = int(labels.max(initial=-1)) + 1
+    totals = np.bincount(labels, weights, minlength=n_groups)
+    averages = csr_matrix(
+        (weights / totals[labels], (labels, np.arange(n_atoms))),
+        shape=(n_groups, n_atoms))
+    flat = coordinates.transpose(1, 0, 2).reshape(n_atoms, -1)
+    centers = averages @ flat
+    return centers.reshape(n_groups, n_frames, 3).transpose(1, 0, 2)
+
+
+def center_of_mass(coordinates, masses):
+    """Return the ``(n_frames, 3)`` centers of mass of a block of frames."""
+    return np.einsum('fni,n->fi', coordinates, masses) / masses.sum()
+
+
+def _copy(chunk):
+    return np.array(chunk.coordinates, dtype=np.float64)
+
+
+def unwrap(chunks, psf):
+    """Yield chunks with every bonded fragment made whole.
+
+    Each atom is moved to the periodic image nearest to the atom it is
+    bonded to, walking the bonds outward from the first atom of every
+    fragment.
+    """
+    levels = bond_levels(psf)
+    for chunk in chunks:
+        box, inverse = _chunk_boxes(chunk)
+        xyz = _copy(chunk)
+        for (children, parents) in levels:
+            bond = minimum_image(
+                xyz[:, children] - xyz[:, parents], box, inverse)
+            xyz[:, children] = xyz[:, parents] + bond
+        yield chunk._replace(coordinates=xyz)
+
+
+def wrap(chunks, psf, selection='all', center=None, compound='fragment'):
+    """Yield chunks with compounds of a selection wrapped into the cell.
+
+    Each compound of the selected atoms is shifted by cell vectors so
+    that its geometric center lies in the cell. The cell spans
+    ``[0, 1)`` in fractional coordinates, or is centered on the center
+    of mass of the ``center`` selection in each frame. Compounds are
+    ``'atom'``, ``'residue'`` or bonded ``'fragment'``; make fragments
+    whole with `unwrap` first.
+    """
+    atoms = psf.indices(selection)
+    labels = compound_labels(psf, atoms, compound)
+    if center is not None:
+        center_atoms = psf.indices(center)
+        center_masses = psf.mass[center_atoms]
+    for chunk in chunks:
+        box, inverse = _chunk_boxes(chunk)
+        xyz = _copy(chunk)
+        centers = group_centers(xyz[:, atoms], labels)
+        if center is not None:
+            origin = (center_of_mass(xyz[:, center_atoms], center_masses)
+                      - box.sum(axis=1) / 2)
+            centers -= origin[:, np.newaxis]
+        fractional = np.einsum('fnj,fjk->fnk', centers, inverse)
+        shifts = np.einsum('fnj,fjk->fnk', -np.floor(fractional), box)
+        xyz[:, atoms] += shifts[:, labels]
+        yield chunk._replace(coordinates=xyz)
+
+
+def center(chunks, psf, selection='protein'):
+    """Yield chunks translated to put a selection's center of mass at 0."""
+    atoms = psf.indices(selection)
+    masses = psf.mass[atoms]
+    for chunk in chunks:
+        xyz = _copy(chunk)
+        xyz -= center_of_mass(xyz[:, atoms], masses)[:, np.newaxis]
+        yield chunk._replace(coordinates=xyz)
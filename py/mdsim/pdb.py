@@ -0,0 +1,155 @@
+"""Reading of PDB and NAMD coordinate files.
+
+ATOM and HETATM records are read by their fixed columns, so fields that
+run into each other, like large coordinates, still parse. NAMD ``.coor``
+files written in PDB format are read the same way. All records are
+parsed together into NumPy arrays. On request the result is cached in
+a sidecar ``.atoms.npz`` file so a file is only parsed again after it
+changes. Input structures often live in read-only places, like the
+``ansible/files`` of this repository, so this is off by default.
+
+"""
+import numpy as np
+
+from mdsim import sidecar
+
+
+PDB_SUFFIX = '.atoms.npz'
+RECORD_WIDTH = 80
+
+# Column slices of the ATOM/HETATM record fields. CHARMM and NAMD use
+# the four columns up to the chain ID for residue names.
+COLUMNS = {
+    'record': (0, 6),
+    'serial': (6, 11),
+    'name': (12, 16),
+    'altloc': (16, 17),
+    'resname': (17, 21),
+    'chain': (21, 22),
+    'resid': (22, 26),
+    'icode': (26, 27),
+    'x': (30, 38),
+    'y': (38, 46),
+    'z': (46, 54),
+    'occupancy': (54, 60),
+    'beta': (60, 66),
+    'segid': (72, 76),
+    'element': (76, 78),
+}
+
+STRING_FIELDS = ('record', 'name', 'resname', 'chain', 'segid')
+FLOAT_FIELDS = ('occupancy', 'beta')
+
+
+class PDB:
+    """Per-atom arrays read from the ATOM/HETATM records of a PDB file.
+
+    ``coordinates`` is an ``(n_atoms, 3)`` array and every other
+    attribute an array with one entry per atom, in file order.
+    ``lineno`` holds the zero-based line number of each record.
+    """
+
+    def __init__(self, record, name, resname, chain, resid, segid,
+                 coordinates, occupancy, beta, lineno):
+        self.record = record
+        self.name = name
+        self.resname = resname
+        self.chain = chain
+        self.resid = resid
+        self.segid = segid
+        self.coordinates = coordinates
+        self.occupancy = occupancy
+        self.beta = beta
+        self.lineno = lineno
+
+    def __repr__(self):
+        return f'<PDB: {self.n_atoms} atoms>'
+
+    def __len__(self):
+        return self.n_atoms
+
+    @property
+    def n_atoms(self):
+        return len(self.coordinates)
+
+    def arrays(self):
+        """Return the attributes as a dict of arrays."""
+        return dict(vars(self))
+
+
+def _column(records, field, dtype=None):
+    start, stop = COLUMNS[field]
+    width = stop - start
+    column = np.ascontiguousarray(records[:, start:stop]).view(f'S{width}')
+    column = column[:, 0]
+    if dtype is None:
+        return np.char.strip(column.astype(f'U{width}'))
+    column = np.char.strip(column)
+    column[column == b''] = b'0'
+    return column.astype(dtype)
+
+
+def parse_records(data):
+    """Parse the ATOM/HETATM records in the bytes of a PDB file."""
+    lines = data.splitlines()
+    lineno = np.array([
+        i for (i, line) in enumerate(lines)
+        if line.startswith(b'ATOM') or line.startswith(b'HETATM')
+    ], dtype=np.int64)
+    # Pad every record to full width and view them as a byte matrix.
+    padded = np.array([lines[i] for i in lineno], dtype=f'S{RECORD_WIDTH}')
+    records = padded.view(np.uint8).reshape(len(padded), RECORD_WIDTH)
+    records = np.where(records == 0, ord(' '), records).astype(np.uint8)
+    result = dict((field, _column(records, field)) for field in STRING_FIELDS)
+    resid = _column(records, 'resid')
+    try:
+        resid = resid.astype(np.int64)
+    except ValueError:
+        # Keep hybrid-36 or hexadecimal resids of huge systems as strings.
+        pass
+    result['resid'] = resid
+    result['coordinates'] = np.column_stack([
+        _column(records, axis, np.float64) for axis in 'xyz'
+    ]).reshape(-1, 3)
+    for field in FLOAT_FIELDS:
+        result[field] = _column(records, field, np.float64)
+    result['lineno'] = lineno
+    return PDB(**result)
+
+
+def read_pdb(file_path, cache=False):
+    """Read the atoms of a PDB or NAMD coordinate file.
+
+    With ``cache`` the arrays are loaded from, or saved to, a sidecar
+    ``.atoms.npz`` file next to the input.
+    """
+    if cache:
+        cached = sidecar.load(file_path, PDB_SUFFIX)
+        if cached is not None:
+            return PDB(**cached)
+    with open(file_path, 'rb') as f:
+        pdb = parse_records(f.read())
+    if cache:
+        sidecar.save(file_path, PDB_SUFFIX, pdb.arrays())
+    return pdb
+
+
+def write_coordinates(file_path, out_path, coordinates):
+    """Copy a PDB file with new ATOM/HETATM coordinates.
+
+    Every other column and record is kept as it is.
+    """
+    with open(file_path) as f:
+        lines = f.readlines()
+    lineno = parse_records(''.join(lines).encode()).lineno
+    if len(lineno) != len(coordinates):
+        raise ValueError(
+            f'{len(coordinates)} coordinates for {len(lineno)} atoms')
+    for (i, xyz) in zip(lineno, coordinates):
+        line = lines[i].rstrip('\n')
+        ending = lines[i][len(line):]
+        line = line.ljust(54)
+        lines[i] = (line[:30] + '%8.3f%8.3f%8.3f' % tuple(xyz) + line[54:]
+                    + ending)
+    with open(out_path, 'w') as f:
+        f.writelines(lines)
@@ -0,0 +1,251 @@
+"""Performance report of the NAMD batches of a simulation project.
+
+`mdsim-perf` reads the ``simulation.trajectories`` config written by
+`mdsim-batch-config` and streams the log of every batch in the project
+directory for its Benchmark, TIMING and WallClock lines, see
+`mdsim.namdlog.read_timing`. Each batch is reported with its host, CPU
+count, wall and CPU time, s/step, ns/day and peak memory. The host is
+the one `mdsim-run` recorded next to the batch log, or else the
+``host`` of the trajectory config.
+
+Batches are compared to the median s/step of all batches on the same
+number of CPUs, so a slow node, a bad core count or a PME grid
+regression stands out as a batch marked ``SLOW``. The timeline plot
+shows the ns/day and memory of every TIMING interval along each
+trajectory.
+
+"""
+import argparse
+import csv
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from mdsim.namdlog import read_timing, throughput
+from mdsim.render import pyplot, save_figure
+from mdsim.run import host_file
+
+
+DEFAULT_TOLERANCE = 0.1
+DEFAULT_HOST = 'default'
+FIELDS = [
+    'host', 'trajectory', 'batch', 'cpus', 'steps', 'wall_hours',
+    'cpu_hours', 's_per_step', 'ns_per_day', 'memory_mb', 'relative',
+]
+
+
+def batch_log(project_dir, trajectory, batch):
+    return (Path(project_dir) / str(trajectory) / 'output'
+            / f'abf_quench{batch}.out')
+
+
+def batch_host(log_path):
+    """Return the host `mdsim-run` recorded for a batch log, or None."""
+    try:
+        return host_file(log_path).read_text().strip() or None
+    except OSError:
+        return None
+
+
+def batch_performance(timing):
+    """Return the performance figures of one batch from its Timing.
+
+    Runs that are not finished have no wall and CPU time.
+    """
+    try:
+        seconds_per_step, ns_per_day = throughput([timing])
+    except ValueError:
+        seconds_per_step = ns_per_day = None
+    return {
+        'cpus': timing.cpus,
+        'steps': timing.steps[-1] if timing.steps else 0,
+        'wall_hours': (None if timing.wallclock is None
+                       else timing.wallclock / 3600),
+        'cpu_hours': (None if timing.cputime is None
+                      else timing.cputime / 3600),
+        's_per_step': seconds_per_step,
+        'ns_per_day': ns_per_day,
+        'memory_mb': max(timing.memory) if timing.memory else None,
+    }
+
+
+def collect(sim_config, project_dir, trajectories=None):
+    """Return ``(records, timings)`` for every batch log that exists.
+
+    Records are dicts of the `FIELDS`, and ``timings`` maps
+    ``(trajectory, batch)`` to the Timing of the log.
+    """
+    records = []
+    timings = {}
+    for trajectory in sim_config['simulation']['trajectories']:
+        name = str(trajectory['trajectory'])
+        if trajectories and name not in trajectories:
+            continue
+        for batch in trajectory['batches']:
+            batch = str(batch['batch'])
+            log_path = batch_log(project_dir, name, batch)
+            if not log_path.exists():
+                continue
+            timing = read_timing(log_path)
+            timings[(name, batch)] = timing
+            record = {
+                'host': (batch_host(log_path) or trajectory.get('host')
+                         or DEFAULT_HOST),
+                'trajectory': name,
+                'batch': batch,
+            }
+            record.update(batch_performance(timing))
+            records.append(record)
+    relative_speed(records)
+    return (records, timings)
+
+
+def relative_speed(records):
+    """Set each record's s/step relative to its CPU count's median."""
+    groups = {}
+    for record in records:
+        if record['s_per_step'] is not None:
+            groups.setdefault(record['cpus'], []).append(
+                record['s_per_step'])
+    medians = dict((cpus, np.median(values))
+                   for (cpus, values) in groups.items())
+    for record in records:
+        record['relative'] = (
+            None if record['s_per_step'] is None
+            else record['s_per_step'] / medians[record['cpus']])
+
+
+def _format(value, spec):
+    return '-' if value is None else format(value, spec)
+
+
+def format_table(records, tolerance=DEFAULT_TOLERANCE):
+    """Return the records as a text table, marking slow batches."""
+    lines = [
+        f'{"host":<10} {"traj":<4} {"batch":<5} {"cpus":>4} '
+        f'{"steps":>8} {"wall h":>7} {"cpu h":>7} {"s/step":>8} '
+        f'{"ns/day":>7} {"MB":>7} {"rel":>5}'
+    ]
+    for record in records:
+        line = (
+            f'{record["host"]:<10} {record["trajectory"]:<4} '
+            f'{record["batch"]:<5} {_format(record["cpus"], "d"):>4} '
+            f'{record["steps"]:>8} '
+            f'{_format(record["wall_hours"], ".3f"):>7} '
+            f'{_format(record["cpu_hours"], ".3f"):>7} '
+            f'{_format(record["s_per_step"], ".5f"):>8} '
+            f'{_format(record["ns_per_day"], ".2f"):>7} '
+            f'{_format(record["memory_mb"], ".1f"):>7} '
+            f'{_format(record["relative"], ".2f"):>5}'
+        )
+        if (record['relative'] or 0) > 1 + tolerance:
+            line += '  SLOW'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def save_csv(file_path, records):
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+
+
+def plot_timeline(records, timings, output_file):
+    """Plot ns/day and memory of every TIMING interval per trajectory.
+
+    The batches of a trajectory are joined on a simulated time axis.
+    """
+    fig, (ax1, ax2) = pyplot().subplots(2, 1, sharex=True, figsize=(8, 6))
+    lines = {}
+    for record in records:
+        key = (record['host'], record['trajectory'])
+        timing = timings[(record['trajectory'], record['batch'])]
+        lines.setdefault(key, []).append(timing)
+    for ((host, trajectory), batch_timings) in lines.items():
+        ns = []
+        ns_per_day = []
+        memory = []
+        offset = 0
+        for timing in batch_timings:
+            if not timing.wall:
+                continue
+            timestep = timing.timestep or 1.0
+            steps = np.asarray(timing.steps) + offset
+            ns.append(steps * timestep * 1e-6)
+            ns_per_day.append(
+                86400 / np.asarray(timing.wall) * timestep * 1e-6)
+            memory.append(timing.memory)
+            offset = steps[-1]
+        if not ns:
+            continue
+        label = f'{host}/{trajectory}'
+        ax1.plot(np.concatenate(ns), np.concatenate(ns_per_day), label=label)
+        ax2.plot(np.concatenate(ns), np.concatenate(memory), label=label)
+    ax1.set_title('Throughput')
+    ax1.set_ylabel('ns/day')
+    ax1.legend(fontsize='small')
+    ax2.set_title('Memory')
+    ax2.set_xlabel('simulated time (ns)')
+    ax2.set_ylabel('MB')
+    fig.tight_layout()
+    save_figure(fig, output_file)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    arg_map = {
+        '--config': {
+            'dest': 'config',
+            'help': 'The simulation config from mdsim-batch-config',
+            'required': True,
+        },
+        '--project-dir': {
+            'dest': 'project_dir',
+            'help': 'The directory holding the trajectory directories',
+            'default': '.',
+        },
+        '--trajectories': {
+            'dest': 'trajectories',
+            'help': 'Only report these trajectories',
+            'nargs': '+',
+        },
+        '--tolerance': {
+            'dest': 'tolerance',
+            'help': ('Mark batches slower than the median by more than '
+                     'this fraction'),
+            'type': float,
+            'default': DEFAULT_TOLERANCE,
+        },
+        '--csv': {
+            'dest': 'csv',
+            'help': 'Save the table as CSV',
+        },
+        '--plot': {
+            'dest': 'plot',
+            'help': 'Save the timeline plot',
+        },
+    }
+    for (arg, arg_opts) in arg_map.items():
+        parser.add_argument(arg, **arg_opts)
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    if argv is not None:
+        args = parser.parse_args(argv[1:])
+    else:
+        args = parser.parse_args()
+    with open(args.config) as f:
+        sim_config = yaml.load(f, yaml.Loader)
+    records, timings = collect(
+        sim_config, args.project_dir, args.trajectories)
+    print(format_table(records, args.tolerance))
+    if args.csv:
+        save_csv(args.csv, records)
+        print(f'Saved table: {args.csv}')
+    if args.plot:
+        plot_timeline(records, timings, args.plot)
+        print(f'Saved plot: {args.plot}')
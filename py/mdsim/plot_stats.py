@@ -1,22 +1,23 @@
 #!/usr/bin/env python
 
 import argparse
+import os
 import sys
 from math import log
 from pathlib import Path
 
-import matplotlib.pyplot as plt
+import numpy as np
 import yaml
 
 import mdsim.defaults
+from mdsim.downsample import DEFAULT_MAX_POINTS, METHODS, downsample
+from mdsim.namdlog import concatenate_batches, read_energies
+from mdsim.render import pyplot, render, save_figure, use_agg
+from mdsim.statistics import detect_equilibration, summarize
 
 
-COL_TS = 1
-COL_KINETIC = 10
-COL_POTENTIAL = 13
-COL_TEMP = 12
-COL_TOTAL = 11
-COL_VOLUME = 18
+PROJECT_PLOT_CONFIG = 'analysis/prod_plot.yaml'
+EQUILIBRATION_COLUMNS = ('TEMP', 'TOTAL', 'VOLUME')
 
 
 def get_parser():
@@ -26,13 +27,64 @@ def get_parser():
             'dest': 'config',
             'help': 'The configuration file',
         },
+        '--project': {
+            'dest': 'project',
+            'help': ('Plot every trajectory of this simulation config from '
+                     'mdsim-batch-config'),
+        },
+        '--project-dir': {
+            'dest': 'project_dir',
+            'help': 'The directory holding the trajectory directories',
+            'default': '.',
+        },
+        '--jobs': {
+            'dest': 'jobs',
+            'help': 'The number of worker processes for --project',
+            'type': int,
+            'default': os.cpu_count(),
+        },
+        '--cache': {
+            'dest': 'cache',
+            'help': ('Cache parsed logs in .energy.npz sidecars next to '
+                     'them'),
+            'action': 'store_true',
+            'default': False,
+        },
+        '--no-cache': {
+            'dest': 'cache',
+            'help': 'Do not use or write parsed log caches (default)',
+            'action': 'store_false',
+            'default': False,
+        },
+        '--downsample': {
+            'dest': 'downsample',
+            'help': 'How to reduce long production timelines',
+            'choices': METHODS,
+        },
+        '--max-points': {
+            'dest': 'max_points',
+            'help': 'The most points to plot per production series',
+            'type': int,
+        },
+        '--trim-equilibration': {
+            'dest': 'trim_equilibration',
+            'help': ('Drop the equilibration and production steps before '
+                     'the detected equilibration'),
+            'action': 'store_true',
+        },
     }
     for (arg, arg_opts) in arg_map.items():
         parser.add_argument(arg, **arg_opts)
     return parser
 
 
-DEFAULTS = mdsim.defaults.load_plot_stats()
+def __getattr__(name):
+    # DEFAULTS is read on first use, not when mdsim-plot starts.
+    if name == 'DEFAULTS':
+        global DEFAULTS
+        DEFAULTS = mdsim.defaults.load_plot_stats()
+        return DEFAULTS
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def load_config(filepath=None):
@@ -73,27 +125,41 @@ def print_plot_step(config, section):
     print(f'    Saving plot to {output_path}')
 
 
+def trim_equilibration(energies, columns=EQUILIBRATION_COLUMNS):
+    """Return the energies from the detected equilibration on.
+
+    The start is the latest one detected for the columns, so all of them
+    are equilibrated. Their mean and standard error after it are printed.
+    """
+    columns = [column for column in columns
+               if column in energies.dtype.names]
+    if len(energies) < 2 or not columns:
+        return energies
+    starts, _, _ = detect_equilibration(
+        np.vstack([energies[column] for column in columns]))
+    energies = energies[int(starts.max()):]
+    print(f'    Equilibrated from ts {energies["TS"][0]}')
+    for column in columns:
+        summary = summarize(energies[column])
+        print(f'    {column}: {summary["mean"]:.4g} '
+              f'+/- {summary["sem"]:.2g} '
+              f'({summary["effective_samples"]:.1f} samples)')
+    return energies
+
+
 def plot_minimzation(config):
     suptitle = config['min'].get('suptitle', 'Minimization')
     input_file, output_file = file_path_pair(config, 'min')
     print_plot_step(config, 'min')
-    with open(input_file) as f:
-        ts = []
-        energy = []
-        for line in f.readlines():
-            if line.startswith('ENERGY:'):
-                cols = line.split()
-                ts.append(int(cols[COL_TS]))
-                energy.append(float(cols[COL_POTENTIAL]))
-        fig, ax = plt.subplots()
-        ax.plot(ts, energy)
-        ax.set_title(r'$E_{pot}$')
-        ax.set_xlabel('ts')
-        ax.set_ylabel(r'$E_{pot}$')
-        fig.suptitle(suptitle)
-        fig.tight_layout()
-        fig.savefig(output_file)
-
+    energies = read_energies(input_file, config.get('cache', False))
+    fig, ax = pyplot().subplots()
+    ax.plot(energies['TS'], energies['POTENTIAL'])
+    ax.set_title(r'$E_{pot}$')
+    ax.set_xlabel('ts')
+    ax.set_ylabel(r'$E_{pot}$')
+    fig.suptitle(suptitle)
+    fig.tight_layout()
+    save_figure(fig, output_file)
 
 
 def plot_heating(config):
@@ -101,27 +167,19 @@ def plot_heating(config):
     suptitle = config[section].get('suptitle', 'Heating')
     input_file, output_file = file_path_pair(config, section)
     print_plot_step(config, section)
-    with open(input_file) as f:
-        ts = []
-        energy = []
-        temp = []
-        for line in f.readlines():
-            if line.startswith('ENERGY:'):
-                cols = line.split()
-                ts.append(int(cols[COL_TS]))
-                temp.append(float(cols[COL_TEMP]))
-                energy.append(float(cols[COL_POTENTIAL]))
-        fig, (ax1, ax2) = plt.subplots(2, 1, sharex=True)
-        ax1.plot(ts, energy)
-        ax1.set_title('Potential Energy')
-        ax1.set_ylabel(r'$E_{pot}$')
-        ax2.plot(ts, temp)
-        ax2.set_title('Temperature')
-        ax2.set_xlabel('ts')
-        ax2.set_ylabel('temperature')
-        fig.suptitle(suptitle)
-        fig.tight_layout()
-        fig.savefig(output_file)
+    energies = read_energies(input_file, config.get('cache', False))
+    ts = energies['TS']
+    fig, (ax1, ax2) = pyplot().subplots(2, 1, sharex=True)
+    ax1.plot(ts, energies['POTENTIAL'])
+    ax1.set_title('Potential Energy')
+    ax1.set_ylabel(r'$E_{pot}$')
+    ax2.plot(ts, energies['TEMP'])
+    ax2.set_title('Temperature')
+    ax2.set_xlabel('ts')
+    ax2.set_ylabel('temperature')
+    fig.suptitle(suptitle)
+    fig.tight_layout()
+    save_figure(fig, output_file)
 
 
 def plot_equilibration(config):
@@ -129,72 +187,69 @@ def plot_equilibration(config):
     suptitle = config[section].get('suptitle', 'Equilibration')
     input_file, output_file = file_path_pair(config, section)
     print_plot_step(config, section)
-    with open(input_file) as f:
-        ts = []
-        temp = []
-        cell_size = []
-        for line in f.readlines():
-            if line.startswith('ENERGY:'):
-                cols = line.split()
-                ts.append(int(cols[COL_TS]))
-                temp.append(float(cols[COL_TEMP]))
-                cell_size.append(float(cols[COL_VOLUME])**(1/3.0))
-        fig, (ax1, ax2) = plt.subplots(2, 1, sharex=True)
-        ax1.plot(ts, temp)
-        ax1.set_title('Temperature')
-        ax1.set_ylabel('temperature')
-        ax2.plot(ts, cell_size)
-        ax2.set_title('Unit Cell Size')
-        ax2.set_xlabel('ts')
-        ax2.set_ylabel('Unit Cell Size')
-        fig.suptitle(suptitle)
-        fig.tight_layout()
-        fig.savefig(output_file)
+    energies = read_energies(input_file, config.get('cache', False))
+    if config.get('trim_equilibration'):
+        energies = trim_equilibration(energies, ('TEMP', 'VOLUME'))
+    ts = energies['TS']
+    cell_size = energies['VOLUME']**(1/3.0)
+    fig, (ax1, ax2) = pyplot().subplots(2, 1, sharex=True)
+    ax1.plot(ts, energies['TEMP'])
+    ax1.set_title('Temperature')
+    ax1.set_ylabel('temperature')
+    ax2.plot(ts, cell_size)
+    ax2.set_title('Unit Cell Size')
+    ax2.set_xlabel('ts')
+    ax2.set_ylabel('Unit Cell Size')
+    fig.suptitle(suptitle)
+    fig.tight_layout()
+    save_figure(fig, output_file)
+
+
+def downsample_options(config, section):
+    """Return the downsampling method and point limit for a section.
+
+    Command line options take precedence over the config section.
+    """
+    method = config.get('downsample') or config[section].get('downsample')
+    max_points = (
+        config.get('max_points') or config[section].get('max_points')
+    )
+    return (method or 'lttb', max_points or DEFAULT_MAX_POINTS)
 
 
 def plot_production(config):
     section = 'quench'
     suptitle = config[section].get('suptitle', 'Quench')
     input_files, output_file = file_path_pair(config, section)
+    if isinstance(input_files, Path):
+        input_files = [input_files]
     print_plot_step(config, section)
-    ts = []
-    i = 0
-    energy = []
-    temp = []
+    batches = []
     for input_file in input_files:
         print(input_file)
-        with open(input_file) as f:
-            for line in f.readlines():
-                if line.startswith('ENERGY:'):
-                    if i % len(input_files) == 0:
-                        cols = line.split()
-                        # t = int(cols[COL_TS])
-                        ts.append(i * 1000)
-                        temp.append(float(cols[COL_TEMP]))
-                        energy.append(float(cols[COL_TOTAL]))
-                    i += 1
-    fig, (ax1, ax2) = plt.subplots(2, 1, sharex=True)
-    ax1.plot(ts, energy, lw=0.7)
+        batches.append(read_energies(input_file, config.get('cache', False)))
+    energies = concatenate_batches(batches)
+    if config.get('trim_equilibration'):
+        energies = trim_equilibration(energies, ('TOTAL', 'TEMP'))
+    method, max_points = downsample_options(config, section)
+    ts = energies['TS']
+    ts_energy, energy = downsample(ts, energies['TOTAL'], method, max_points)
+    ts_temp, temp = downsample(ts, energies['TEMP'], method, max_points)
+    fig, (ax1, ax2) = pyplot().subplots(2, 1, sharex=True)
+    ax1.plot(ts_energy, energy, lw=0.7)
     # ax1.set_title('Total Energy')
     ax1.set_ylabel(r'$E_{total}$')
-    ax2.plot(ts, temp, lw=0.7)
+    ax2.plot(ts_temp, temp, lw=0.7)
     # ax2.set_title('Temperature')
     ax2.set_xlabel('ts')
     ax2.set_ylabel('temperature')
     fig.suptitle(suptitle)
     fig.tight_layout()
-    fig.savefig(output_file)
+    save_figure(fig, output_file)
 
 
-def main():
-    parser = get_parser()
-    args = parser.parse_args()
-    config = load_config(args.config)
-    if args.config:
-        config['config_path'] = args.config
-    else:
-        config['config_path'] = Path.cwd()
-
+def plot_config(config):
+    """Draw every plot in a config."""
     if 'min' in config:
         plot_minimzation(config)
 
@@ -208,5 +263,52 @@ def main():
         plot_production(config)
 
 
+def project_configs(sim_config, project_dir, options):
+    """Return the plot configs of all trajectories with one.
+
+    Each trajectory is plotted from its ``analysis/prod_plot.yaml``.
+    """
+    configs = []
+    for trajectory in sim_config['simulation']['trajectories']:
+        config_path = (Path(project_dir) / str(trajectory['trajectory'])
+                       / PROJECT_PLOT_CONFIG)
+        if not config_path.exists():
+            print(f'* Skipping trajectory {trajectory["trajectory"]}: '
+                  f'no {PROJECT_PLOT_CONFIG}')
+            continue
+        config = load_config(config_path)
+        config.update(options, config_path=str(config_path))
+        configs.append(config)
+    return configs
+
+
+def main(argv=None):
+    parser = get_parser()
+    if argv is not None:
+        args = parser.parse_args(argv[1:])
+    else:
+        args = parser.parse_args()
+    use_agg()
+    options = {
+        'cache': args.cache,
+        'downsample': args.downsample,
+        'max_points': args.max_points,
+        'trim_equilibration': args.trim_equilibration,
+    }
+    if args.project:
+        sim_config = load_config(args.project)
+        configs = project_configs(sim_config, args.project_dir, options)
+        render(((plot_config, (config,)) for config in configs), args.jobs)
+        return
+
+    config = load_config(args.config)
+    config.update(options)
+    if args.config:
+        config['config_path'] = args.config
+    else:
+        config['config_path'] = Path.cwd()
+    plot_config(config)
+
+
 if __name__ == '__main__':
     main()
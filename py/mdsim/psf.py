@@ -0,0 +1,153 @@
+"""Reading of CHARMM/X-PLOR PSF topology files.
+
+"""
+import numpy as np
+
+from mdsim.selection import compile_selection
+
+
+PROTEIN_RESNAMES = frozenset([
+    'ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'HSD',
+    'HSE', 'HSP', 'ILE', 'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR',
+    'TRP', 'TYR', 'VAL',
+])
+
+# Atoms lighter than this are treated as hydrogens.
+HYDROGEN_MAX_MASS = 1.5
+
+
+def _section_count(line, tag):
+    fields = line.split()
+    if len(fields) < 2 or not fields[1].startswith(tag):
+        return None
+    return int(fields[0])
+
+
+class PSF:
+    """Per-atom topology arrays read from a PSF file.
+
+    Each attribute is a NumPy array with one entry per atom, in file
+    order. ``residue`` numbers residues from zero in order of
+    appearance, like VMD's ``residue`` keyword. ``bonds`` is an
+    ``(n_bonds, 2)`` array of zero-based atom indices.
+
+    Atom selections, see `mdsim.selection`, are compiled and evaluated
+    once per PSF and then served from a cache.
+    """
+
+    def __init__(self, segid, resid, resname, name, type, charge, mass,
+                 bonds=None):
+        self.segid = segid
+        self.resid = resid
+        self.resname = resname
+        self.name = name
+        self.type = type
+        self.charge = charge
+        self.mass = mass
+        if bonds is None:
+            bonds = np.zeros((0, 2), dtype=np.int64)
+        self.bonds = bonds
+        self.residue = residue_indices(segid, resid)
+        self._masks = {}
+        self._indices = {}
+
+    def __repr__(self):
+        return f'<PSF: {self.n_atoms} atoms, {self.n_residues} residues>'
+
+    def __len__(self):
+        return self.n_atoms
+
+    @property
+    def n_atoms(self):
+        return len(self.name)
+
+    @property
+    def n_residues(self):
+        return int(self.residue[-1]) + 1 if self.n_atoms else 0
+
+    def is_protein(self):
+        return np.isin(self.resname, list(PROTEIN_RESNAMES))
+
+    def is_hydrogen(self):
+        return self.mass < HYDROGEN_MAX_MASS
+
+    def select(self, selection):
+        """Return the read-only boolean mask of a selection."""
+        mask = self._masks.get(selection)
+        if mask is None:
+            mask = np.asarray(compile_selection(selection)(self), dtype=bool)
+            mask.flags.writeable = False
+            self._masks[selection] = mask
+        return mask
+
+    def indices(self, selection):
+        """Return the read-only atom indices of a selection."""
+        indices = self._indices.get(selection)
+        if indices is None:
+            indices = np.flatnonzero(self.select(selection))
+            indices.flags.writeable = False
+            self._indices[selection] = indices
+        return indices
+
+    def total_charge(self, selection='all'):
+        return float(self.charge[self.select(selection)].sum())
+
+
+def residue_indices(segid, resid):
+    """Return zero-based residue numbers for per-atom segid and resid."""
+    if len(segid) == 0:
+        return np.zeros(0, dtype=np.int64)
+    changed = (segid[1:] != segid[:-1]) | (resid[1:] != resid[:-1])
+    return np.concatenate(([0], np.cumsum(changed)))
+
+
+def read_atom_lines(f, n_atoms):
+    fields = [next(f).split() for _ in range(n_atoms)]
+    columns = list(zip(*fields)) if fields else [()] * 8
+    resid = np.array(columns[2], dtype=str)
+    try:
+        resid = resid.astype(np.int64)
+    except ValueError:
+        # Keep insertion codes such as "16A" as strings.
+        pass
+    return {
+        'segid': np.array(columns[1], dtype=str),
+        'resid': resid,
+        'resname': np.array(columns[3], dtype=str),
+        'name': np.array(columns[4], dtype=str),
+        'type': np.array(columns[5], dtype=str),
+        'charge': np.array(columns[6], dtype=np.float64),
+        'mass': np.array(columns[7], dtype=np.float64),
+    }
+
+
+def read_bond_lines(f, n_bonds):
+    """Return zero-based bond pairs from the lines of a !NBOND section.
+
+    Each line holds up to four pairs of one-based atom numbers.
+    """
+    n_lines = -(-n_bonds // 4)
+    fields = ' '.join(next(f) for _ in range(n_lines)).split()
+    pairs = np.array(fields, dtype=np.int64).reshape(-1, 2)
+    return pairs[:n_bonds] - 1
+
+
+def read_psf(file_path):
+    """Read the atoms and bonds of a PSF file."""
+    atoms = None
+    with open(file_path) as f:
+        if not next(f).startswith('PSF'):
+            raise ValueError(f'Not a PSF file: {file_path}')
+        for line in f:
+            if atoms is None:
+                n_atoms = _section_count(line, '!NATOM')
+                if n_atoms is not None:
+                    atoms = read_atom_lines(f, n_atoms)
+                continue
+            n_bonds = _section_count(line, '!NBOND')
+            if n_bonds is not None:
+                atoms['bonds'] = read_bond_lines(f, n_bonds)
+                break
+    if atoms is None:
+        raise ValueError(f'No atoms in PSF file: {file_path}')
+    return PSF(**atoms)
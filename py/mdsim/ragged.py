@@ -0,0 +1,217 @@
+"""Ragged arrays of per-trajectory timeseries.
+
+Trajectories of one experiment can have different frame counts, for
+example while a batch is still running. A RaggedArray keeps all rows in
+one flat buffer with row offsets, so rows of any length are stored
+without padding and reductions run over segments of the buffer.
+
+"""
+import numpy as np
+
+
+class RaggedArray:
+    """Rows of different lengths stored in one flat buffer.
+
+    Row ``i`` is ``data[offsets[i]:offsets[i + 1]]``. Rows are indexed
+    along axis 0 and frames within a row along axis 1; any further axes
+    of ``data``, like residues, are kept as they are.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = np.asarray(data)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if self.offsets[0] != 0 or self.offsets[-1] != len(self.data):
+            raise ValueError('Offsets do not span the data')
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Copy a sequence of arrays into one preallocated buffer.
+
+        Empty arrays become empty rows whatever their shape.
+        """
+        arrays = [np.asarray(array) for array in arrays]
+        lengths = [len(array) for array in arrays]
+        filled = [array for array in arrays if len(array)] or arrays
+        inner_shape = filled[0].shape[1:] if filled else ()
+        dtype = np.result_type(*filled) if filled else np.float64
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        data = np.empty((offsets[-1],) + inner_shape, dtype=dtype)
+        for (i, array) in enumerate(arrays):
+            if len(array):
+                data[offsets[i]:offsets[i + 1]] = array
+        return cls(data, offsets)
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        """Wrap an ``(n_rows, n_frames, ...)`` array without copying."""
+        matrix = np.asarray(matrix)
+        n_rows, n_frames = matrix.shape[:2]
+        offsets = np.arange(n_rows + 1, dtype=np.int64) * n_frames
+        return cls(matrix.reshape((-1,) + matrix.shape[2:]), offsets)
+
+    def __repr__(self):
+        lengths = self.lengths
+        frames = (f'{lengths.min()} to {lengths.max()} frames'
+                  if len(self) else 'no frames')
+        return f'<RaggedArray: {len(self)} rows, {frames}>'
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, key):
+        """Return a row view for an integer, else a RaggedArray of rows."""
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError(f'Row index out of range: {key}')
+            return self.data[self.offsets[key]:self.offsets[key + 1]]
+        rows = np.arange(len(self))[key]
+        if not len(rows):
+            return RaggedArray(self.data[:0], [0])
+        if isinstance(key, slice) and (np.diff(rows) == 1).all():
+            # Consecutive rows share a contiguous piece of the buffer.
+            start = self.offsets[rows[0]]
+            stop = self.offsets[rows[-1] + 1]
+            return RaggedArray(self.data[start:stop],
+                               self.offsets[rows[0]:rows[-1] + 2] - start)
+        lengths = self.lengths[rows]
+        starts = self.offsets[rows]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        index = np.arange(offsets[-1]) - np.repeat(offsets[:-1] - starts,
+                                                   lengths)
+        return RaggedArray(self.data[index], offsets)
+
+    @property
+    def lengths(self):
+        """The number of frames in each row."""
+        return np.diff(self.offsets)
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def is_uniform(self):
+        """Whether all rows have the same length."""
+        return len(np.unique(self.lengths)) <= 1
+
+    def to_array(self):
+        """Return the rows as an ``(n_rows, n_frames, ...)`` view.
+
+        Raises ValueError if the rows have different lengths.
+        """
+        if not self.is_uniform:
+            raise ValueError('Rows have different lengths')
+        return self.data.reshape((len(self), -1) + self.data.shape[1:])
+
+    def _sum_dtype(self):
+        return np.zeros(1, dtype=self.dtype).sum().dtype
+
+    def _segment_sums(self):
+        """Return the sum of each row, with zeros for empty rows."""
+        lengths = self.lengths
+        result = np.zeros((len(self),) + self.data.shape[1:],
+                          dtype=self._sum_dtype())
+        filled = lengths > 0
+        if filled.any():
+            result[filled] = np.add.reduceat(
+                self.data, self.offsets[:-1][filled], axis=0)
+        return result
+
+    def _frame_sums(self):
+        """Return frame-wise sums over rows and the rows per frame."""
+        (sums, counts) = group_frame_sums(
+            self, np.zeros(len(self), dtype=np.int64), 1)
+        return (sums[0], counts[0])
+
+    def sum(self, axis=None):
+        """Sum all values, over rows frame-wise (0) or within rows (1).
+
+        Frame-wise sums run to the longest row and only include the rows
+        that reach each frame.
+        """
+        if axis is None:
+            return self.data.sum()
+        if axis == 0:
+            return self._frame_sums()[0]
+        if axis == 1:
+            return self._segment_sums()
+        raise ValueError(f'Invalid axis: {axis}')
+
+    def mean(self, axis=None):
+        """Average like `sum`, over the values that are present."""
+        if axis is None:
+            return self.data.mean()
+        if axis == 0:
+            sums, counts = self._frame_sums()
+        elif axis == 1:
+            sums, counts = self._segment_sums(), self.lengths
+        else:
+            raise ValueError(f'Invalid axis: {axis}')
+        counts = counts.reshape(counts.shape + (1,) * (sums.ndim - 1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts
+
+
+def as_ragged(rows):
+    """Return rows as a RaggedArray.
+
+    Arrays of equal-length rows are wrapped without copying, sequences
+    of arrays are copied into one buffer.
+    """
+    if isinstance(rows, RaggedArray):
+        return rows
+    if isinstance(rows, np.ndarray):
+        return RaggedArray.from_matrix(rows)
+    return RaggedArray.from_arrays(rows)
+
+
+def length_groups(xs):
+    """Yield row indices and ``(rows, frames)`` matrices of equal length.
+
+    A matrix is one group; a RaggedArray has one group per row length.
+    """
+    if isinstance(xs, RaggedArray):
+        lengths = xs.lengths
+        for length in np.unique(lengths):
+            rows = np.flatnonzero(lengths == length)
+            yield (rows, xs[rows].to_array())
+    else:
+        xs = np.asarray(xs)
+        yield (np.arange(len(xs)), xs)
+
+
+def group_frame_sums(xs, labels, n_groups=None):
+    """Return frame-wise sums over the rows of every group.
+
+    Row ``i`` belongs to group ``labels[i]``, or to none for -1. As for
+    `RaggedArray.sum` over axis 0, frames only sum the rows that reach
+    them. All groups are summed in one pass over the data, and the
+    result is ``(sums, counts)`` with one row of sums, and of the number
+    of rows summed per frame, for every group.
+    """
+    xs = as_ragged(xs)
+    labels = np.asarray(labels, dtype=np.int64)
+    if n_groups is None:
+        n_groups = int(labels.max(initial=-1)) + 1
+    lengths = xs.lengths
+    n_frames = int(lengths.max(initial=0))
+    row_labels = np.repeat(labels, lengths)
+    frames = np.arange(len(xs.data)) - np.repeat(xs.offsets[:-1], lengths)
+    member = row_labels >= 0
+    index = row_labels[member] * n_frames + frames[member]
+    size = n_groups * n_frames
+    if xs.data.ndim == 1:
+        sums = np.bincount(index, xs.data[member], minlength=size).astype(
+            xs._sum_dtype())
+    else:
+        sums = np.zeros((size,) + xs.data.shape[1:], dtype=xs._sum_dtype())
+        np.add.at(sums, index, xs.data[member])
+    counts = np.bincount(index, minlength=size)
+    return (sums.reshape((n_groups, n_frames) + xs.data.shape[1:]),
+            counts.reshape(n_groups, n_frames))
@@ -0,0 +1,63 @@
+"""Non-interactive figure rendering.
+
+Plots are only ever saved to files, so rendering uses the Agg backend,
+which needs no display and starts fastest, and every figure is closed
+once it is saved. Independent figures are rendered on a process pool
+with `render`; each task is a module level plot function and its
+arguments, so they can be sent to the workers.
+
+matplotlib is only imported by the first call to `pyplot`, so modules
+using it load fast on code paths that draw nothing.
+
+"""
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+
+
+BACKEND = 'Agg'
+
+
+def use_agg():
+    """Switch matplotlib to the Agg backend."""
+    import matplotlib
+    if matplotlib.get_backend().lower() != BACKEND.lower():
+        matplotlib.use(BACKEND)
+
+
+def pyplot():
+    """Return ``matplotlib.pyplot`` drawing with the Agg backend."""
+    use_agg()
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def save_figure(fig, output_file):
+    """Save a figure and close it to free its memory."""
+    fig.savefig(output_file)
+    pyplot().close(fig)
+
+
+def _render_task(task):
+    function, args = task
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        function(*args)
+    return output.getvalue()
+
+
+def render(tasks, jobs=1):
+    """Run ``(function, args)`` plot tasks, on a process pool if jobs > 1.
+
+    The output the tasks print is echoed in task order.
+    """
+    tasks = list(tasks)
+    use_agg()
+    if jobs == 1 or len(tasks) <= 1:
+        for (function, args) in tasks:
+            function(*args)
+        return
+    with ProcessPoolExecutor(
+            max_workers=jobs, initializer=use_agg) as executor:
+        for output in executor.map(_render_task, tasks):
+            print(output, end='', flush=True)
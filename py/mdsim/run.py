@@ -0,0 +1,442 @@
+"""Local scheduler for the NAMD batches of a simulation project.
+
+`mdsim-run` reads the ``simulation.trajectories`` config written by
+`mdsim-batch-config`. The batches of a trajectory run in order, each
+restarting from the restart files of its ``previous_batch``, while
+independent trajectories run side by side: the host's cores are split
+into blocks of ``--cores-per-job`` and every running NAMD job is pinned
+to its own block, with ``+p`` and ``+pemap`` for NAMD and the CPU
+affinity of the process.
+
+A failed batch is run again from the same restart files, up to
+``--retries`` times, before its trajectory is given up. Progress is kept
+in a JSON state file, so an interrupted run picks up where it stopped.
+On SIGTERM the running NAMD jobs are stopped and the state is saved.
+
+Several hosts may share a project directory. A host takes a trajectory
+by creating its ``.mdsim-run.lock`` file, and skips trajectories locked
+by others. Finished batches are appended to the ``batch.progress`` file
+of their trajectory, and batches listed there count as done, so hosts
+with their own state files see each other's progress.
+
+"""
+import argparse
+from datetime import datetime
+import os
+from pathlib import Path
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import yaml
+
+from mdsim.filestate import load_state, save_state
+
+
+STATE_FILE = '.mdsim-run.json'
+LOCK_FILE = '.mdsim-run.lock'
+HOST_SUFFIX = '.host'
+DEFAULT_CORES_PER_JOB = 16
+DEFAULT_RETRIES = 1
+DEFAULT_POLL_INTERVAL = 10.0
+TERMINATE_TIMEOUT = 30.0
+RESTART_FILES = (
+    'output/abfi_quench{batch}.coor',
+    'output/abfi_quench{batch}.vel',
+)
+PROGRESS_FILE = 'batch.progress'
+
+
+def available_cores(limit=None):
+    """Return the CPU ids this process may run on, at most ``limit``."""
+    try:
+        cores = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = list(range(os.cpu_count()))
+    return cores[:limit] if limit else cores
+
+
+def format_cpu_list(cores):
+    """Return CPU ids as a list of ranges, like ``0-15,32-47``."""
+    ranges = []
+    for core in sorted(cores):
+        if ranges and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return ','.join(
+        str(a) if a == b else f'{a}-{b}' for (a, b) in ranges)
+
+
+def namd_command(namd, config_file, cores):
+    return [namd, f'+p{len(cores)}', '+setcpuaffinity',
+            '+pemap', format_cpu_list(cores), config_file]
+
+
+def batch_files(batch):
+    name = f'abf_quench{batch}'
+    return (f'{name}.namd', f'output/{name}.out')
+
+
+def host_file(log_path):
+    """Return the file naming the host that wrote a batch log."""
+    return Path(log_path).with_suffix(HOST_SUFFIX)
+
+
+def restart_files(trajectory_dir, batch):
+    return [Path(trajectory_dir) / pattern.format(batch=batch)
+            for pattern in RESTART_FILES]
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def read_progress(trajectory_dir):
+    """Return the batch configs listed in ``batch.progress``."""
+    try:
+        with open(Path(trajectory_dir) / PROGRESS_FILE) as f:
+            return set(line.strip() for line in f)
+    except OSError:
+        return set()
+
+
+def record_progress(trajectory_dir, batch):
+    with open(Path(trajectory_dir) / PROGRESS_FILE, 'a') as f:
+        f.write(batch_files(batch)[0] + '\n')
+
+
+def lock_owner():
+    return f'{socket.gethostname()} {os.getpid()}'
+
+
+def _stale(owner):
+    """Return whether a lock was left by a dead process of this host."""
+    try:
+        (host, pid) = owner.split()
+        pid = int(pid)
+    except ValueError:
+        return False
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def acquire_lock(trajectory_dir):
+    """Lock a trajectory and return None, or return the owner of its lock.
+
+    The lock file is created with ``O_EXCL``, which is atomic on local
+    file systems and NFS. A lock left behind by a process of this host
+    that is no longer running is taken over.
+    """
+    lock_path = Path(trajectory_dir) / LOCK_FILE
+    for _ in range(2):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                         0o644)
+        except FileExistsError:
+            try:
+                owner = lock_path.read_text().strip()
+            except FileNotFoundError:
+                continue
+            if not _stale(owner):
+                return owner
+            try:
+                lock_path.unlink()
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, 'w') as f:
+            f.write(lock_owner() + '\n')
+        return None
+    return 'unknown'
+
+
+def release_lock(trajectory_dir):
+    lock_path = Path(trajectory_dir) / LOCK_FILE
+    try:
+        if lock_path.read_text().strip() == lock_owner():
+            lock_path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _terminate(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def mark_progress(trajectory_dir, batches, state, name):
+    """Record the batches listed in ``batch.progress`` as done."""
+    progress = read_progress(trajectory_dir)
+    for batch in batches:
+        if batch_files(batch['batch'])[0] in progress:
+            state[f'{name}/{batch["batch"]}']['status'] = 'done'
+
+
+def plan_batches(sim_config, project_dir, state):
+    """Return ``{trajectory: [batch configs]}`` and mark recorded progress.
+
+    Batches found in ``batch.progress`` files are recorded as done in
+    ``state``. Batches that failed, or were left running by an
+    interrupted scheduler, are run again.
+    """
+    plan = {}
+    for trajectory in sim_config['simulation']['trajectories']:
+        name = str(trajectory['trajectory'])
+        trajectory_dir = Path(project_dir) / name
+        progress = read_progress(trajectory_dir)
+        batches = []
+        for batch in trajectory['batches']:
+            batch = dict(batch, batch=str(batch['batch']))
+            key = f'{name}/{batch["batch"]}'
+            record = state.setdefault(key, {'status': 'pending',
+                                            'attempts': 0})
+            if batch_files(batch['batch'])[0] in progress:
+                record['status'] = 'done'
+            elif record['status'] in ('running', 'interrupted', 'failed',
+                                      'retry'):
+                record.update(status='pending', attempts=0)
+            batches.append(batch)
+        plan[name] = batches
+    return plan
+
+
+def next_batch(batches, state, name):
+    """Return the next batch of a trajectory to run, or None."""
+    for batch in batches:
+        status = state[f'{name}/{batch["batch"]}']['status']
+        if status == 'done':
+            continue
+        if status in ('pending', 'retry'):
+            return batch
+        return None
+    return None
+
+
+def start_batch(project_dir, name, batch, cores, namd):
+    """Start NAMD for a batch pinned to ``cores`` and return the process."""
+    trajectory_dir = Path(project_dir) / name
+    config_file, log_file = batch_files(batch['batch'])
+    (trajectory_dir / 'output').mkdir(exist_ok=True)
+    previous = batch.get('previous_batch')
+    if previous is not None:
+        missing = [str(path) for path in
+                   restart_files(trajectory_dir, previous)
+                   if not path.exists()]
+        if missing:
+            raise FileNotFoundError(
+                f'Missing restart files: {", ".join(missing)}')
+
+    def pin():
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cores)
+
+    host_file(trajectory_dir / log_file).write_text(
+        socket.gethostname() + '\n')
+    with open(trajectory_dir / log_file, 'wb') as log:
+        return subprocess.Popen(
+            namd_command(namd, config_file, cores), cwd=trajectory_dir,
+            stdout=log, stderr=subprocess.STDOUT, preexec_fn=pin)
+
+
+def run_simulation(sim_config, project_dir, cores, cores_per_job, namd,
+                   state, state_path=None, retries=DEFAULT_RETRIES,
+                   poll_interval=DEFAULT_POLL_INTERVAL):
+    """Run every pending batch and return the state.
+
+    ``cores`` are the CPU ids to use. Each job gets ``cores_per_job`` of
+    them, and jobs start whenever a block of cores is free and a
+    trajectory has a batch ready. A trajectory is locked while this
+    scheduler runs its batches; trajectories locked by another host are
+    skipped.
+    """
+    plan = plan_batches(sim_config, project_dir, state)
+    cores_per_job = max(1, min(cores_per_job, len(cores)))
+    free = list(cores)
+    running = {}
+    locked = set()
+    skipped = set()
+
+    def save():
+        if state_path is not None:
+            save_state(state_path, state)
+
+    def report(key, message):
+        print(f'{_now()}  {key}  {message}', flush=True)
+
+    def lock(name):
+        if name in locked:
+            return True
+        owner = acquire_lock(Path(project_dir) / name)
+        if owner is not None:
+            if name not in skipped:
+                skipped.add(name)
+                report(name, f'locked by {owner}, skipped')
+            return False
+        locked.add(name)
+        mark_progress(Path(project_dir) / name, plan[name], state, name)
+        return True
+
+    def unlock(name):
+        if name in locked:
+            release_lock(Path(project_dir) / name)
+            locked.discard(name)
+
+    save()
+    previous_handler = signal.signal(signal.SIGTERM, _terminate)
+    try:
+        while True:
+            for (name, batches) in plan.items():
+                if name in running or len(free) < cores_per_job:
+                    continue
+                if next_batch(batches, state, name) is None or not lock(name):
+                    continue
+                # Locking reads the progress of other hosts.
+                batch = next_batch(batches, state, name)
+                if batch is None:
+                    unlock(name)
+                    continue
+                key = f'{name}/{batch["batch"]}'
+                record = state[key]
+                job_cores, free = free[:cores_per_job], free[cores_per_job:]
+                record['attempts'] += 1
+                record['started'] = _now()
+                record['cores'] = format_cpu_list(job_cores)
+                record['host'] = socket.gethostname()
+                try:
+                    process = start_batch(
+                        project_dir, name, batch, job_cores, namd)
+                except OSError as error:
+                    free = sorted(free + job_cores)
+                    record['status'] = 'failed'
+                    record['error'] = str(error)
+                    report(key, f'failed: {error}')
+                    unlock(name)
+                    continue
+                record['status'] = 'running'
+                running[name] = (key, process, job_cores)
+                report(key, f'started on cores {record["cores"]}')
+            save()
+            if not running:
+                break
+            time.sleep(poll_interval)
+            for (name, (key, process, job_cores)) in list(running.items()):
+                returncode = process.poll()
+                if returncode is None:
+                    continue
+                del running[name]
+                free = sorted(free + job_cores)
+                record = state[key]
+                record['finished'] = _now()
+                record['returncode'] = returncode
+                if returncode == 0:
+                    record['status'] = 'done'
+                    record_progress(Path(project_dir) / name,
+                                    key.rpartition('/')[2])
+                    report(key, 'done')
+                    if all(state[f'{name}/{b["batch"]}']['status'] == 'done'
+                           for b in plan[name]):
+                        (Path(project_dir) / name / 'completed').touch()
+                elif record['attempts'] <= retries:
+                    record['status'] = 'retry'
+                    report(key, f'failed with exit code {returncode}, '
+                           'restarting from the previous batch')
+                else:
+                    record['status'] = 'failed'
+                    report(key, f'failed with exit code {returncode}')
+                if next_batch(plan[name], state, name) is None:
+                    unlock(name)
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        for (key, process, _) in running.values():
+            process.terminate()
+        for (key, process, _) in running.values():
+            try:
+                process.wait(TERMINATE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            state[key]['status'] = 'interrupted'
+            report(key, 'interrupted')
+        for name in list(locked):
+            unlock(name)
+        save()
+    return state
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    arg_map = {
+        '--config': {
+            'dest': 'config',
+            'help': 'The simulation config from mdsim-batch-config',
+            'required': True,
+        },
+        '--project-dir': {
+            'dest': 'project_dir',
+            'help': 'The directory holding the trajectory directories',
+            'default': '.',
+        },
+        '--cores': {
+            'dest': 'cores',
+            'help': 'The number of cores to use (default: all available)',
+            'type': int,
+        },
+        '--cores-per-job': {
+            'dest': 'cores_per_job',
+            'help': 'The number of cores of each NAMD job',
+            'type': int,
+            'default': DEFAULT_CORES_PER_JOB,
+        },
+        '--namd': {
+            'dest': 'namd',
+            'help': 'The NAMD executable',
+            'default': 'namd2',
+        },
+        '--retries': {
+            'dest': 'retries',
+            'help': 'How often to restart a failed batch',
+            'type': int,
+            'default': DEFAULT_RETRIES,
+        },
+        '--state': {
+            'dest': 'state',
+            'help': f'The state file (default: PROJECT_DIR/{STATE_FILE})',
+        },
+        '--poll-interval': {
+            'dest': 'poll_interval',
+            'help': 'Seconds between checks of the running jobs',
+            'type': float,
+            'default': DEFAULT_POLL_INTERVAL,
+        },
+    }
+    for (arg, arg_opts) in arg_map.items():
+        parser.add_argument(arg, **arg_opts)
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    if argv is not None:
+        args = parser.parse_args(argv[1:])
+    else:
+        args = parser.parse_args()
+    with open(args.config) as f:
+        sim_config = yaml.load(f, yaml.Loader)
+    state_path = args.state or Path(args.project_dir) / STATE_FILE
+    state = run_simulation(
+        sim_config, args.project_dir, available_cores(args.cores),
+        args.cores_per_job, args.namd, load_state(state_path), state_path,
+        args.retries, args.poll_interval)
+    statuses = [record['status'] for record in state.values()]
+    print(f'{statuses.count("done")} of {len(statuses)} batches done')
+    if 'failed' in statuses:
+        sys.exit(1)
@@ -0,0 +1,241 @@
+"""Atom selections over PSF topologies.
+
+A small subset of VMD's selection language. Selections combine
+keyword tests with ``and``, ``or``, ``not`` and parentheses::
+
+    protein and resid 16 to 18 and name CA
+    resname IBU2 and not hydrogen
+    segid ABF and (name N or name HN)
+    mass > 30 or charge < -0.5
+
+String keywords (``name``, ``type``, ``resname``, ``segid``) and
+numeric keywords (``resid``, ``residue``, ``index``) take one or more
+values, and numeric keywords also ranges ``a to b``. ``charge``,
+``mass``, ``resid``, ``residue`` and ``index`` can be compared with
+``<``, ``<=``, ``>``, ``>=``, ``==`` and ``!=``. ``all``, ``none``,
+``protein``, ``water``, ``hydrogen``, ``noh`` and ``backbone`` select
+atom classes.
+
+Selections compile to functions of a PSF returning a boolean mask.
+
+"""
+import operator
+import re
+
+import numpy as np
+
+
+STRING_KEYWORDS = {
+    'name': 'name',
+    'type': 'type',
+    'resname': 'resname',
+    'segid': 'segid',
+    'segname': 'segid',
+}
+NUMERIC_KEYWORDS = ('resid', 'residue', 'index', 'charge', 'mass')
+
+WATER_RESNAMES = ('TIP3', 'TIP3P', 'TIP4', 'TIP4P', 'SPC', 'SPCE', 'WAT',
+                  'HOH')
+BACKBONE_NAMES = ('N', 'CA', 'C', 'O')
+
+RESERVED = frozenset(['and', 'or', 'not', 'to', '(', ')'])
+
+COMPARISONS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+TOKEN_RE = re.compile(
+    r'\s*(?:"([^"]*)"|\'([^\']*)\'|(<=|>=|==|!=|<|>|\(|\))|([^\s()<>=!]+))')
+
+
+def tokenize(text):
+    """Split a selection into words, quoted strings and operators."""
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = TOKEN_RE.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError(f'Invalid selection: {text!r}')
+        quoted = match.group(1)
+        if quoted is None:
+            quoted = match.group(2)
+        if quoted is not None:
+            tokens.append(('value', quoted))
+        else:
+            tokens.append(('word', match.group(3) or match.group(4)))
+        position = match.end()
+    return tokens
+
+
+def _field(psf, keyword):
+    if keyword == 'index':
+        return np.arange(psf.n_atoms)
+    return getattr(psf, keyword)
+
+
+def _singleton(word):
+    if word == 'all':
+        return lambda psf: np.ones(psf.n_atoms, dtype=bool)
+    if word == 'none':
+        return lambda psf: np.zeros(psf.n_atoms, dtype=bool)
+    if word == 'protein':
+        return lambda psf: psf.is_protein()
+    if word == 'water':
+        return lambda psf: np.isin(psf.resname, WATER_RESNAMES)
+    if word == 'hydrogen':
+        return lambda psf: psf.is_hydrogen()
+    if word == 'noh':
+        return lambda psf: ~psf.is_hydrogen()
+    if word == 'backbone':
+        return lambda psf: (
+            psf.is_protein() & np.isin(psf.name, BACKBONE_NAMES))
+    return None
+
+
+def _number(keyword, word):
+    try:
+        return float(word) if keyword in ('charge', 'mass') else int(word)
+    except ValueError:
+        raise ValueError(f'Invalid {keyword} value: {word!r}')
+
+
+class _Parser:
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def error(self, message):
+        return ValueError(f'{message} in selection: {self.text!r}')
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def accept(self, word):
+        if self.peek() == ('word', word):
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        if not self.tokens:
+            raise self.error('Empty expression')
+        result = self.parse_or()
+        if self.position != len(self.tokens):
+            raise self.error(f'Unexpected {self.peek()[1]!r}')
+        return result
+
+    def parse_or(self):
+        result = self.parse_and()
+        while self.accept('or'):
+            result = _combine(operator.or_, result, self.parse_and())
+        return result
+
+    def parse_and(self):
+        result = self.parse_not()
+        while self.accept('and'):
+            result = _combine(operator.and_, result, self.parse_not())
+        return result
+
+    def parse_not(self):
+        if self.accept('not'):
+            inner = self.parse_not()
+            return lambda psf: ~inner(psf)
+        return self.parse_primary()
+
+    def parse_primary(self):
+        kind, word = self.next()
+        if word is None:
+            raise self.error('Unexpected end')
+        if kind == 'word' and word == '(':
+            result = self.parse_or()
+            if not self.accept(')'):
+                raise self.error('Missing )')
+            return result
+        if kind == 'word':
+            singleton = _singleton(word)
+            if singleton is not None:
+                return singleton
+            if word in STRING_KEYWORDS:
+                return self.parse_strings(STRING_KEYWORDS[word])
+            if word in NUMERIC_KEYWORDS:
+                return self.parse_numbers(word)
+        raise self.error(f'Unknown keyword {word!r}')
+
+    def values(self):
+        values = []
+        while True:
+            kind, word = self.peek()
+            if word is None or (kind == 'word' and word in RESERVED):
+                break
+            if kind == 'word' and word in COMPARISONS:
+                break
+            values.append(word)
+            self.position += 1
+        return values
+
+    def parse_strings(self, field):
+        values = self.values()
+        if not values:
+            raise self.error(f'No values for {field}')
+        return lambda psf: np.isin(_field(psf, field), values)
+
+    def parse_numbers(self, keyword):
+        kind, word = self.peek()
+        if kind == 'word' and word in COMPARISONS:
+            self.position += 1
+            compare = COMPARISONS[word]
+            value = _number(keyword, self.next()[1] or '')
+            return lambda psf: compare(_field(psf, keyword), value)
+        values = []
+        ranges = []
+        words = self.values()
+        while self.accept('to'):
+            if not words:
+                raise self.error('Range without a start')
+            start = words.pop()
+            end_words = self.values()
+            if not end_words:
+                raise self.error('Range without an end')
+            ranges.append((_number(keyword, start),
+                           _number(keyword, end_words[0])))
+            values.extend(words)
+            words = end_words[1:]
+        values.extend(words)
+        if not values and not ranges:
+            raise self.error(f'No values for {keyword}')
+        numbers = [_number(keyword, value) for value in values]
+
+        def select(psf):
+            field = _field(psf, keyword)
+            mask = np.isin(field, numbers)
+            for (start, end) in ranges:
+                mask |= (field >= start) & (field <= end)
+            return mask
+        return select
+
+
+def _combine(op, left, right):
+    return lambda psf: op(left(psf), right(psf))
+
+
+def compile_selection(text):
+    """Compile a selection into a function from a PSF to a boolean mask.
+
+    Raises ValueError for invalid selections.
+    """
+    return _Parser(text).parse()
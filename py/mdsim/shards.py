@@ -0,0 +1,192 @@
+"""Per-batch analysis results stored as NumPy shards.
+
+A shard directory, named like ``sstructure-ibu01.shards``, holds one
+``<batch>.npy`` file of ``(n_frames, n_columns)`` results per simulation
+batch and a ``manifest.json`` recording the frame range of every batch
+in trajectory order. Adding a batch only writes its own shard and the
+manifest.
+
+`open_shards` returns a ShardedArray that reads like the concatenated
+matrix, but memory-maps shards on demand and only copies the frames
+that are indexed.
+
+"""
+import json
+import os
+from pathlib import Path
+import tempfile
+
+import numpy as np
+
+
+MANIFEST = 'manifest.json'
+SHARD_SUFFIX = '.shards'
+
+
+def shard_path(directory, batch):
+    return Path(directory) / f'{batch}.npy'
+
+
+def is_sharded(path):
+    """Return True if path is a shard directory with a manifest."""
+    return (Path(path) / MANIFEST).is_file()
+
+
+def _replace_file(path, write):
+    fd, tmp_path = tempfile.mkstemp(prefix=path.name, dir=path.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_shard(directory, batch, array, update_manifest=True):
+    """Save the results of one batch as a shard.
+
+    With ``update_manifest`` the manifest is rewritten to include it.
+    Writers running in parallel should leave that to a single
+    `write_manifest` call once they are done.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    array = np.asarray(array)
+    if array.ndim != 2:
+        raise ValueError(f'Shards are 2D, got shape {array.shape}')
+    _replace_file(shard_path(directory, batch),
+                  lambda f: np.save(f, array))
+    if update_manifest:
+        write_manifest(directory)
+
+
+def write_manifest(directory, batches=None):
+    """Write the manifest of the shards of ``batches``, in that order.
+
+    By default all shards in the directory are included, ordered by
+    batch name. Returns the manifest.
+    """
+    directory = Path(directory)
+    if batches is None:
+        batches = sorted(path.stem for path in directory.glob('*.npy'))
+    shards = []
+    start = 0
+    dtype = None
+    n_columns = None
+    for batch in batches:
+        array = np.load(shard_path(directory, batch), mmap_mode='r')
+        if dtype is None:
+            dtype = array.dtype
+            n_columns = array.shape[1]
+        elif array.dtype != dtype or array.shape[1] != n_columns:
+            raise ValueError(
+                f'Shard {batch} has {array.shape[1]} columns of '
+                f'{array.dtype}, expected {n_columns} of {dtype}')
+        stop = start + len(array)
+        shards.append({
+            'batch': str(batch),
+            'file': shard_path(directory, batch).name,
+            'start': start,
+            'stop': stop,
+        })
+        start = stop
+    manifest = {
+        'dtype': np.dtype(np.float64 if dtype is None else dtype).str,
+        'columns': n_columns or 0,
+        'frames': start,
+        'shards': shards,
+    }
+    _replace_file(directory / MANIFEST,
+                  lambda f: f.write(json.dumps(manifest, indent=1).encode()))
+    return manifest
+
+
+def read_manifest(directory):
+    with open(Path(directory) / MANIFEST) as f:
+        return json.load(f)
+
+
+class ShardedArray:
+    """Batch shards read as one ``(n_frames, n_columns)`` matrix.
+
+    Integer indices, slices and index arrays select frames; only the
+    shards holding them are mapped, and only the selected frames are
+    copied.
+    """
+
+    def __init__(self, directory, manifest):
+        self.directory = Path(directory)
+        self.manifest = manifest
+        shards = manifest['shards']
+        self.batches = [shard['batch'] for shard in shards]
+        self.starts = np.array([s['start'] for s in shards], dtype=np.int64)
+        self.stops = np.array([s['stop'] for s in shards], dtype=np.int64)
+        self.dtype = np.dtype(manifest['dtype'])
+        self.shape = (int(manifest['frames']), int(manifest['columns']))
+        self._arrays = {}
+
+    def __repr__(self):
+        return (f'<ShardedArray {self.directory.name}: '
+                f'{len(self.batches)} shards, shape {self.shape}>')
+
+    def __len__(self):
+        return self.shape[0]
+
+    def frame_ranges(self):
+        """Return ``{batch: (start, stop)}`` frame ranges."""
+        return dict(
+            (batch, (int(start), int(stop)))
+            for (batch, start, stop) in zip(self.batches, self.starts,
+                                            self.stops))
+
+    def shard(self, i):
+        """Return shard ``i`` as a read-only memory map."""
+        array = self._arrays.get(i)
+        if array is None:
+            entry = self.manifest['shards'][i]
+            array = np.load(self.directory / entry['file'], mmap_mode='r')
+            expected = entry['stop'] - entry['start']
+            if len(array) != expected:
+                raise ValueError(
+                    f'Shard {entry["file"]} has {len(array)} frames, '
+                    f'the manifest {expected}')
+            self._arrays[i] = array
+        return array
+
+    def take(self, frames):
+        """Return the given frame indices as a new array."""
+        frames = np.asarray(frames, dtype=np.int64)
+        if frames.size and (frames.min() < 0 or frames.max() >= len(self)):
+            raise IndexError('Frame index out of range')
+        result = np.empty((len(frames), self.shape[1]), dtype=self.dtype)
+        shard_ids = np.searchsorted(self.stops, frames, side='right')
+        for i in np.unique(shard_ids):
+            selected = shard_ids == i
+            result[selected] = self.shard(int(i))[
+                frames[selected] - self.starts[i]]
+        return result
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            i = int(key) + len(self) if key < 0 else int(key)
+            return self.take([i])[0]
+        if isinstance(key, slice):
+            return self.take(np.arange(*key.indices(len(self))))
+        frames = np.asarray(key)
+        if frames.dtype == bool:
+            frames = np.flatnonzero(frames)
+        frames = np.where(frames < 0, frames + len(self), frames)
+        return self.take(frames)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_array().astype(dtype or self.dtype, copy=False)
+
+    def to_array(self):
+        """Return all frames as one array."""
+        return self[:]
+
+
+def open_shards(directory):
+    """Open a shard directory as a ShardedArray."""
+    return ShardedArray(directory, read_manifest(directory))
@@ -0,0 +1,58 @@
+"""Sidecar caches of arrays parsed from input files.
+
+A sidecar is a ``.npz`` file stored next to its source file. It records
+the size and modification time of the source, and is only used while
+both still match.
+
+"""
+import os
+from pathlib import Path
+import tempfile
+
+import numpy as np
+
+
+KEY_FIELD = '_source_key'
+
+
+def sidecar_path(file_path, suffix):
+    path = Path(file_path)
+    return path.with_name(path.name + suffix)
+
+
+def source_key(file_path):
+    """Return the (size, mtime) key of a file."""
+    st = os.stat(file_path)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def load(file_path, suffix):
+    """Return the cached arrays for a file, or None when stale or missing."""
+    cache_path = sidecar_path(file_path, suffix)
+    try:
+        with np.load(cache_path) as data:
+            if not np.array_equal(data[KEY_FIELD], source_key(file_path)):
+                return None
+            return {k: data[k] for k in data.files if k != KEY_FIELD}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def save(file_path, suffix, arrays):
+    """Cache arrays for a file. Unwritable locations are skipped."""
+    cache_path = sidecar_path(file_path, suffix)
+    arrays = dict(arrays)
+    arrays[KEY_FIELD] = source_key(file_path)
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=cache_path.name, dir=cache_path.parent)
+    except OSError:
+        return None
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        os.unlink(tmp_path)
+        return None
+    return cache_path
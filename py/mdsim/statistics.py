@@ -0,0 +1,282 @@
+"""Error estimates for correlated timeseries.
+
+Successive MD frames are correlated, so the spread of the frames
+understates the error of their mean. The statistical inefficiency ``g``
+is the number of frames per independent sample, estimated from the
+FFT autocorrelation function with Sokal's automatic window, or seen as
+the plateau of block averaging. The standard error of a mean of ``n``
+frames is then ``std * sqrt(g / n)``.
+
+The functions take a single series, an ``(n_series, n_frames)`` matrix
+like the trajectories x frames matrix of `mdsim.stride.process_files`,
+or a RaggedArray of series, and handle all series of the same length in
+one vectorized call. ENERGY columns of `mdsim.namdlog.read_energies`
+are single series.
+
+`detect_equilibration` finds the end of the burn-in of every series,
+and `trim` drops it before any statistics are taken.
+
+`bootstrap_mean` resamples whole trajectories, which are independent,
+to get confidence intervals of a mean over trajectories.
+
+"""
+import numpy as np
+
+from mdsim.ragged import RaggedArray, length_groups
+
+
+DEFAULT_WINDOW = 5.0
+DEFAULT_MIN_BLOCKS = 4
+DEFAULT_RESAMPLES = 1000
+DEFAULT_CONFIDENCE = 0.95
+BOOTSTRAP_BATCH_SIZE = 100
+DEFAULT_CANDIDATES = 100
+DEFAULT_MAX_DISCARD = 0.5
+
+
+def _per_series(function, xs):
+    """Return ``function`` of every series, grouped by length.
+
+    ``function`` maps an ``(n_series, n_frames)`` float matrix to one
+    result per series.
+    """
+    if not isinstance(xs, RaggedArray):
+        xs = np.asarray(xs, dtype=np.float64)
+        if xs.ndim == 1:
+            return function(xs[np.newaxis])[0]
+        return function(xs)
+    results = [None] * len(xs)
+    for (rows, matrix) in length_groups(xs):
+        values = function(np.asarray(matrix, dtype=np.float64))
+        for (row, value) in zip(rows, values):
+            results[row] = value
+    return results
+
+
+def _autocorrelation(matrix):
+    n_frames = matrix.shape[1]
+    centered = matrix - matrix.mean(axis=1, keepdims=True)
+    # Zero padding to twice the length avoids circular correlation.
+    size = 1 << max(2 * n_frames - 1, 1).bit_length()
+    spectrum = np.fft.rfft(centered, size, axis=1)
+    acov = np.fft.irfft(spectrum * spectrum.conj(), size,
+                        axis=1)[:, :n_frames]
+    variance = acov[:, :1]
+    result = np.zeros_like(acov)
+    result[:, :1] = 1.0
+    varying = variance[:, 0] > 0
+    result[varying] = acov[varying] / variance[varying]
+    return result
+
+
+def autocorrelation(xs):
+    """Return the normalized autocorrelation function of every series.
+
+    Lags run from 0 to the series length. A constant series has no
+    correlation beyond lag 0.
+    """
+    result = _per_series(_autocorrelation, xs)
+    if isinstance(xs, RaggedArray):
+        return RaggedArray.from_arrays(result)
+    return result
+
+
+def _statistical_inefficiency(matrix, window):
+    n_series, n_frames = matrix.shape
+    if n_frames < 2:
+        return np.ones(n_series)
+    rho = _autocorrelation(matrix)
+    # tau(M) = 1/2 + sum of rho up to lag M, for M = 1 .. n_frames - 1.
+    tau = 0.5 + np.cumsum(rho[:, 1:], axis=1)
+    lags = np.arange(1, n_frames)
+    done = lags >= window * tau
+    cutoff = np.where(done.any(axis=1), np.argmax(done, axis=1),
+                      n_frames - 2)
+    tau_int = tau[np.arange(n_series), cutoff]
+    return np.maximum(2 * tau_int, 1.0)
+
+
+def statistical_inefficiency(xs, window=DEFAULT_WINDOW):
+    """Return the statistical inefficiency ``g`` of every series.
+
+    ``g = 1 + 2 * sum(rho(t))``, summed up to the first lag ``M`` with
+    ``M >= window * tau(M)``, and at least 1.
+    """
+    result = _per_series(
+        lambda matrix: _statistical_inefficiency(matrix, window), xs)
+    return np.asarray(result, dtype=np.float64)
+
+
+def integrated_autocorrelation_time(xs, window=DEFAULT_WINDOW):
+    """Return the integrated autocorrelation time of every series in frames.
+
+    This is ``g / 2`` of `statistical_inefficiency`, so uncorrelated
+    frames have 1/2.
+    """
+    return statistical_inefficiency(xs, window) / 2
+
+
+def effective_sample_size(xs, window=DEFAULT_WINDOW):
+    """Return the number of independent samples in every series."""
+    lengths = (xs.lengths if isinstance(xs, RaggedArray)
+               else np.asarray(xs).shape[-1])
+    return lengths / statistical_inefficiency(xs, window)
+
+
+def standard_error(xs, window=DEFAULT_WINDOW):
+    """Return the standard error of the mean of every series.
+
+    The variance of the frames is scaled by the statistical
+    inefficiency.
+    """
+    def function(matrix):
+        g = _statistical_inefficiency(matrix, window)
+        return np.sqrt(matrix.var(axis=1) * g / matrix.shape[1])
+    return np.asarray(_per_series(function, xs), dtype=np.float64)
+
+
+def default_block_sizes(n_frames, min_blocks=DEFAULT_MIN_BLOCKS):
+    """Return block sizes 1, 2, 4, ... leaving at least ``min_blocks``."""
+    sizes = [1]
+    while n_frames // (sizes[-1] * 2) >= min_blocks:
+        sizes.append(sizes[-1] * 2)
+    return np.array(sizes)
+
+
+def block_average(xs, block_sizes=None):
+    """Return block sizes and the block standard error of every series.
+
+    Each series is cut into blocks of every size, dropping the frames
+    left over at the end, and the standard error of the mean is
+    estimated from the spread of the block means. Once blocks are
+    longer than the correlation time the estimate reaches a plateau,
+    the honest standard error. The result is ``(block_sizes, errors)``
+    with one row of errors per series; sizes leaving fewer than two
+    blocks give NaN. By default the sizes are `default_block_sizes` of
+    the shortest series.
+    """
+    if block_sizes is None:
+        lengths = (xs.lengths if isinstance(xs, RaggedArray)
+                   else np.asarray(xs).shape[-1:])
+        block_sizes = default_block_sizes(int(np.min(lengths)))
+    block_sizes = np.asarray(block_sizes, dtype=np.int64)
+
+    def function(matrix):
+        n_series, n_frames = matrix.shape
+        errors = np.full((n_series, len(block_sizes)), np.nan)
+        for (i, size) in enumerate(block_sizes):
+            n_blocks = n_frames // size
+            if n_blocks < 2:
+                continue
+            means = matrix[:, :n_blocks * size].reshape(
+                n_series, n_blocks, size).mean(axis=2)
+            errors[:, i] = means.std(axis=1, ddof=1) / np.sqrt(n_blocks)
+        return errors
+
+    return (block_sizes, np.asarray(_per_series(function, xs)))
+
+
+def summarize(x, window=DEFAULT_WINDOW):
+    """Return the mean, standard error and inefficiency of one series."""
+    x = np.asarray(x, dtype=np.float64)
+    g = float(statistical_inefficiency(x, window))
+    return {
+        'mean': float(x.mean()),
+        'sem': float(np.sqrt(x.var() * g / len(x))),
+        'statistical_inefficiency': g,
+        'effective_samples': len(x) / g,
+    }
+
+
+def _detect_equilibration(matrix, n_candidates, max_discard, window):
+    n_series, n_frames = matrix.shape
+    last = max(int(n_frames * max_discard), 0)
+    starts = np.unique(np.linspace(0, last, n_candidates).astype(np.int64))
+    starts = starts[n_frames - starts >= 2] if n_frames >= 2 else starts[:1]
+    samples = np.empty((n_series, len(starts)))
+    for (i, start) in enumerate(starts):
+        g = _statistical_inefficiency(matrix[:, start:], window)
+        samples[:, i] = (n_frames - start) / g
+    best = np.argmax(samples, axis=1)
+    rows = np.arange(n_series)
+    return np.column_stack(
+        (starts[best], (n_frames - starts[best]) / samples[rows, best],
+         samples[rows, best]))
+
+
+def detect_equilibration(xs, n_candidates=DEFAULT_CANDIDATES,
+                         max_discard=DEFAULT_MAX_DISCARD,
+                         window=DEFAULT_WINDOW):
+    """Return the equilibrated start of every series.
+
+    The start ``t0`` maximizes the number of effectively uncorrelated
+    frames ``(n_frames - t0) / g(t0)`` of the rest of the series.
+    ``n_candidates`` starts are tried, evenly spaced over the first
+    ``max_discard`` of the series, each for all series of a length at
+    once. Returns the arrays ``(t0, g, effective_samples)``.
+    """
+    def function(matrix):
+        return _detect_equilibration(
+            matrix, n_candidates, max_discard, window)
+    result = np.asarray(_per_series(function, xs), dtype=np.float64)
+    if result.ndim == 1:
+        return (int(result[0]), result[1], result[2])
+    return (result[:, 0].astype(np.int64), result[:, 1], result[:, 2])
+
+
+def trim(xs, starts):
+    """Return every series from its start as a RaggedArray."""
+    starts = np.broadcast_to(starts, (len(xs),))
+    return RaggedArray.from_arrays(
+        [x[start:] for (x, start) in zip(xs, starts)])
+
+
+def _padded(values):
+    """Return values as a float matrix and a mask of present frames."""
+    if isinstance(values, RaggedArray):
+        n_frames = int(values.lengths.max(initial=0))
+        matrix = np.zeros((len(values), n_frames))
+        mask = np.zeros((len(values), n_frames))
+        for (i, row) in enumerate(values):
+            matrix[i, :len(row)] = row
+            mask[i, :len(row)] = 1.0
+        return (matrix, mask)
+    matrix = np.asarray(values, dtype=np.float64)
+    return (matrix, None)
+
+
+def bootstrap_mean(values, n_resamples=DEFAULT_RESAMPLES,
+                   confidence=DEFAULT_CONFIDENCE, seed=None):
+    """Return the mean over rows and its bootstrap confidence interval.
+
+    ``values`` holds one number per trajectory, or one series per
+    trajectory as a matrix or RaggedArray, for frame-wise intervals over
+    the trajectories reaching each frame. Trajectories are resampled
+    with replacement; each batch of resamples is a matrix product of
+    resampling counts with the values. Returns ``(mean, low, high)``.
+    """
+    matrix, mask = _padded(values)
+    scalar = matrix.ndim == 1
+    if scalar:
+        matrix = matrix[:, np.newaxis]
+    n_rows = len(matrix)
+    if n_rows == 0:
+        raise ValueError('Cannot bootstrap without values')
+    rng = np.random.default_rng(seed)
+    estimates = np.empty((n_resamples,) + matrix.shape[1:])
+    for start in range(0, n_resamples, BOOTSTRAP_BATCH_SIZE):
+        stop = min(start + BOOTSTRAP_BATCH_SIZE, n_resamples)
+        counts = rng.multinomial(
+            n_rows, np.full(n_rows, 1 / n_rows), size=stop - start)
+        sums = counts @ matrix
+        present = n_rows if mask is None else counts @ mask
+        with np.errstate(invalid='ignore', divide='ignore'):
+            estimates[start:stop] = sums / present
+    alpha = (1 - confidence) / 2
+    low, high = np.nanquantile(estimates, [alpha, 1 - alpha], axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (matrix.mean(axis=0) if mask is None
+                else matrix.sum(axis=0) / mask.sum(axis=0))
+    if scalar:
+        return (float(mean[0]), float(low[0]), float(high[0]))
+    return (mean, low, high)
@@ -3,12 +3,37 @@
 """
 import sys
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import os
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import numpy as np
 import yaml
-from scipy.signal import savgol_filter
+
+from mdsim.cache import CACHE_DIR, DEFAULT_MAX_BYTES, Cache, cached
+from mdsim.ragged import (
+    RaggedArray, as_ragged, group_frame_sums, length_groups)
+from mdsim.render import pyplot, render, save_figure
+from mdsim.shards import is_sharded, open_shards
+from mdsim.statistics import (
+    bootstrap_mean, detect_equilibration, standard_error,
+    statistical_inefficiency, trim)
+
+
+# Secondary structure letters written by VMD/STRIDE. Each frame is
+# encoded as one uint8 code per residue, indexing into this string.
+# Any other letter is encoded as UNKNOWN_CODE.
+STRUCTURES = 'HGIEBTC'
+HELIX_STRUCTURES = 'HGI'
+UNKNOWN_CODE = len(STRUCTURES)
+N_CODES = len(STRUCTURES) + 1
+
+CODE_TABLE = np.full(256, UNKNOWN_CODE, dtype=np.uint8)
+for (code, letter) in enumerate(STRUCTURES):
+    CODE_TABLE[ord(letter)] = code
+
+HELIX_CODES = [STRUCTURES.index(letter) for letter in HELIX_STRUCTURES]
 
 
 def process_line(line):
@@ -29,31 +54,125 @@ def count_all(d):
     return sum(d.values())
 
 
-def process_file(file_path):
-    ts_helix = []
-    ts_all = []
-    with open(file_path) as f:
-        for line in f.readlines():
-            structures = process_line(line)
-            ts_helix.append(count_helices(structures))
-            ts_all.append(count_all(structures))
-    helices = np.array(ts_helix, dtype=np.uint)
-    totals = np.array(ts_all, dtype=np.uint)
+def encode_structures(data):
+    """Return the ``(frames, residues)`` uint8 code matrix of STRIDE data.
+
+    ``data`` holds the bytes of a STRIDE file, one frame per line with
+    whitespace-separated structure letters. Blank lines are skipped.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if not len(buf):
+        return np.zeros((0, 0), dtype=np.uint8)
+    codes = _encode_single_spaced(buf)
+    if codes is not None:
+        return codes
+    is_space = buf <= ord(' ')
+    newlines = buf == ord('\n')
+    starts = np.flatnonzero(
+        ~is_space & np.concatenate(([True], is_space[:-1])))
+    if not len(starts):
+        return np.zeros((0, 0), dtype=np.uint8)
+    counts = np.bincount(np.cumsum(newlines)[starts])
+    counts = counts[counts > 0]
+    n_residues = counts[0]
+    if (counts != n_residues).any():
+        raise ValueError('STRIDE frames have different residue counts')
+    return CODE_TABLE[buf[starts]].reshape(len(counts), n_residues)
+
+
+def _encode_single_spaced(buf):
+    """Encode the usual layout of single letters separated by one space.
+
+    Every line then has the same length, so the letters are a strided
+    view of the buffer. Returns None for any other layout.
+    """
+    line_length = int(np.argmax(buf == ord('\n'))) + 1
+    if line_length % 2 or len(buf) % line_length:
+        return None
+    lines = buf.reshape(-1, line_length)
+    if not ((lines[:, 1:-1:2] == ord(' ')).all()
+            and (lines[:, -1] == ord('\n')).all()
+            and (lines[:, 0:-1:2] > ord(' ')).all()):
+        return None
+    return CODE_TABLE[lines[:, 0:-1:2]]
+
+
+def parse_frames(text):
+    """Return a frame slice from ``START:STOP[:STEP]`` text."""
+    fields = text.split(':')
+    if not 2 <= len(fields) <= 3:
+        raise ValueError(f'Invalid frame range: {text!r}')
+    return slice(*(int(field) if field else None for field in fields))
+
+
+def read_structure_codes(file_path, frames=None):
+    """Return the structure code matrix of a STRIDE file or shards.
+
+    ``frames`` selects a frame slice. Shards, see `mdsim.shards`, only
+    read the frames selected.
+    """
+    frames = slice(None) if frames is None else frames
+    if is_sharded(file_path):
+        return open_shards(file_path)[frames]
+    with open(file_path, 'rb') as f:
+        return encode_structures(f.read())[frames]
+
+
+def structure_histogram(codes):
+    """Return the ``(frames, N_CODES)`` structure counts of each frame."""
+    n_frames = len(codes)
+    frame_offsets = np.arange(n_frames)[:, np.newaxis] * N_CODES
+    counts = np.bincount(
+        (frame_offsets + codes).ravel(), minlength=n_frames * N_CODES)
+    return counts.reshape(n_frames, N_CODES)
+
+
+def count_structure_codes(codes):
+    """Return helix and total structure counts per frame."""
+    histogram = structure_histogram(codes)
+    helices = histogram[:, HELIX_CODES].sum(axis=1).astype(np.uint)
+    totals = histogram.sum(axis=1).astype(np.uint)
+    return (helices, totals)
+
+
+def process_file(file_path, frames=None):
+    helices, totals = count_structure_codes(
+        read_structure_codes(file_path, frames))
     return (helices, totals, helices / totals)
 
 
-def process_files(file_paths):
+def map_files(function, file_paths, jobs=1):
+    """Apply a function to every file, on a process pool if jobs > 1."""
+    if jobs == 1 or len(file_paths) <= 1:
+        return [function(fpath) for fpath in file_paths]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(function, file_paths))
+
+
+def _stack(arrays, ragged):
+    """Return arrays as one RaggedArray, or a matrix if not ragged.
+
+    Rows are copied once into a preallocated buffer, and the matrix is a
+    view of that buffer.
+    """
+    result = RaggedArray.from_arrays(arrays)
+    return result if ragged else result.to_array()
+
+
+def process_files(file_paths, jobs=1, ragged=False, frames=None):
+    """Return helix counts, totals and fractions of STRIDE files.
+
+    With ``ragged`` the results are RaggedArrays, so trajectories may
+    have different frame counts; otherwise they are matrices.
+    ``frames`` selects the same frame slice of every file.
+    """
     assert len(file_paths) > 0, 'No files given'
 
-    helices = []
-    totals = []
-    helices_pcts = []
-    for fpath in file_paths:
-        ts_helix, ts_all, ts_pcts = process_file(fpath)
-        helices.append(ts_helix)
-        totals.append(ts_all)
-        helices_pcts.append(ts_pcts)
-    return (np.vstack(helices), np.vstack(totals), np.vstack(helices_pcts))
+    results = map_files(partial(process_file, frames=frames), file_paths,
+                        jobs)
+    helices, totals, helices_pcts = zip(*results)
+    return tuple(
+        _stack(arrays, ragged) for arrays in (helices, totals, helices_pcts))
 
 
 def process_contact_line(line):
@@ -69,13 +188,28 @@ def process_contact_file(file_path):
     return ts_contacts
 
 
-def process_contact_files(file_paths):
+def read_contact_counts(file_path, frames=None):
+    """Return the contact count matrix of an ibuContacts file or shards."""
+    frames = slice(None) if frames is None else frames
+    if is_sharded(file_path):
+        return open_shards(file_path)[frames].astype(np.uint, copy=False)
+    return np.array(process_contact_file(file_path), dtype=np.uint)[frames]
+
+
+def process_contact_files(file_paths, ragged=False, frames=None):
+    """Return contact counts of ibuContacts files.
+
+    With ``ragged`` the result is a RaggedArray, so trajectories may
+    have different frame counts; otherwise it is an
+    ``(n_files, n_frames, n_residues)`` array. ``frames`` selects the
+    same frame slice of every file.
+    """
     assert len(file_paths) > 0, 'No files given'
 
-    contact_vecs = []
-    for fpath in file_paths:
-        contact_vecs.append(process_contact_file(fpath))
-    return np.array(contact_vecs, dtype=np.uint)
+    contact_vecs = [
+        read_contact_counts(fpath, frames) for fpath in file_paths
+    ]
+    return _stack(contact_vecs, ragged)
 
 
 def mean_residue_contact_frequency(contacts):
@@ -83,8 +217,8 @@ def mean_residue_contact_frequency(contacts):
 
 
 def total_mean_residue_contact_frequency(contacts):
-    x = np.array([mean_residue_contact_frequency(c) for c in contacts])
-    return x.mean(axis=0)
+    """Return the mean over trajectories of per-trajectory frequencies."""
+    return as_ragged(contacts).mean(axis=1).mean(axis=0)
 
 
 def split_contact_timeline(x, t_h):
@@ -105,33 +239,105 @@ def split_helix_timeline(x, t_h=None):
 
 
 def split_helix_timeline_all(xs, t_h=None):
-    timeline_pairs = [split_helix_timeline(x, t_h) for x in xs]
+    """Split every trajectory at ``t_h``, by default its own t_h.
+
+    ``t_h`` can also be an array with one time per trajectory.
+    """
+    if t_h is None:
+        t_h = helix_denature_times(xs)
+    t_hs = np.broadcast_to(t_h, (len(xs),))
+    timeline_pairs = [split_helix_timeline(x, t) for (x, t) in zip(xs, t_hs)]
     xs_initial = [pair[0] for pair in timeline_pairs]
     xs_final = [pair[1] for pair in timeline_pairs]
     return (xs_initial, xs_final)
 
 
 def group_sum(matrix, cols):
+    """Sum the rows in cols frame-wise.
+
+    For a RaggedArray, frames only sum over the rows that reach them.
+    """
     return matrix[cols].sum(axis=0)
 
 
 def group_mean(matrix, cols):
+    """Average the rows in cols frame-wise, like `group_sum`."""
     return matrix[cols].mean(axis=0)
 
 
+def group_labels(group_configs, n_trajectories):
+    """Return the index of every trajectory's group, or -1 for none."""
+    labels = np.full(n_trajectories, -1, dtype=np.int64)
+    for (i, group_config) in enumerate(group_configs):
+        labels[group_config['cols']] = i
+    return labels
+
+
+def grouped_mean(values, labels, n_groups=None):
+    """Average the values of the trajectories of every group at once.
+
+    ``values`` has one row per trajectory, and further axes, like
+    residues, are averaged separately. Empty groups give NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    labels = np.asarray(labels, dtype=np.int64)
+    if n_groups is None:
+        n_groups = int(labels.max(initial=-1)) + 1
+    member = labels >= 0
+    rows = values[member].reshape(member.sum(), -1)
+    sums = np.zeros((n_groups, rows.shape[1]))
+    np.add.at(sums, labels[member], rows)
+    counts = np.bincount(labels[member], minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts[:, np.newaxis]
+    return means.reshape((n_groups,) + values.shape[1:])
+
+
+def split_means(xs, t_h):
+    """Return the mean of every row before and from its ``t_h``.
+
+    ``t_h`` is one time or one per row. Rows without frames on a side
+    give NaN there. Both sides of all rows are summed in one pass.
+    """
+    xs = as_ragged(xs)
+    starts = xs.offsets[:-1]
+    split = starts + np.minimum(
+        np.broadcast_to(t_h, (len(xs),)).astype(np.int64), xs.lengths)
+    # Segments alternate between the initial and final frames of a row.
+    bounds = np.column_stack((starts, split)).ravel()
+    sizes = np.diff(np.append(bounds, len(xs.data)))
+    sums = np.zeros((len(bounds),) + xs.data.shape[1:])
+    filled = sizes > 0
+    if filled.any():
+        sums[filled] = np.add.reduceat(
+            xs.data.astype(np.float64, copy=False), bounds[filled], axis=0)
+    shape = sizes.shape + (1,) * (xs.data.ndim - 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / sizes.reshape(shape)
+    return (means[0::2], means[1::2])
+
+
 def aggregate_group(helices, totals, cols):
     return np.vstack((group_sum(helices, cols), group_sum(totals, cols)))
 
 
 def stats(ts_arrays):
+    """Return the helix fraction timeline of a group and its statistics.
+
+    ``y_sem`` is the standard error of ``y_mean`` allowing for the
+    correlation of frames, see `mdsim.statistics`.
+    """
     helices, totals = ts_arrays
+    y = helices / totals
     return {
-        'y': helices / totals,
-        'y_mean': (helices / totals).mean(),
+        'y': y,
+        'y_mean': y.mean(),
         'var': helices.var(),
         'helix_count': helices.sum(),
         'structure_count': totals.sum(),
-        'steps': len(totals)
+        'steps': len(totals),
+        'y_sem': float(standard_error(y)),
+        'statistical_inefficiency': float(statistical_inefficiency(y)),
     }
 
 
@@ -143,6 +349,54 @@ def get_parser():
             'help': 'The configuration file',
             'required': True
         },
+        '--jobs': {
+            'dest': 'jobs',
+            'help': 'The number of worker processes for files and plots',
+            'type': int,
+            'default': os.cpu_count(),
+        },
+        '--frames': {
+            'dest': 'frames',
+            'help': 'Only analyze frames START:STOP[:STEP]',
+            'type': parse_frames,
+        },
+        '--no-plot': {
+            'dest': 'plot',
+            'help': 'Only print the statistics, draw no figures',
+            'action': 'store_false',
+        },
+        '--trim-equilibration': {
+            'dest': 'trim_equilibration',
+            'help': ('Drop the frames before each trajectory\'s detected '
+                     'equilibration'),
+            'action': 'store_true',
+        },
+        '--no-cache': {
+            'dest': 'cache',
+            'help': 'Do not use or write the analysis cache',
+            'action': 'store_false',
+        },
+        '--clear-cache': {
+            'dest': 'clear_cache',
+            'help': 'Empty the analysis cache first',
+            'action': 'store_true',
+        },
+        '--cache-dir': {
+            'dest': 'cache_dir',
+            'help': ('The analysis cache directory (default: '
+                     f'{CACHE_DIR} next to the config file)'),
+        },
+        '--cache-size': {
+            'dest': 'cache_size',
+            'help': 'The most MB to keep in the analysis cache',
+            'type': float,
+            'default': DEFAULT_MAX_BYTES / 2**20,
+        },
+        '--hash': {
+            'dest': 'content_hash',
+            'help': 'Key the cache by content hash instead of mtime',
+            'action': 'store_true',
+        },
     }
     for (arg, arg_opts) in arg_map.items():
         parser.add_argument(arg, **arg_opts)
@@ -178,19 +432,44 @@ def apply_transforms(stats):
 
 
 def smooth(x, window_size=100):
-    window_size = min(window_size, len(x) // 2)
-    return savgol_filter(x, window_size, 1)
+    return smooth_all(np.asarray(x)[np.newaxis], window_size)[0]
     # return window_transform(x, window_size)
 
 
+def smooth_all(xs, window_size=100):
+    """Smooth every trajectory with a linear Savitzky-Golay filter.
+
+    The window is at most half a trajectory long. All trajectories of
+    the same length are filtered in one call.
+    """
+    if isinstance(xs, RaggedArray):
+        result = RaggedArray(
+            np.empty(xs.data.shape, dtype=np.float64), xs.offsets)
+        for (rows, matrix) in length_groups(xs):
+            smoothed = _smooth_matrix(matrix, window_size)
+            for (row, y) in zip(rows, smoothed):
+                result[row][:] = y
+        return result
+    return _smooth_matrix(np.asarray(xs), window_size)
+
+
+def _smooth_matrix(matrix, window_size):
+    window_size = min(window_size, matrix.shape[1] // 2)
+    if window_size < 2:
+        return matrix.astype(np.float64)
+    from scipy.signal import savgol_filter
+    return savgol_filter(matrix, window_size, 1, axis=1)
+
+
 def save_plot(fig, output_file):
-    fig.savefig(output_file)
+    save_figure(fig, output_file)
     print('Saved plot:', output_file)
 
 
 def make_plot(title, group_stats, output_file):
     nrows = len(group_stats)
-    fig, axs = plt.subplots(nrows, sharey=True)
+    fig, axs = pyplot().subplots(nrows, sharey=True, squeeze=False)
+    axs = axs[:, 0]
     for (ax, (name, st)) in zip(axs, group_stats.items()):
         st = apply_transforms(st)
         y = st['y']
@@ -205,7 +484,7 @@ def make_plot(title, group_stats, output_file):
 
 
 def plot_average_helix_all(helices_pcts, output_file):
-    fig, ax = plt.subplots()
+    fig, ax = pyplot().subplots()
     y = smooth(helices_pcts.mean(axis=0))
     ax.plot(y)
     y_mean = y.mean()
@@ -218,21 +497,47 @@ def plot_average_helix_all(helices_pcts, output_file):
 
 
 def helix_denature_time(helix_content, helix_fraction=0.4):
-    result = 0
-    for t, content in enumerate(smooth(helix_content)):
-        if content > 0.4:
-            result = t
+    """Return the last time the smoothed helix content is above a fraction.
+
+    Returns 0 if it never is.
+    """
+    return int(helix_denature_times(
+        np.asarray(helix_content)[np.newaxis], helix_fraction)[0])
+
+
+def last_crossings(smoothed, helix_fraction=0.4):
+    """Return the last index above ``helix_fraction`` of every row, or 0."""
+    result = np.zeros(len(smoothed), dtype=np.int64)
+    for (rows, matrix) in length_groups(smoothed):
+        if not matrix.shape[1]:
+            continue
+        above = matrix[:, ::-1] > helix_fraction
+        last = matrix.shape[1] - 1 - np.argmax(above, axis=1)
+        result[rows] = np.where(above.any(axis=1), last, 0)
     return result
 
 
-def plot_trajectory_helix_content(experiment, trajectory, y_raw, output_file):
+def helix_denature_times(helix_contents, helix_fraction=0.4):
+    """Return `helix_denature_time` of every trajectory."""
+    return last_crossings(smooth_all(helix_contents), helix_fraction)
+
+
+def plot_trajectory_helix_content(experiment, trajectory, y_raw, output_file,
+                                  y_smooth=None, t_denatured=None):
+    """Plot smoothed and raw helix content of one trajectory.
+
+    Pass ``y_smooth`` and ``t_denatured`` to reuse values computed for
+    all trajectories at once.
+    """
     ncols = 2
-    y_smooth = smooth(y_raw)
+    if y_smooth is None:
+        y_smooth = smooth(y_raw)
     y_mean = y_raw.mean()
-    t_denatured = helix_denature_time(y_raw)
+    if t_denatured is None:
+        t_denatured = last_crossings(y_smooth[np.newaxis])[0]
     helix_mean = y_raw[:t_denatured].mean()
     denatured_mean = y_raw[t_denatured:].mean()
-    fig, (ax1, ax2) = plt.subplots(nrows=2)
+    fig, (ax1, ax2) = pyplot().subplots(nrows=2)
     ax1.plot(y_smooth, lw=1)
     ax1.set_ylabel(f"$<H_{{{trajectory}}}(t)>$")
     ax2.plot(y_raw, lw=1)
@@ -247,87 +552,167 @@ def plot_trajectory_helix_content(experiment, trajectory, y_raw, output_file):
     save_plot(fig, output_file)
 
 
-def plot_contacts(y_all, y_initial, y_final):
-    fig, ax = plt.subplots()
+def _plot_contacts(ax, y_all, y_initial, y_final):
     x = list(range(1, len(y_all) + 1))
     ys = (y_all, y_initial, y_final)
     labels = ('$<C_{all}>$', '$<C_{initial}>$', '$<C_{final}>$')
     for (y, label) in zip(ys, labels):
         ax.plot(x, y, marker='o', lw=1, label=label)
     ax.set_ylabel('<C(i)>')
-    ax.set_xlabel('i')
     ax.legend()
+
+
+def plot_contacts(y_all, y_initial, y_final):
+    fig, ax = pyplot().subplots()
+    _plot_contacts(ax, y_all, y_initial, y_final)
+    ax.set_xlabel('i')
     return fig
 
 
-def analyze_contacts(config, t_h):
-    contact_file_paths = canonicalize_file_paths(
-        config['config_path'],
-        config['ibuContact_files'],
-    )
-    output_dir_path = Path(config['output_dir'])
-    output_file = output_dir_path / 'contacts.png'
-    title = 'Average Ibuprofin Contacts'
-    contacts = process_contact_files(contact_file_paths)
-    contacts_initial, contacts_final = split_contact_timeline_all(contacts, t_h)
-    y_all = total_mean_residue_contact_frequency(contacts)
-    y_initial = total_mean_residue_contact_frequency(contacts_initial)
-    y_final = total_mean_residue_contact_frequency(contacts_final)
-    fig = plot_contacts(y_all, y_initial, y_final)
-    fig.suptitle(title)
-    save_plot(fig, output_file)
+def plot_group_contacts(group_contacts):
+    """Plot the contact frequencies of every group in its own row."""
+    fig, axs = pyplot().subplots(
+        len(group_contacts), sharex=True, sharey=True, squeeze=False)
+    for (ax, (name, ys)) in zip(axs[:, 0], group_contacts.items()):
+        _plot_contacts(ax, *ys)
+        ax.set_title(name)
+    axs[-1, 0].set_xlabel('i')
+    return fig
 
 
-def plot_t_h(t_h_data):
-    fig, ax = plt.subplots()
-    labels = ['$t_{h,ibu}$', '$t_{h,water}$']
-    data = [t_h_data['ibu_t_h'], t_h_data['water_t_h']]
+def contact_sources(config):
+    """Return the contact files of a config and their trajectory columns.
+
+    A group lists the contact files of its trajectories, in the order of
+    its ``cols``, as ``contact_files``. The top level ``ibuContact_files``
+    belong to the ``ibu`` group.
+    """
+    file_paths = []
+    cols = []
+    for group_config in config['groups']:
+        names = group_config.get('contact_files')
+        if names is None and group_config['name'] == 'ibu':
+            names = config.get('ibuContact_files')
+        if not names:
+            continue
+        file_paths.extend(
+            canonicalize_file_paths(config['config_path'], names))
+        cols.extend(group_config['cols'][:len(names)])
+    return (file_paths, np.array(cols, dtype=np.int64))
+
+
+def analyze_contacts(config, group_t_h, frames=None, plot=True,
+                     starts=None, cache=None):
+    """Return and plot contact frequencies of all, initial and final frames.
+
+    Every contact file is split at the mean ``t_h`` of its group, from
+    ``group_t_h``, and the frequencies of the files are averaged per
+    group. ``starts`` are the first frames to keep of every trajectory.
+    The parsed files are kept in ``cache``, a `mdsim.cache.Cache`, if
+    given. Returns ``{group name: (y_all, y_initial, y_final)}`` for the
+    groups with contact files.
+    """
+    contact_file_paths, cols = contact_sources(config)
+    if not contact_file_paths:
+        return {}
+    group_configs = config['groups']
+    n_groups = len(group_configs)
+    labels = group_labels(group_configs, len(config['stride_files']))[cols]
+    output_dir_path = Path(config['output_dir'])
+    output_file = output_dir_path / 'contacts.png'
+    title = 'Average ligand contacts'
+    contacts = cached(
+        cache, 'contact-files', contact_file_paths, {'frames': frames},
+        lambda: {'contacts': process_contact_files(
+            contact_file_paths, ragged=True, frames=frames)},
+    )['contacts']
+    if starts is not None:
+        contacts = trim(contacts, starts[cols])
+    t_h = np.asarray(group_t_h)[labels].astype(np.int64)
+    means_initial, means_final = split_means(contacts, t_h)
+    ys = [grouped_mean(means, labels, n_groups) for means in (
+        as_ragged(contacts).mean(axis=1), means_initial, means_final)]
+    group_contacts = dict(
+        (group_configs[i]['name'], tuple(y[i] for y in ys))
+        for i in np.unique(labels))
+    if plot:
+        fig = plot_group_contacts(group_contacts)
+        fig.suptitle(title)
+        save_plot(fig, output_file)
+    return group_contacts
+
+
+def group_title(group_configs):
+    """Return the group names for figure titles, like ``ibu and water``."""
+    names = [group_config['name'] for group_config in group_configs]
+    if len(names) <= 2:
+        return ' and '.join(names)
+    return ', '.join(names[:-1]) + f' and {names[-1]}'
+
+
+def plot_t_h(t_h_data, group_configs):
+    fig, ax = pyplot().subplots()
+    names = [group_config['name'] for group_config in group_configs]
+    labels = [f'$t_{{h,{name}}}$' for name in names]
+    data = [t_h_data[f'{name}_t_h'] for name in names]
     ax.boxplot(data, labels=labels)
     ax.set_ylabel('t')
-    fig.suptitle('Helix dissolution time of Ibuprofen and Water systems')
+    fig.suptitle(
+        f'Helix dissolution time of {group_title(group_configs)} systems')
     return fig
 
 
 def calculate_t_h(group_configs, helices_pcts):
+    """Return helix dissolution times of all trajectories and groups.
+
+    The smoothed helix content is kept as ``y_smooth`` for plotting.
+    """
     result = {}
-    result['t_h'] = t_h = np.array([
-        helix_denature_time(x) for x in helices_pcts
-    ])
+    result['y_smooth'] = y_smooth = smooth_all(helices_pcts)
+    result['t_h'] = t_h = last_crossings(y_smooth)
     result['t_h_mean'] = t_h.mean()
-    for group_config in group_configs:
+    labels = group_labels(group_configs, len(t_h))
+    result['group_t_h_mean'] = group_t_h_mean = grouped_mean(
+        t_h, labels, len(group_configs))
+    for (i, group_config) in enumerate(group_configs):
         name = group_config['name']
-        cols = group_config['cols']
-        trajectories = group_config['trajectories']
-        result[f'{name}_t_h'] = t_h[cols]
-        result[f'{name}_t_h_mean'] = group_mean(t_h, cols)
+        result[f'{name}_t_h'] = t_h[group_config['cols']]
+        result[f'{name}_t_h_mean'] = group_t_h_mean[i]
     return result
 
 
-def helix_timeline_means(helices_pcts):
-    ys_initial, ys_final = split_helix_timeline_all(helices_pcts)
-    ys_initial = [y.mean() for y in ys_initial]
-    ys_final = [y.mean() for y in ys_final]
-    return (ys_initial, ys_final)
+def helix_timeline_means(helices_pcts, t_h=None):
+    """Return the mean helix content of every trajectory around ``t_h``.
 
+    By default every trajectory is split at its own t_h. A trajectory
+    whose helix never dissolves has no initial frames and gives NaN.
+    """
+    if t_h is None:
+        t_h = helix_denature_times(helices_pcts)
+    ys_initial, ys_final = split_means(helices_pcts, t_h)
+    return (ys_initial.tolist(), ys_final.tolist())
 
-def analyze_helix_timelines(config, helices_pcts):
+
+def analyze_helix_timelines(config, helices_pcts, t_h=None, plot=True):
+    """Return and plot mean helix content before and after ``t_h``."""
     output_dir_path = Path(config['output_dir'])
     output_file = output_dir_path / 't_h_batch_compare.png'
-    ibu_config, water_config = config['groups']
-    ibu_cols = ibu_config['cols']
-    water_cols = water_config['cols']
-    labels = ['Ibu', 'Water']
+    group_configs = config['groups']
+    labels = [group_config['name'].capitalize()
+              for group_config in group_configs]
 
-    y1, y2 = helix_timeline_means(helices_pcts)
+    y1, y2 = helix_timeline_means(helices_pcts, t_h)
     y1 = np.array(y1)
     y2 = np.array(y2)
-    fig, (ax1, ax2) = plt.subplots(ncols=2, sharex=True, sharey=True)
+    if not plot:
+        return (y1, y2)
+    fig, (ax1, ax2) = pyplot().subplots(ncols=2, sharex=True, sharey=True)
 
-    data1 = [y1[ibu_cols], y1[water_cols]]
+    data1 = [y1[group_config['cols']] for group_config in group_configs]
     ax1.boxplot(data1, labels=labels)
     ax1.set_ylabel('$<H_{initial}>$')
 
-    data2 = [y2[ibu_cols], y2[water_cols]]
+    data2 = [y2[group_config['cols']] for group_config in group_configs]
     ax2.boxplot(data2, labels=labels)
     ax2.set_ylabel('$<H_{final}>$')
 
@@ -336,11 +721,15 @@ def analyze_helix_timelines(config, helices_pcts):
         '$t_{h,m}$'
     )
     save_plot(fig, output_file)
+    return (y1, y2)
 
 
-def main():
+def main(argv=None):
     parser = get_parser()
-    args = parser.parse_args()
+    if argv is not None:
+        args = parser.parse_args(argv[1:])
+    else:
+        args = parser.parse_args()
     config = load_config(args.config)
 
     stride_file_paths = canonicalize_file_paths(
@@ -352,37 +741,104 @@ def main():
     output_dir_path = Path(config['output_dir'])
     output_dir_path.mkdir(parents=True, exist_ok=True)
 
+    cache = None
+    if args.cache or args.clear_cache:
+        (cache_dir,) = canonicalize_file_paths(
+            args.config, [args.cache_dir or CACHE_DIR])
+        cache = Cache(cache_dir, int(args.cache_size * 2**20),
+                      args.content_hash)
+        if args.clear_cache:
+            cache.clear()
+            print(f'Cleared cache: {cache_dir}')
+        if not args.cache:
+            cache = None
+
+    def cached_stride(name, params, function):
+        return cached(cache, name, stride_file_paths,
+                      dict(params, frames=args.frames), function)
+
+    def read_stride():
+        arrays = process_files(
+            stride_file_paths, args.jobs, ragged=True, frames=args.frames)
+        return dict(zip(('helices', 'totals', 'helices_pcts'), arrays))
+
     group_configs = config['groups']
-    helices, totals, helices_pcts = process_files(stride_file_paths)
-    t_h_data = calculate_t_h(group_configs, helices_pcts)
+    group_names = [group_config['name'] for group_config in group_configs]
+    stride_data = cached_stride('stride-files', {}, read_stride)
+    helices, totals, helices_pcts = (
+        stride_data[name] for name in ('helices', 'totals', 'helices_pcts'))
+    starts = None
+    if args.trim_equilibration:
+        # Frames then count from each trajectory's equilibrated start.
+        starts = cached_stride('equilibration', {}, lambda: {
+            'starts': detect_equilibration(helices_pcts)[0]})['starts']
+        print(f'Equilibrated from frames: {starts}')
+        helices, totals, helices_pcts = (
+            trim(xs, starts) for xs in (helices, totals, helices_pcts))
+    labels = group_labels(group_configs, len(helices_pcts))
+    t_h_data = cached_stride(
+        't_h', {'groups': group_configs,
+                'trim_equilibration': args.trim_equilibration},
+        lambda: calculate_t_h(group_configs, helices_pcts))
     t_h_mean = t_h_data['t_h_mean']
     print(t_h_data['t_h'])
     print(f'Average t_h: {t_h_mean:.3f} ps')
-    fig = plot_t_h(t_h_data)
-    save_plot(fig, output_dir_path / 't_h.png')
+    if args.plot:
+        fig = plot_t_h(t_h_data, group_configs)
+        save_plot(fig, output_dir_path / 't_h.png')
 
+    # The figures below are independent and rendered on the pool.
+    tasks = []
+    trajectory_means = helices_pcts.mean(axis=1)
     for group_config in group_configs:
         group_name = group_config['name']
         cols = group_config['cols']
         trajectories = group_config['trajectories']
         group_t_h_mean = t_h_data[f'{group_name}_t_h_mean']
         print(f'{group_name} t_h average: {group_t_h_mean:.3f} ps')
+        # Trajectories are independent samples, unlike their frames.
+        mean, low, high = bootstrap_mean(trajectory_means[cols], seed=0)
+        print(f'{group_name} helix content: {mean:.3f} '
+              f'(95% CI {low:.3f} to {high:.3f})')
         for (col, trajectory) in zip(cols, trajectories):
             file_name = f'stride-{group_name}-{trajectory}.png'
             output_file_path = output_dir_path / file_name
-            plot_trajectory_helix_content(
-                group_name, trajectory, helices_pcts[col], output_file_path)
-
-    groups = dict(
-        (conf['name'], aggregate_group(helices, totals, conf['cols']))
-        for conf in group_configs
-    )
-    group_stats = dict((name, stats(data)) for (name, data) in groups.items())
-    title = 'Average helix structure (%) of IBU and Water systems'
-    make_plot(title, group_stats, output_dir_path / 'stride-groups.png')
-    plot_average_helix_all(helices_pcts, output_dir_path / 'stride-all.png')
-
-    analyze_helix_timelines(config, helices_pcts)
-
-    ibu_t_h = int(t_h_data['ibu_t_h_mean'])
-    analyze_contacts(config, ibu_t_h)
+            tasks.append((plot_trajectory_helix_content, (
+                group_name, trajectory, helices_pcts[col], output_file_path,
+                t_h_data['y_smooth'][col], t_h_data['t_h'][col])))
+
+    if args.plot:
+        helix_sums, counts = group_frame_sums(
+            helices, labels, len(group_configs))
+        total_sums, _ = group_frame_sums(totals, labels, len(group_configs))
+        # Each group only runs to the frames its trajectories reach.
+        group_stats = dict(
+            (name, stats(np.vstack((helix_sums[i], total_sums[i]))
+                         [:, counts[i] > 0]))
+            for (i, name) in enumerate(group_names))
+        title = ('Average helix structure (%) of '
+                 f'{group_title(group_configs)} systems')
+        tasks.append((make_plot, (
+            title, group_stats, output_dir_path / 'stride-groups.png')))
+        tasks.append((plot_average_helix_all, (
+            helices_pcts, output_dir_path / 'stride-all.png')))
+        render(tasks, args.jobs)
+
+    y_initial, y_final = analyze_helix_timelines(
+        config, helices_pcts, t_h_data['t_h'], args.plot)
+    if not args.plot:
+        group_initial, group_final = (
+            grouped_mean(y, labels, len(group_configs))
+            for y in (y_initial, y_final))
+        for (i, name) in enumerate(group_names):
+            print(f'{name} helix content before/after t_h: '
+                  f'{group_initial[i]:.3f} / {group_final[i]:.3f}')
+
+    group_t_h = [t_h_data[f'{name}_t_h_mean'] for name in group_names]
+    group_contacts = analyze_contacts(
+        config, group_t_h, args.frames, args.plot, starts, cache)
+    if not args.plot:
+        for (name, ys) in group_contacts.items():
+            for (label, y) in zip(('all', 'initial', 'final'), ys):
+                print(f'{name} contact frequency ({label}): '
+                      + np.array2string(y, precision=3))
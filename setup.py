@@ -7,11 +7,19 @@ mdsim-cell-size=mdsim.find_cell_size:main
 mdsim-check-coords=mdsim.check_coordinates:main
 mdsim-batch-config=mdsim.batch:main
 mdsim-stride-stats=mdsim.stride:main
+mdsim-contacts=mdsim.contacts:main
+mdsim-monitor=mdsim.monitor:main
+mdsim-sstructure=mdsim.sstructure:main
+mdsim-bench=mdsim.bench.suite:main
+mdsim-check-charge=mdsim.check_charge:main
+mdsim-analyze=mdsim.analyze:main
+mdsim-run=mdsim.run:main
+mdsim-perf=mdsim.perf:main
 """
 
 package_data = {
     'mdsim.defaults': ['*.yaml'],
-    'test.mdsim': ['*.dat'],
+    'test.mdsim': ['*.dat', '*.out'],
 }
 
 setup(
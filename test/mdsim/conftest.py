@@ -1,5 +1,6 @@
 from pathlib import Path
 
+import numpy as np
 import pytest
 
 
@@ -24,3 +25,62 @@ def contact_file_paths():
         'ibuContacts2.dat',
     ]
     return [test_dir / name for name in file_names]
+
+
+@pytest.fixture(autouse=True)
+def sim_files_dir():
+    return test_dir.parent.parent / 'ansible' / 'files'
+
+
+@pytest.fixture(autouse=True)
+def namd_log_paths():
+    file_names = [
+        'abf_quench00.out',
+        'abf_quench01.out',
+    ]
+    return [test_dir / name for name in file_names]
+
+
+def _place_atom(a, b, c, length, angle, torsion):
+    """Place an atom bonded to c from internal coordinates (NeRF)."""
+    angle = np.radians(angle)
+    torsion = np.radians(torsion)
+    bc = (c - b) / np.linalg.norm(c - b)
+    n = np.cross(b - a, bc)
+    n /= np.linalg.norm(n)
+    m = np.column_stack((bc, np.cross(n, bc), n))
+    d = length * np.array([
+        -np.cos(angle),
+        np.sin(angle) * np.cos(torsion),
+        np.sin(angle) * np.sin(torsion),
+    ])
+    return c + m @ d
+
+
+def build_backbone(phis, psis):
+    """Return N, CA, C, O and H positions of a chain with given torsions."""
+    atoms = {name: [] for name in ('N', 'CA', 'C', 'O', 'H')}
+    n = np.array([0.0, 1.458, 0.0])
+    ca = np.array([0.0, 0.0, 0.0])
+    c = _place_atom(np.array([1.0, 1.0, 0.0]), n, ca, 1.525, 111.2, -60.0)
+    for (i, (phi, psi)) in enumerate(zip(phis, psis)):
+        if i > 0:
+            prev_n, prev_ca, prev_c = n, ca, c
+            n = _place_atom(prev_n, prev_ca, prev_c, 1.329, 116.2, prev_psi)
+            ca = _place_atom(prev_ca, prev_c, n, 1.458, 121.7, 180.0)
+            c = _place_atom(prev_c, n, ca, 1.525, 111.2, phi)
+            bisector = (n - prev_c) / np.linalg.norm(n - prev_c)
+            bisector += (n - ca) / np.linalg.norm(n - ca)
+            h = n + bisector / np.linalg.norm(bisector)
+        else:
+            h = n + np.array([0.0, 1.0, 0.0])
+        o = _place_atom(n, ca, c, 1.231, 120.5, psi + 180.0)
+        for (name, xyz) in zip(atoms, (n, ca, c, o, h)):
+            atoms[name].append(xyz)
+        prev_psi = psi
+    return dict((name, np.array(xyz)) for (name, xyz) in atoms.items())
+
+
+@pytest.fixture(autouse=True)
+def backbone_builder():
+    return build_backbone